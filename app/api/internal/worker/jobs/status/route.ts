@@ -0,0 +1,71 @@
+import { NextResponse } from "next/server";
+import { requireWorkerSecret } from "@/lib/worker-auth";
+import { getSupabaseAdmin } from "@/lib/supabase-admin";
+
+/**
+ * GET ?ids=a,b,c: Which of the given job ids are still pending for this worker.
+ * Read-only (no lease, no heartbeat): the worker calls it between jobs of one
+ * poll to drop jobs that were cancelled, dispatched elsewhere or leased to
+ * another worker while the previous job ran.
+ * Protected by WORKER_SECRET.
+ */
+export async function GET(request: Request) {
+  if (!requireWorkerSecret(request)) {
+    return NextResponse.json({ error: "Unauthorized" }, { status: 401 });
+  }
+
+  const url = new URL(request.url);
+  const ids = (url.searchParams.get("ids") ?? "")
+    .split(",")
+    .map((id) => id.trim())
+    .filter(Boolean)
+    .slice(0, 100);
+  if (ids.length === 0) {
+    return NextResponse.json({ training_job_ids: [], generation_job_ids: [] });
+  }
+  const workerId = request.headers.get("x-worker-id")?.trim() || "";
+  const admin = getSupabaseAdmin();
+
+  const [trainingRes, generationRes] = await Promise.all([
+    admin
+      .from("training_jobs")
+      .select("id")
+      .in("id", ids)
+      .eq("status", "pending")
+      .is("runpod_job_id", null),
+    admin
+      .from("generation_jobs")
+      .select("id, lease_owner, lease_until")
+      .in("id", ids)
+      .eq("status", "pending")
+      .is("runpod_job_id", null),
+  ]);
+  if (trainingRes.error || generationRes.error) {
+    return NextResponse.json(
+      { error: (trainingRes.error ?? generationRes.error)?.message },
+      { status: 500 }
+    );
+  }
+
+  // A generation job is still ours while we hold the lease, or once the lease
+  // has lapsed without another worker taking it.
+  const now = Date.now();
+  const generation = (generationRes.data ?? []) as Array<{
+    id: string;
+    lease_owner: string | null;
+    lease_until: string | null;
+  }>;
+  const generationIds = generation
+    .filter(
+      (row) =>
+        row.lease_owner === workerId ||
+        !row.lease_until ||
+        new Date(row.lease_until).getTime() < now
+    )
+    .map((row) => row.id);
+
+  return NextResponse.json({
+    training_job_ids: (trainingRes.data ?? []).map((row: { id: string }) => row.id),
+    generation_job_ids: generationIds,
+  });
+}
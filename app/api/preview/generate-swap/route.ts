@@ -39,6 +39,14 @@ const SCENE_PROMPTS = {
     "photorealistic, editorial photography, real photograph",
 };
 
+// Extension for a worker-reported content_type (worker/encode.py FORMATS)
+const RESULT_EXTENSIONS: Record<string, string> = {
+  "image/jpeg": ".jpg",
+  "image/webp": ".webp",
+  "image/avif": ".avif",
+  "image/png": ".png",
+};
+
 interface SwapResult {
   targetIdx: number;
   targetUrl: string;
@@ -147,6 +155,10 @@ export async function POST(req: NextRequest) {
     const t2 = Date.now();
 
     const runpodUrl = `https://api.runpod.ai/v2/${endpointId}/runsync`;
+    // The worker uploads the result straight to this path and returns only
+    // output_path + metadata; image_base64 comes back if its upload fails.
+    const resultStoragePath = `preview-generate-swap/${crypto.randomUUID()}.jpg`;
+
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), 180_000);
 
@@ -161,6 +173,7 @@ export async function POST(req: NextRequest) {
           type: "faceswap",
           user_photo_urls: faceSignedUrls,
           scenario_image_url: sceneSignedUrl,
+          output_path: resultStoragePath,
         },
       }),
       signal: controller.signal,
@@ -182,10 +195,14 @@ export async function POST(req: NextRequest) {
     }
 
     let imageBase64: string | null = null;
+    let imageContentType: string | null = null;
+    let uploadedPath: string | null = null;
 
     if (swapResult.status === "COMPLETED") {
       const output = swapResult.output as Record<string, unknown> | undefined;
+      uploadedPath = (output?.output_path as string) || null;
       imageBase64 = (output?.image_base64 as string) || null;
+      imageContentType = (output?.content_type as string) || null;
     } else if (swapResult.status === "FAILED") {
       console.error(`[gen_swap:${rid}] Face swap failed: ${swapResult.error}`);
       return fail((swapResult.error as string) || "Face swap failed");
@@ -193,40 +210,48 @@ export async function POST(req: NextRequest) {
       console.log(`[gen_swap:${rid}] Job ${swapResult.id} queued, polling...`);
       const pollResult = await pollRunPodJob(endpointId, swapResult.id as string, 180_000);
       if (pollResult.status === "COMPLETED") {
+        uploadedPath = pollResult.output?.output_path || null;
         imageBase64 = pollResult.output?.image_base64 || null;
+        imageContentType = pollResult.output?.content_type || null;
       } else {
         console.error(`[gen_swap:${rid}] Poll: ${pollResult.status} — ${pollResult.error}`);
         return fail(pollResult.error || "Face swap timed out");
       }
     }
 
-    if (!imageBase64) {
+    if (!uploadedPath && !imageBase64) {
       return fail("No output from face swap");
     }
 
     const step2Ms = Date.now() - t2;
     console.log(`[gen_swap:${rid}] Step 2 done (${(step2Ms / 1000).toFixed(1)}s)`);
 
-    // Upload final result to Supabase
-    const resultBuffer = Buffer.from(imageBase64, "base64");
-    const resultStoragePath = `preview-generate-swap/${crypto.randomUUID()}.jpg`;
-
-    const { error: resultUploadError } = await admin.storage
-      .from("uploads")
-      .upload(resultStoragePath, resultBuffer, { contentType: "image/jpeg", upsert: true });
-
-    if (resultUploadError) {
-      console.error(`[gen_swap:${rid}] Result upload failed: ${resultUploadError.message}`);
-      return fail("Result upload failed");
+    // Upload final result to Supabase unless the worker already wrote it,
+    // typed (and named) after the format the worker encoded
+    if (!uploadedPath && imageBase64) {
+      const contentType = imageContentType || "image/jpeg";
+      const ext = RESULT_EXTENSIONS[contentType] ?? ".jpg";
+      uploadedPath = resultStoragePath.replace(/\.jpg$/, ext);
+      const resultBuffer = Buffer.from(imageBase64, "base64");
+      const { error: resultUploadError } = await admin.storage
+        .from("uploads")
+        .upload(uploadedPath, resultBuffer, { contentType, upsert: true });
+
+      if (resultUploadError) {
+        console.error(`[gen_swap:${rid}] Result upload failed: ${resultUploadError.message}`);
+        return fail("Result upload failed");
+      }
     }
 
+    // The extension follows the worker's output format (either upload path)
+    const finalStoragePath = uploadedPath || resultStoragePath;
     const { data: resultSignedData } = await admin.storage
       .from("uploads")
-      .createSignedUrl(resultStoragePath, 3600);
+      .createSignedUrl(finalStoragePath, 3600);
 
     const swappedUrl =
       resultSignedData?.signedUrl ||
-      `${process.env.NEXT_PUBLIC_SUPABASE_URL}/storage/v1/object/public/uploads/${resultStoragePath}`;
+      `${process.env.NEXT_PUBLIC_SUPABASE_URL}/storage/v1/object/public/uploads/${finalStoragePath}`;
 
     const totalMs = Date.now() - t0;
     console.log(`[gen_swap:${rid}] Done — ${(totalMs / 1000).toFixed(1)}s total (scene: ${(step1Ms / 1000).toFixed(1)}s, swap: ${(step2Ms / 1000).toFixed(1)}s)`);
@@ -7,11 +7,10 @@ Only billed while processing jobs (no idle costs).
 
 import os
 import sys
-import tempfile
 import time
 import traceback
 import runpod
-from face_swap import do_face_swap, warmup
+from face_swap import do_face_swap, do_face_swap_batch, job_object_path, job_swap_options, warmup
 
 
 def _run_training(input_data, job_id):
@@ -22,6 +21,7 @@ def _run_training(input_data, job_id):
     # import cost when a training job actually arrives.
     import requests  # already in requirements-gpu.txt via facefusionlib
     from storage import download_many_from_uploads, upload_to_uploads
+    from scratch import job_scratch
     from train_lora import train_and_save
 
     training_job_id = input_data.get("job_id")
@@ -38,11 +38,9 @@ def _run_training(input_data, job_id):
     print(f"[worker:{job_id}] TRAINING: job_id={training_job_id} subject={subject_id} "
           f"photos={len(sample_paths)} steps={max_train_steps} batch={batch_size}", flush=True)
 
-    with tempfile.TemporaryDirectory(prefix="ot_train_") as tmp_root:
-        instance_dir = os.path.join(tmp_root, "instance")
-        output_dir = os.path.join(tmp_root, "out")
-        os.makedirs(instance_dir, exist_ok=True)
-        os.makedirs(output_dir, exist_ok=True)
+    with job_scratch("ot_train_") as scratch:
+        instance_dir = scratch.dir("instance", size_hint=len(sample_paths) * 8 * 1024 * 1024)
+        output_dir = scratch.dir("out", size_hint=256 * 1024 * 1024)
 
         # Download photos from Supabase uploads bucket
         downloaded = download_many_from_uploads(sample_paths, instance_dir)
@@ -129,17 +127,91 @@ def handler(job):
             if not user_photo_urls or not scenario_image_url:
                 print(f"[worker:{job_id}] FAILED: missing URLs", flush=True)
                 return {"error": "Missing user_photo_urls or scenario_image_url"}
+            try:
+                swap_opts = job_swap_options(input_data, "output_path")
+            except ValueError as e:
+                print(f"[worker:{job_id}] FAILED: {e}", flush=True)
+                return {"error": f"Invalid job input: {e}"}
 
             print(f"[worker:{job_id}] Starting face swap ({len(user_photo_urls)} source(s))...", flush=True)
-            result_b64 = do_face_swap(user_photo_urls, scenario_image_url)
+            stats = {}
+            # output_path: uploads-bucket object to write the result to; the
+            # response then carries the path instead of image_base64.
+            payload = do_face_swap(user_photo_urls, scenario_image_url, stats, **swap_opts)
             elapsed = round(time.time() - start, 2)
 
-            if not result_b64:
+            if not payload:
                 print(f"[worker:{job_id}] FAILED: do_face_swap returned None after {elapsed}s", flush=True)
-                return {"error": "Face swap processing failed"}
+                return {"error": "Face swap processing failed", "stats": stats}
+
+            where = payload.get("output_path") or f"{len(payload['image_base64'])} chars base64"
+            print(f"[worker:{job_id}] COMPLETED in {elapsed}s: {where}", flush=True)
+            return {**payload, "stats": stats}
+
+        if job_type == "faceswap_batch":
+            # One identity onto a scenario pack: identity computed once,
+            # swap inference batched across scenarios.
+            user_photo_urls = input_data.get("user_photo_urls") or []
+            if not user_photo_urls and input_data.get("user_photo_url"):
+                user_photo_urls = [input_data["user_photo_url"]]
+            scenario_image_urls = input_data.get("scenario_image_urls") or []
+
+            if not user_photo_urls or not scenario_image_urls:
+                print(f"[worker:{job_id}] FAILED: missing URLs", flush=True)
+                return {"error": "Missing user_photo_urls or scenario_image_urls"}
+            try:
+                swap_opts = job_swap_options(input_data, "output_prefix")
+            except ValueError as e:
+                print(f"[worker:{job_id}] FAILED: {e}", flush=True)
+                return {"error": f"Invalid job input: {e}"}
+
+            print(f"[worker:{job_id}] Starting batch face swap ({len(user_photo_urls)} source(s), "
+                  f"{len(scenario_image_urls)} scenario(s))...", flush=True)
+            payloads, stats = do_face_swap_batch(user_photo_urls, scenario_image_urls, **swap_opts)
+            elapsed = round(time.time() - start, 2)
+
+            if not any(payloads):
+                print(f"[worker:{job_id}] FAILED: batch face swap produced no images after {elapsed}s", flush=True)
+                return {"error": "Face swap processing failed", "stats": stats}
+
+            print(f"[worker:{job_id}] COMPLETED in {elapsed}s: "
+                  f"{stats.get('succeeded', 0)}/{len(scenario_image_urls)} images", flush=True)
+            if swap_opts["output_prefix"]:
+                return {"outputs": payloads, "stats": stats}
+            return {"images_base64": [p and p.get("image_base64") for p in payloads], "stats": stats}
+
+        if job_type == "faceswap_video":
+            # One identity onto every frame of a clip; the result is uploaded
+            # to output_path (videos are too large for a base64 response).
+            from video_swap import do_video_swap
+
+            user_photo_urls = input_data.get("user_photo_urls") or []
+            if not user_photo_urls and input_data.get("user_photo_url"):
+                user_photo_urls = [input_data["user_photo_url"]]
+            video_url = input_data.get("video_url")
+            output_path = input_data.get("output_path")
+
+            if not user_photo_urls or not video_url or not output_path:
+                print(f"[worker:{job_id}] FAILED: missing video fields", flush=True)
+                return {"error": "Missing user_photo_urls, video_url or output_path"}
+            try:
+                output_path = job_object_path(input_data, "output_path")
+            except ValueError as e:
+                print(f"[worker:{job_id}] FAILED: {e}", flush=True)
+                return {"error": f"Invalid job input: {e}"}
+
+            print(f"[worker:{job_id}] Starting video face swap ({len(user_photo_urls)} source(s))...", flush=True)
+            stats = {}
+            payload = do_video_swap(user_photo_urls, video_url, output_path, stats)
+            elapsed = round(time.time() - start, 2)
+
+            if not payload:
+                print(f"[worker:{job_id}] FAILED: video face swap failed after {elapsed}s", flush=True)
+                return {"error": "Video face swap failed", "stats": stats}
 
-            print(f"[worker:{job_id}] COMPLETED in {elapsed}s: {len(result_b64)} chars base64", flush=True)
-            return {"image_base64": result_b64}
+            print(f"[worker:{job_id}] COMPLETED in {elapsed}s: {stats.get('frames', 0)} frames "
+                  f"→ {payload['output_path']}", flush=True)
+            return {**payload, "stats": stats}
 
         if job_type == "training":
             result = _run_training(input_data, job_id)
@@ -184,8 +256,9 @@ def handler(job):
                 "job_type": input_data.get("job_type") or "user",
                 "lead_id": input_data.get("lead_id"),
             }
-            # Forward cheap-mode overrides if present
-            for cheap_key in ("cheap_mode", "width", "height", "num_inference_steps", "guidance_scale", "skip_face_swap"):
+            # Forward cheap-mode, swap-profile and output-encoding overrides if present
+            for cheap_key in ("cheap_mode", "width", "height", "num_inference_steps", "guidance_scale", "skip_face_swap",
+                              "swap_profile", "output_format", "output_quality", "target_kb", "target_ssim"):
                 if cheap_key in input_data:
                     gen_job_dict[cheap_key] = input_data[cheap_key]
 
@@ -227,8 +300,9 @@ if __name__ == "__main__":
     try:
         print(f"[worker] Starting RunPod Serverless. Python={sys.version}", flush=True)
 
-        # Preload models at startup
-        warmup()
+        # Preload models at startup; returns once the critical tier is loaded
+        status = warmup()
+        print(f"[worker] warmup: {status}", flush=True)
 
         # Log dependency versions
         try:
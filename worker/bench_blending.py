@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Blend engines (face_swap.BLEND_MODES): latency plus a visual-diff harness.
+
+    python worker/bench_blending.py --images ./scenes --out-dir /tmp/blend_diff
+
+Each target gets the same swapped frame (real swap with --swap, otherwise a
+color-shifted face region) composited once per mode. Reports per-mode p50/p95
+and PSNR / mean abs diff against the poisson output over the face ROI. With
+--out-dir, writes for every image a strip  target | poisson | laplacian | alpha
+and a strip of x8-amplified diff heatmaps against poisson, cropped to the face.
+"""
+
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+import face_swap
+from bench_compositing import _fake_swap
+from bench_utils import emit, load_images, peak_rss_mb, summarize, timed
+
+REFERENCE = "poisson"
+
+
+def _psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = float(np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2))
+    return 99.0 if mse == 0 else round(10 * np.log10(255.0 ** 2 / mse), 2)
+
+
+def _heatmap(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    diff = np.abs(a.astype(np.int16) - b).max(axis=2)
+    return cv2.applyColorMap(np.clip(diff * 8, 0, 255).astype(np.uint8), cv2.COLORMAP_INFERNO)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark face_swap blend modes")
+    ap.add_argument("--images", required=True, help="Folder of target scenes with one face")
+    ap.add_argument("--modes", default=",".join(face_swap.BLEND_MODES))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--swap", action="store_true", help="Use the real swap model for the swapped frame")
+    ap.add_argument("--out-dir", default=None, help="Write side-by-side and diff strips here")
+    ap.add_argument("--json-out", default=None)
+    args = ap.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    if REFERENCE not in modes:
+        modes.insert(0, REFERENCE)
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    face_swap._log = lambda _msg: None
+    rng = np.random.default_rng(0)
+    timings = {m: [] for m in modes}
+    quality = {m: {"psnr": [], "mad": []} for m in modes if m != REFERENCE}
+    used = 0
+
+    for name, target in load_images(args.images, args.limit):
+        faces = face_swap._detect_faces(target, "landmarks")
+        if not faces:
+            print(f"[bench] {name}: no face — skipped", file=sys.stderr)
+            continue
+        face = face_swap._largest_face(faces)
+        if args.swap:
+            kind, model = face_swap._get_swapper()
+            source = face_swap._SyntheticFace(rng.standard_normal(512).astype(np.float32))
+            swapped = face_swap._run_swap(kind, model, target, face, source)
+            if swapped is None:
+                continue
+        else:
+            swapped = _fake_swap(target, face)
+        used += 1
+
+        outputs = {}
+        for mode in modes:
+            for _ in range(args.repeat):
+                with timed(timings[mode]):
+                    outputs[mode] = face_swap._composite(target, face, swapped, blend_mode=mode)
+
+        x1, y1, x2, y2 = face_swap._composite_roi(face, target.shape, face_swap.COMPOSITE_PAD)
+        crops = {m: img[y1:y2, x1:x2] for m, img in outputs.items()}
+        ref = crops[REFERENCE]
+        for mode in quality:
+            quality[mode]["psnr"].append(_psnr(crops[mode], ref))
+            quality[mode]["mad"].append(float(np.abs(crops[mode].astype(np.int16) - ref).mean()))
+
+        if args.out_dir:
+            stem = os.path.splitext(name)[0]
+            strip = np.hstack([target[y1:y2, x1:x2]] + [crops[m] for m in modes])
+            diffs = np.hstack([_heatmap(crops[m], ref) for m in modes if m != REFERENCE])
+            cv2.imwrite(os.path.join(args.out_dir, f"{stem}_modes.png"), strip)
+            cv2.imwrite(os.path.join(args.out_dir, f"{stem}_diff.png"), diffs)
+
+    emit({
+        "images": used,
+        "repeat": args.repeat,
+        "reference": REFERENCE,
+        "modes": {
+            m: {
+                **summarize(timings[m]),
+                **({
+                    "psnr_vs_reference": round(float(np.mean(quality[m]["psnr"])), 2) if quality[m]["psnr"] else None,
+                    "mean_abs_diff": round(float(np.mean(quality[m]["mad"])), 3) if quality[m]["mad"] else None,
+                } if m in quality else {}),
+            }
+            for m in modes
+        },
+        "out_dir": args.out_dir,
+        "peak_rss_mb": peak_rss_mb(),
+    }, args.json_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Post-swap compositing: ROI-bounded vs full-frame.
+
+    python worker/bench_compositing.py --images ./scenes --repeat 5
+
+For every image with a detectable face, times the HyperSwap paste-back and the
+mask → LAB → seamlessClone chain both ways (roi=True / roi=False) and reports
+p50/p95 per stage plus the largest pixel difference between the two outputs.
+The "swapped" frame is the target with a shifted, blurred face region (or the
+real swap with --swap), so no swap model is needed for the default run.
+"""
+
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+import face_swap
+from bench_utils import emit, load_images, peak_rss_mb, summarize, timed
+
+
+def _fake_swap(target: np.ndarray, face) -> np.ndarray:
+    out = target.copy()
+    x1, y1, x2, y2 = face.bbox.astype(int)
+    x1, y1 = max(0, x1), max(0, y1)
+    region = out[y1:y2, x1:x2]
+    region[:] = cv2.GaussianBlur(cv2.add(region, (12, 6, -8, 0)), (5, 5), 0)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark ROI-bounded compositing")
+    ap.add_argument("--images", required=True, help="Folder of target scenes with one face")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--swap", action="store_true", help="Use the real swap model for the swapped frame")
+    ap.add_argument("--json-out", default=None)
+    args = ap.parse_args()
+
+    face_swap._log = lambda _msg: None
+    rng = np.random.default_rng(0)
+    timings = {k: [] for k in ("paste_roi", "paste_full", "composite_roi", "composite_full")}
+    max_diff = {"paste": 0, "composite": 0}
+    used = 0
+
+    for name, target in load_images(args.images, args.limit):
+        faces = face_swap._detect_faces(target, "landmarks")
+        if not faces:
+            print(f"[bench] {name}: no face — skipped", file=sys.stderr)
+            continue
+        face = face_swap._largest_face(faces)
+        aligned = face_swap._swap_align("hyperswap", target, face)
+        if aligned is None:
+            continue
+        _blob, M = aligned
+        pred = rng.integers(0, 255, (256, 256, 3), dtype=np.uint8)
+        if args.swap:
+            kind, model = face_swap._get_swapper()
+            source = face_swap._SyntheticFace(rng.standard_normal(512).astype(np.float32))
+            swapped = face_swap._run_swap(kind, model, target, face, source)
+            if swapped is None:
+                continue
+        else:
+            swapped = _fake_swap(target, face)
+        used += 1
+
+        for _ in range(args.repeat):
+            with timed(timings["paste_roi"]):
+                a = face_swap._swap_paste(target, pred, M, roi=True)
+            with timed(timings["paste_full"]):
+                b = face_swap._swap_paste(target, pred, M, roi=False)
+            with timed(timings["composite_roi"]):
+                c = face_swap._composite(target, face, swapped, roi=True)
+            with timed(timings["composite_full"]):
+                d = face_swap._composite(target, face, swapped, roi=False)
+        max_diff["paste"] = max(max_diff["paste"], int(np.abs(a.astype(np.int16) - b).max()))
+        max_diff["composite"] = max(max_diff["composite"], int(np.abs(c.astype(np.int16) - d).max()))
+
+    stages = {k: summarize(v) for k, v in timings.items()}
+    speedup = {
+        stage: round(stages[f"{stage}_full"]["p50_ms"] / max(stages[f"{stage}_roi"]["p50_ms"], 1e-6), 2)
+        for stage in ("paste", "composite")
+    }
+    emit({
+        "images": used,
+        "repeat": args.repeat,
+        "stages": stages,
+        "speedup_p50": speedup,
+        "max_pixel_diff": max_diff,
+        "peak_rss_mb": peak_rss_mb(),
+    }, args.json_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Detection latency vs recall for fixed and adaptive det sizes.
+
+    python worker/bench_detection.py --faces ./faces --count 200
+
+Builds a synthetic set by pasting seed face photos (one face each) onto large
+noisy/gradient canvases at random positions and scales, so ground-truth boxes
+are known. Each strategy (fixed 320, fixed 640, adaptive FACE_SWAP_DET_SIZES)
+runs over the same set; a ground-truth face counts as recalled when a detection
+overlaps it with IoU >= --iou.
+"""
+
+import argparse
+import random
+import sys
+
+import cv2
+import numpy as np
+
+import face_swap
+from bench_utils import emit, load_images, peak_rss_mb, summarize, timed
+
+
+def _iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _background(rng: random.Random, h: int, w: int) -> np.ndarray:
+    if rng.random() < 0.5:
+        seed = rng.randrange(1 << 30)
+        return np.random.default_rng(seed).integers(0, 255, (h, w, 3), dtype=np.uint8)
+    c0 = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    c1 = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    t = np.linspace(0.0, 1.0, h, dtype=np.float32)[:, None, None]
+    return np.broadcast_to(c0 * (1 - t) + c1 * t, (h, w, 3)).astype(np.uint8)
+
+
+def build_set(seeds, count: int, sizes: list[int], rng: random.Random):
+    """[(image, gt_box)] with one pasted face per image."""
+    app = face_swap._get_face_app("detect")
+    crops = []
+    for name, img in seeds:
+        faces = app.get(img)
+        if not faces:
+            print(f"[bench] seed {name}: no face — skipped", file=sys.stderr)
+            continue
+        f = face_swap._largest_face(faces)
+        x1, y1, x2, y2 = f.bbox
+        # Keep the face plus context so its box inside the crop is known
+        pad = 0.6 * max(x2 - x1, y2 - y1)
+        cx1, cy1 = int(max(0, x1 - pad)), int(max(0, y1 - pad))
+        cx2, cy2 = int(min(img.shape[1], x2 + pad)), int(min(img.shape[0], y2 + pad))
+        crops.append((img[cy1:cy2, cx1:cx2], (x1 - cx1, y1 - cy1, x2 - cx1, y2 - cy1)))
+    if not crops:
+        raise SystemExit("no usable seed faces")
+
+    samples = []
+    for _ in range(count):
+        crop, box = rng.choice(crops)
+        side = rng.choice(sizes)
+        h, w = side, int(side * rng.uniform(0.66, 1.5))
+        canvas = _background(rng, h, w).copy()
+        face_frac = rng.uniform(0.04, 0.45)  # face width as a fraction of the canvas
+        s = face_frac * w / max(1.0, box[2] - box[0])
+        ch, cw = crop.shape[:2]
+        nh, nw = max(1, int(ch * s)), max(1, int(cw * s))
+        if nh >= h or nw >= w:
+            s = min((h - 1) / ch, (w - 1) / cw)
+            nh, nw = max(1, int(ch * s)), max(1, int(cw * s))
+        interp = cv2.INTER_AREA if s < 1 else cv2.INTER_CUBIC
+        resized = cv2.resize(crop, (nw, nh), interpolation=interp)
+        ox, oy = rng.randrange(0, w - nw + 1), rng.randrange(0, h - nh + 1)
+        canvas[oy:oy + nh, ox:ox + nw] = resized
+        gt = (ox + box[0] * s, oy + box[1] * s, ox + box[2] * s, oy + box[3] * s)
+        samples.append((canvas, gt))
+    return samples
+
+
+def run_strategy(samples, sizes: list[int], iou_min: float) -> dict:
+    times: list[float] = []
+    hits = 0
+    stats: dict = {}
+    for img, gt in samples:
+        with timed(times):
+            faces = face_swap._detect_faces(img, "detect", stats, sizes=sizes)
+        if any(_iou(f.bbox, gt) >= iou_min for f in faces):
+            hits += 1
+    det = stats.get("detection", {"passes": 0, "sizes": []})
+    return {
+        "sizes": sizes,
+        "recall": round(hits / len(samples), 4),
+        "mean_passes": round(det["passes"] / len(samples), 3),
+        **summarize(times),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark adaptive detection resolution")
+    ap.add_argument("--faces", required=True, help="Folder of seed photos, one clear face each")
+    ap.add_argument("--count", type=int, default=200)
+    ap.add_argument("--canvas", default="1024,2048,3072", help="Canvas heights to sample")
+    ap.add_argument("--iou", type=float, default=0.3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json-out", default=None)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    seeds = load_images(args.faces)
+    samples = build_set(seeds, args.count, [int(s) for s in args.canvas.split(",")], rng)
+
+    strategies = {
+        "fixed_320": [320],
+        "fixed_640": [640],
+        "adaptive": face_swap.DET_SIZES,
+    }
+    face_swap._detect_faces(samples[0][0], "detect")  # warm the session
+    result = {
+        "samples": len(samples),
+        "retry_score": face_swap.DET_RETRY_SCORE,
+        "strategies": {name: run_strategy(samples, sizes, args.iou) for name, sizes in strategies.items()},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    emit(result, args.json_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Output encoding: time, bytes and SSIM per format and mode.
+
+    python worker/bench_encode.py --images ./outputs --formats jpeg,webp,avif --target-kb 400 --target-ssim 0.97
+
+For every format, encodes each image at the default quality and (when given)
+with the size / SSIM targets, reporting p50/p95 encode time, mean bytes, bits
+per pixel and SSIM against the source. A final pass times encode_batch() with
+ENCODE_WORKERS threads against a single thread on the whole set.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import encode
+from bench_utils import emit, load_images, peak_rss_mb, summarize
+
+
+def run_mode(images, fmt: str, **kwargs) -> dict:
+    times, sizes, bpp, scores = [], [], [], []
+    for _name, img in images:
+        enc = encode.encode(img, fmt, **kwargs)
+        times.append(enc.seconds)
+        sizes.append(len(enc.data))
+        bpp.append(len(enc.data) * 8 / (enc.width * enc.height))
+        score = enc.ssim
+        if score is None:
+            score = encode._decoded_ssim(encode._luma_small(img), enc.data, img.shape)
+        scores.append(score)
+    return {
+        "format": enc.format,  # avif → webp when no AVIF writer is available
+        "mean_kb": round(float(np.mean(sizes)) / 1024, 1),
+        "bits_per_pixel": round(float(np.mean(bpp)), 3),
+        "ssim_mean": round(float(np.mean(scores)), 4),
+        "ssim_min": round(float(np.min(scores)), 4),
+        **summarize(times),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark output encoders")
+    ap.add_argument("--images", required=True, help="Folder of pipeline outputs")
+    ap.add_argument("--formats", default="jpeg,webp,avif,png")
+    ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--target-kb", type=float, default=None)
+    ap.add_argument("--target-ssim", type=float, default=None)
+    ap.add_argument("--workers", type=int, default=encode.ENCODE_WORKERS)
+    ap.add_argument("--json-out", default=None)
+    args = ap.parse_args()
+
+    images = load_images(args.images, args.limit)
+    formats = [encode.normalize_format(f) for f in args.formats.split(",") if f.strip()]
+    result = {"images": len(images), "avif_backend": encode._get_avif_backend(), "formats": {}}
+
+    for fmt in formats:
+        modes = {"default": run_mode(images, fmt)}
+        if fmt != "png":
+            if args.target_kb:
+                modes[f"target_kb_{args.target_kb:g}"] = run_mode(images, fmt, target_kb=args.target_kb)
+            if args.target_ssim:
+                modes[f"target_ssim_{args.target_ssim:g}"] = run_mode(images, fmt, target_ssim=args.target_ssim)
+        result["formats"][fmt] = modes
+
+    batch = [img for _name, img in images]
+    result["batch"] = {}
+    for fmt in formats:
+        t0 = time.perf_counter()
+        encode.encode_batch(batch, workers=1, fmt=fmt)
+        serial = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        encode.encode_batch(batch, workers=args.workers, fmt=fmt)
+        threaded = time.perf_counter() - t0
+        result["batch"][fmt] = {
+            "workers": args.workers,
+            "serial_sec": round(serial, 3),
+            "threaded_sec": round(threaded, 3),
+            "speedup": round(serial / max(threaded, 1e-9), 2),
+        }
+    result["peak_rss_mb"] = peak_rss_mb()
+    emit(result, args.json_out)
+
+
+if __name__ == "__main__":
+    main()
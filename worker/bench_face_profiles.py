@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Per-profile FaceAnalysis latency (face_swap.FACE_PROFILES).
+
+    python worker/bench_face_profiles.py --images ./faces --repeat 5
+
+Loads each profile once, runs one untimed warm-up get(), then times get() over
+every image. Reports p50/p95 per profile plus the face count each returned, so a
+profile that silently loses detections shows up next to its speedup.
+"""
+
+import argparse
+import time
+
+from bench_utils import emit, load_images, peak_rss_mb, summarize, timed
+from face_swap import FACE_PROFILES, _get_face_app
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark FaceAnalysis profiles")
+    ap.add_argument("--images", required=True, help="Folder of test images")
+    ap.add_argument("--profiles", default=",".join(FACE_PROFILES), help="Comma-separated profile names")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--limit", type=int, default=0, help="Max images (0 = all)")
+    ap.add_argument("--json-out", default=None)
+    args = ap.parse_args()
+
+    images = load_images(args.images, args.limit)
+    result = {"images": len(images), "repeat": args.repeat, "profiles": {}}
+
+    for profile in [p.strip() for p in args.profiles.split(",") if p.strip()]:
+        t0 = time.perf_counter()
+        app = _get_face_app(profile)
+        load_sec = time.perf_counter() - t0
+        app.get(images[0][1])
+
+        times: list[float] = []
+        faces = 0
+        for _ in range(args.repeat):
+            for _name, img in images:
+                with timed(times):
+                    found = app.get(img)
+                faces += len(found)
+
+        result["profiles"][profile] = {
+            "modules": sorted(app.models),
+            "load_sec": round(load_sec, 2),
+            "faces_per_image": round(faces / (len(images) * args.repeat), 3),
+            **summarize(times),
+        }
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    emit(result, args.json_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Stage-by-stage face_swap pipeline benchmark.
+
+    python worker/bench_face_swap.py --models stub --resolutions 512,1024,2048 --faces-per-image 1,2,4
+    python worker/bench_face_swap.py --models real --faces ./faces --json-out run.json
+    python worker/bench_face_swap.py --models stub --compare run.json --max-regress-pct 15
+
+Runs the stages swap_faces chains (detect → align → swap → paste → composite →
+restore → upscale) on synthetic scenes for every resolution x face-count pair
+and reports per-stage p50/p95, images/sec and peak RSS.
+
+  stub  deterministic stand-ins for every model: faces are drawn at known
+        positions (detection reads the ground truth), the swap and restore
+        sessions are cheap numpy transforms, upscaling is the Lanczos fallback.
+        Times the non-model work; needs nothing beyond cv2/numpy.
+  real  the loaded insightface / HyperSwap / restorer / Real-ESRGAN models,
+        on scenes built by pasting faces cropped from --faces photos.
+
+--compare reads an earlier --json-out and adds per-stage p50 deltas; with
+--max-regress-pct the exit code is 1 when any stage slowed down by more.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import face_swap
+from bench_utils import emit, load_images, peak_rss_mb, summarize, timed
+
+STAGES = ("detect", "align", "swap", "paste", "composite", "restore", "upscale", "total")
+
+
+# ── Stub models ─────────────────────────────────────────────────────
+
+class _StubInput:
+    def __init__(self, name: str, shape: list):
+        self.name = name
+        self.shape = shape
+
+
+class _StubSwapSession:
+    """HyperSwap-shaped session: target crop mirrored and tinted by the source embedding."""
+
+    def get_inputs(self):
+        return [_StubInput("source", [None, 512]), _StubInput("target", [None, 3, 256, 256])]
+
+    def run(self, _names, feeds):
+        target = feeds["target"]
+        tint = np.tanh(feeds["source"][:, :3]).reshape(-1, 3, 1, 1) * 0.1
+        return [np.clip(target[..., ::-1] * 0.9 + tint, -1, 1).astype(np.float32)]
+
+
+class _StubRestoreSession:
+    """GFPGAN-shaped session (dynamic batch): 3x3 box filter on the normalized crop."""
+
+    def get_inputs(self):
+        return [_StubInput("input", [None, 3, 512, 512])]
+
+    def run(self, _names, feeds):
+        x = feeds["input"]
+        out = np.empty_like(x)
+        for i in range(x.shape[0]):
+            out[i] = cv2.blur(x[i].transpose(1, 2, 0), (3, 3)).transpose(2, 0, 1)
+        return [out]
+
+
+def install_stubs() -> None:
+    face_swap._get_swapper = lambda: ("hyperswap", _StubSwapSession())
+    face_swap._get_restorer = lambda: ("gfpgan_onnx", _StubRestoreSession(), None)
+    face_swap._get_upscaler = lambda: "none"
+
+
+class _StubFace:
+    """Ground-truth face: bbox, arcface-template kps and a 106-point contour."""
+
+    def __init__(self, x1: float, y1: float, x2: float, y2: float):
+        self.bbox = np.array([x1, y1, x2, y2], dtype=np.float32)
+        w, h = x2 - x1, y2 - y1
+        # _ARCFACE_TEMPLATE_128 spans roughly x 24..104, y 28..116 of the 128 crop
+        t = face_swap._ARCFACE_TEMPLATE_128
+        self.kps = np.stack([x1 + (t[:, 0] - 24) / 80 * w, y1 + (t[:, 1] - 28) / 88 * h], axis=1).astype(np.float32)
+        a = np.linspace(0, 2 * np.pi, 106, endpoint=False)
+        self.landmark_2d_106 = np.stack([(x1 + x2) / 2 + 0.45 * w * np.cos(a),
+                                         (y1 + y2) / 2 + 0.48 * h * np.sin(a)], axis=1).astype(np.float32)
+        self.landmark_3d_68 = None
+        self.det_score = 1.0
+
+
+# ── Scenes ──────────────────────────────────────────────────────────
+
+def _canvas(rng: random.Random, h: int, w: int) -> np.ndarray:
+    c0 = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    c1 = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    t = np.linspace(0.0, 1.0, h, dtype=np.float32)[:, None, None]
+    img = np.broadcast_to(c0 * (1 - t) + c1 * t, (h, w, 3)).astype(np.uint8).copy()
+    noise = np.random.default_rng(rng.randrange(1 << 30)).integers(-12, 12, (h, w, 3))
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def _slots(rng: random.Random, h: int, w: int, n: int) -> list[tuple[int, int, int]]:
+    """n non-overlapping (x, y, side) squares on an n-column grid."""
+    cols = int(np.ceil(np.sqrt(n)))
+    rows = int(np.ceil(n / cols))
+    cw, ch = w // cols, h // rows
+    side = int(min(cw, ch) * 0.7)
+    cells = rng.sample(range(cols * rows), n)
+    return [((c % cols) * cw + (cw - side) // 2, (c // cols) * ch + (ch - side) // 2, side) for c in cells]
+
+
+def _draw_face(img: np.ndarray, x: int, y: int, side: int) -> _StubFace:
+    cx, cy = x + side // 2, y + side // 2
+    cv2.ellipse(img, (cx, cy), (int(side * 0.45), int(side * 0.48)), 0, 0, 360, (120, 150, 200), -1)
+    face = _StubFace(x, y, x + side, y + side)
+    for px, py in face.kps[:2]:
+        cv2.circle(img, (int(px), int(py)), max(2, side // 20), (40, 30, 30), -1)
+    mx = face.kps[3:5, 0].astype(int)
+    cv2.line(img, (mx[0], int(face.kps[3, 1])), (mx[1], int(face.kps[4, 1])), (60, 40, 140), max(1, side // 40))
+    return face
+
+
+def _face_crops(folder: str) -> list[np.ndarray]:
+    crops = []
+    for name, img in load_images(folder):
+        faces = face_swap._detect_faces(img, "detect")
+        if not faces:
+            print(f"[bench] {name}: no face — skipped", file=sys.stderr)
+            continue
+        x1, y1, x2, y2 = face_swap._largest_face(faces).bbox
+        pad = 0.35 * max(x2 - x1, y2 - y1)
+        cx, cy, half = (x1 + x2) / 2, (y1 + y2) / 2, max(x2 - x1, y2 - y1) / 2 + pad
+        sx1, sy1 = int(max(0, cx - half)), int(max(0, cy - half))
+        sx2, sy2 = int(min(img.shape[1], cx + half)), int(min(img.shape[0], cy + half))
+        crops.append(img[sy1:sy2, sx1:sx2])
+    if not crops:
+        raise SystemExit("no usable face photos")
+    return crops
+
+
+def build_scene(rng: random.Random, res: int, n_faces: int, crops: list[np.ndarray] | None):
+    """(image, ground-truth faces) at res x res*4/3 with n_faces faces."""
+    h, w = res, res * 4 // 3
+    img = _canvas(rng, h, w)
+    faces = []
+    for x, y, side in _slots(rng, h, w, n_faces):
+        if crops is None:
+            faces.append(_draw_face(img, x, y, side))
+        else:
+            img[y:y + side, x:x + side] = cv2.resize(rng.choice(crops), (side, side), interpolation=cv2.INTER_AREA)
+    return img, faces
+
+
+# ── Pipeline ────────────────────────────────────────────────────────
+
+def run_pipeline(img: np.ndarray, gt_faces: list, source, stub: bool, times: dict) -> bool:
+    """One swap_faces pass over every face in img, each stage timed into times[stage]."""
+    t0 = time.perf_counter()
+    with timed(times["detect"]):
+        faces = gt_faces if stub else face_swap._detect_faces(img, "landmarks")
+    if not faces:
+        return False
+
+    kind, model = face_swap._get_swapper()
+    result = img
+    for face in faces:
+        with timed(times["align"]):
+            aligned = face_swap._swap_align(kind, result, face)
+        if aligned is None:
+            return False
+        blob, M = aligned
+        with timed(times["swap"]):
+            pred = face_swap._swap_infer(kind, model, source, blob[np.newaxis])[0]
+        with timed(times["paste"]):
+            swapped = face_swap._swap_paste(result, pred, M)
+        with timed(times["composite"]):
+            result = face_swap._composite(result, face, swapped)
+
+    with timed(times["restore"]):
+        result = face_swap._restore_faces([result], [faces], fidelity=0.75)[0]
+    with timed(times["upscale"]):
+        face_swap._upscale(result, outscale=2)
+    times["total"].append(time.perf_counter() - t0)
+    return True
+
+
+def compare(current: dict, previous: dict, max_regress_pct: float | None) -> tuple[dict, list[str]]:
+    deltas, regressions = {}, []
+    for cfg, run in current["configs"].items():
+        prev = previous.get("configs", {}).get(cfg)
+        if not prev:
+            continue
+        deltas[cfg] = {}
+        for stage, s in run["stages"].items():
+            before = prev["stages"].get(stage, {}).get("p50_ms")
+            if not before:
+                continue
+            pct = round((s["p50_ms"] - before) / before * 100, 1)
+            deltas[cfg][stage] = {"p50_ms_prev": before, "p50_ms": s["p50_ms"], "delta_pct": pct}
+            if max_regress_pct is not None and pct > max_regress_pct:
+                regressions.append(f"{cfg}/{stage}: {before} → {s['p50_ms']} ms ({pct:+.1f}%)")
+    return deltas, regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark face_swap stages")
+    ap.add_argument("--models", default="stub", choices=("stub", "real"))
+    ap.add_argument("--faces", default=None, help="Folder of face photos (required for --models real)")
+    ap.add_argument("--resolutions", default="512,1024,2048", help="Scene heights")
+    ap.add_argument("--faces-per-image", default="1,2,4")
+    ap.add_argument("--images", type=int, default=5, help="Scenes per resolution x face-count")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--compare", default=None, help="Earlier --json-out to diff against")
+    ap.add_argument("--max-regress-pct", type=float, default=None)
+    ap.add_argument("--verbose", action="store_true", help="Keep face_swap's per-stage logging")
+    ap.add_argument("--json-out", default=None)
+    args = ap.parse_args()
+
+    stub = args.models == "stub"
+    if not stub and not args.faces:
+        ap.error("--models real needs --faces")
+    if not args.verbose:
+        face_swap._log = lambda _msg: None
+
+    rng = random.Random(args.seed)
+    if stub:
+        install_stubs()
+        crops = None
+        source = face_swap._SyntheticFace(np.random.default_rng(args.seed).standard_normal(512).astype(np.float32))
+    else:
+        crops = _face_crops(args.faces)
+        source = face_swap._SyntheticFace(face_swap.average_embeddings(crops))
+        face_swap.warmup()
+        for fut in face_swap._warmup_futures.values():  # keep background loads out of the timed runs
+            fut.result()
+
+    result = {"models": args.models, "repeat": args.repeat, "blend_mode": face_swap.BLEND_MODE, "configs": {}}
+    for res in [int(r) for r in args.resolutions.split(",")]:
+        for n in [int(k) for k in args.faces_per_image.split(",")]:
+            scenes = [build_scene(rng, res, n, crops) for _ in range(args.images)]
+            run_pipeline(*scenes[0], source, stub, {s: [] for s in STAGES})  # untimed warm-up
+            times = {s: [] for s in STAGES}
+            failed = 0
+            for _ in range(args.repeat):
+                for img, gt in scenes:
+                    failed += not run_pipeline(img, gt, source, stub, times)
+            total = sum(times["total"])
+            result["configs"][f"{res}p_{n}f"] = {
+                "resolution": [res * 4 // 3, res],
+                "faces": n,
+                "runs": len(times["total"]),
+                "failed": failed,
+                "images_per_sec": round(len(times["total"]) / total, 3) if total > 0 else 0.0,
+                "stages": {s: summarize(v) for s, v in times.items() if v},
+            }
+    result["peak_rss_mb"] = peak_rss_mb()
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            result["compare"], regressions = compare(result, json.load(f), args.max_regress_pct)
+        result["regressions"] = regressions
+    emit(result, args.json_out)
+    if regressions:
+        print(f"[bench] {len(regressions)} stage(s) regressed beyond {args.max_regress_pct}%", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+fp32 vs INT8 model tiers on CPU: latency speedup and output agreement.
+
+    python worker/bench_quantized.py --faces ./eval_faces
+
+For every model kind whose fp32 file and <name>.int8.onnx variant are both
+found (face_swap's model dirs, or --model-dir), runs both on the CPU provider
+over the same aligned crops and reports p50 latency, speedup, PSNR of the
+int8 output against fp32 and, for swap models, ArcFace identity cosine.
+"""
+
+import argparse
+import os
+import sys
+
+import face_swap
+from bench_utils import emit, peak_rss_mb
+from ort_sessions import create_session
+from quantize_models import build_feeds, evaluate, load_faces
+
+_FILES = {
+    "hyperswap": "hyperswap_1c_256.onnx",
+    "inswapper": "inswapper_128.onnx",
+    "gfpgan": "gfpgan_1.4.onnx",
+}
+
+
+def _resolve(name: str, model_dir: str | None) -> str | None:
+    if model_dir:
+        p = os.path.join(model_dir, name)
+        return p if os.path.isfile(p) else None
+    return face_swap._find_model(name)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark INT8 model tiers against fp32")
+    ap.add_argument("--faces", required=True, help="Folder of face photos")
+    ap.add_argument("--kinds", default=",".join(_FILES))
+    ap.add_argument("--model-dir", default=None)
+    ap.add_argument("--limit", type=int, default=32)
+    ap.add_argument("--json-out", default=None)
+    args = ap.parse_args()
+
+    face_swap._log = lambda _msg: None
+    samples = load_faces(args.faces, args.limit)
+    cpu = ["CPUExecutionProvider"]
+    results = {}
+    for kind in [k.strip() for k in args.kinds.split(",") if k.strip()]:
+        fp32 = _resolve(_FILES[kind], args.model_dir)
+        int8 = _resolve(_FILES[kind].replace(".onnx", ".int8.onnx"), args.model_dir)
+        if not fp32 or not int8:
+            print(f"[bench] {kind}: fp32 or int8 model missing — skipped", file=sys.stderr)
+            continue
+        ref = create_session(fp32, cpu)
+        test = create_session(int8, cpu)
+        feeds = build_feeds(kind, fp32, ref, samples)
+        evaluate(kind, ref, test, feeds[:1])  # warm both sessions
+        results[kind] = {"fp32": fp32, "int8": int8, **evaluate(kind, ref, test, feeds)}
+
+    emit({"samples": len(samples), "models": results, "peak_rss_mb": peak_rss_mb()}, args.json_out)
+
+
+if __name__ == "__main__":
+    main()
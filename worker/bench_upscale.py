@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tiled Real-ESRGAN engine: latency and peak memory across image sizes.
+
+    python worker/bench_upscale.py --weights /app/models/RealESRGAN_x2plus.pth \
+        --sizes 512,1024,2048 --tiles 0,256,512,auto
+
+Each (size, tile) pair runs in a fresh spawned process so its peak RSS (and
+CUDA max_memory_allocated on GPU) is not polluted by earlier runs. tile=0 is
+the whole-image pass (the old RealESRGANer(tile=0) behaviour); "auto" derives
+the tile from UPSCALE_MEMORY_BUDGET_MB / free device memory.
+"""
+
+import argparse
+import multiprocessing as mp
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from bench_utils import emit, peak_rss_mb, summarize
+
+
+def _run_one(weights: str, size: int, tile: str, repeat: int, image: str | None, queue) -> None:
+    import torch
+    from upscaler import load_upscaler
+
+    try:
+        # tile=0 → a fixed tile larger than any input, i.e. one whole-image pass
+        kwargs = {} if tile == "auto" else {"tile": int(tile) or 10 ** 6}
+        up = load_upscaler(weights, **kwargs)
+        if image:
+            img = cv2.imread(image)
+            scale = size / max(img.shape[:2])
+            img = cv2.resize(img, (round(img.shape[1] * scale), round(img.shape[0] * scale)),
+                             interpolation=cv2.INTER_AREA)
+        else:
+            img = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 255, (size, size, 3), dtype=np.uint8),
+                                   (0, 0), 2)
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            up.enhance(img)
+            times.append(time.perf_counter() - t0)
+        result = {
+            "size": f"{img.shape[1]}x{img.shape[0]}",
+            "tile": tile,
+            "effective_tile": up.tile_size(*img.shape[:2]),
+            **summarize(times),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        if up.device.type == "cuda":
+            result["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / (1024 * 1024), 1)
+        queue.put(result)
+    except Exception as e:
+        queue.put({"size": size, "tile": tile, "error": str(e)})
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark tiled Real-ESRGAN upscaling")
+    ap.add_argument("--weights", required=True, help="RealESRGAN_x2plus.pth or x4plus.pth")
+    ap.add_argument("--sizes", default="512,1024,2048", help="Long-side input sizes")
+    ap.add_argument("--tiles", default="0,256,512,auto", help="Tile sides; 0 = whole image, auto = budget")
+    ap.add_argument("--image", default=None, help="Resize this image instead of synthetic noise")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json-out", default=None)
+    args = ap.parse_args()
+
+    ctx = mp.get_context("spawn")
+    runs = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for tile in [t.strip() for t in args.tiles.split(",") if t.strip()]:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_run_one, args=(args.weights, size, tile, args.repeat, args.image, queue))
+            proc.start()
+            proc.join()
+            runs.append(queue.get() if not queue.empty() else
+                        {"size": size, "tile": tile, "error": f"exit code {proc.exitcode}"})
+            print(f"[bench] {runs[-1]}", file=sys.stderr)
+
+    emit({"weights": args.weights, "repeat": args.repeat, "runs": runs}, args.json_out)
+
+
+if __name__ == "__main__":
+    main()
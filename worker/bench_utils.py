@@ -0,0 +1,77 @@
+"""
+Shared helpers for the worker's bench_*.py scripts.
+
+Each benchmark prints one JSON document to stdout (and optionally writes it with
+--json-out) so runs on different GPU hosts can be diffed directly.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import cv2
+import numpy as np
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return float(np.percentile(np.asarray(values, dtype=np.float64), q))
+
+
+def summarize(values_sec: list[float]) -> dict:
+    """p50/p95/mean/min/max in milliseconds."""
+    ms = [v * 1000.0 for v in values_sec]
+    return {
+        "n": len(ms),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "mean_ms": round(float(np.mean(ms)), 2) if ms else 0.0,
+        "min_ms": round(min(ms), 2) if ms else 0.0,
+        "max_ms": round(max(ms), 2) if ms else 0.0,
+    }
+
+
+@contextmanager
+def timed(out: list[float]) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        out.append(time.perf_counter() - t0)
+
+
+def peak_rss_mb() -> float:
+    """Process peak RSS so far (ru_maxrss is KiB on Linux)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def load_images(folder: str, limit: int = 0) -> list[tuple[str, np.ndarray]]:
+    names = sorted(n for n in os.listdir(folder) if n.lower().endswith(IMAGE_EXTS))
+    if limit > 0:
+        names = names[:limit]
+    images = []
+    for name in names:
+        img = cv2.imread(os.path.join(folder, name))
+        if img is not None:
+            images.append((name, img))
+    if not images:
+        print(f"[bench] no readable images in {folder}", file=sys.stderr)
+        sys.exit(1)
+    return images
+
+
+def emit(result: dict, json_out: str | None = None) -> None:
+    text = json.dumps(result, indent=2)
+    print(text)
+    if json_out:
+        with open(json_out, "w") as f:
+            f.write(text + "\n")
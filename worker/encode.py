@@ -0,0 +1,292 @@
+"""
+Shared output encoder: progressive JPEG, WebP, AVIF and PNG.
+
+Every job result goes through encode() (or encode_batch() for scenario packs)
+instead of a hard-coded JPEG 95 / PNG write:
+
+  - per-job format (ENCODE_FORMAT default), quality from DEFAULT_QUALITY
+  - target_kb: highest quality whose output fits the size budget
+  - target_ssim: lowest quality whose decoded output keeps SSIM >= target
+    (measured on a downscaled luma copy, see SSIM_MAX_SIDE)
+  - encode_batch() encodes on a thread pool (cv2 / Pillow encoders release
+    the GIL)
+
+AVIF needs an OpenCV build with the AVIF writer or Pillow with AVIF support
+(Pillow >= 11.3, or the pillow-avif-plugin package); without either it falls
+back to WebP and says so in the log.
+
+    enc = encode(img_bgr, "webp", target_kb=350)
+    upload_bytes_to_uploads(enc.data, f"out/{name}{enc.ext}", enc.content_type)
+"""
+
+from __future__ import annotations
+
+import io
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+    "avif": (".avif", "image/avif"),
+    "png": (".png", "image/png"),
+}
+_ALIASES = {"jpg": "jpeg"}
+DEFAULT_QUALITY = {"jpeg": 95, "webp": 90, "avif": 70}
+QUALITY_RANGE = {"jpeg": (40, 98), "webp": (40, 98), "avif": (30, 95)}
+
+ENCODE_FORMAT = os.environ.get("ENCODE_FORMAT", "jpeg")
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+ENCODE_SEARCH_STEPS = int(os.environ.get("ENCODE_SEARCH_STEPS", "6"))
+SSIM_MAX_SIDE = int(os.environ.get("ENCODE_SSIM_MAX_SIDE", "512"))
+
+
+def _log(msg: str) -> None:
+    print(msg, flush=True)
+
+
+@dataclass
+class Encoded:
+    data: bytes
+    format: str
+    quality: int | None
+    width: int
+    height: int
+    seconds: float
+    ssim: float | None = None
+
+    @property
+    def ext(self) -> str:
+        return FORMATS[self.format][0]
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    def meta(self) -> dict:
+        """JSON-safe description for job results (no payload bytes)."""
+        out = {"format": self.format, "content_type": self.content_type, "bytes": len(self.data),
+               "width": self.width, "height": self.height, "quality": self.quality,
+               "encode_sec": round(self.seconds, 3)}
+        if self.ssim is not None:
+            out["ssim"] = round(self.ssim, 4)
+        return out
+
+
+def normalize_format(fmt: str | None) -> str:
+    fmt = (fmt or ENCODE_FORMAT).lower().lstrip(".")
+    fmt = _ALIASES.get(fmt, fmt)
+    if fmt not in FORMATS:
+        _log(f"[encode] Unknown format {fmt!r} — using jpeg")
+        return "jpeg"
+    return fmt
+
+
+# ── Backends ────────────────────────────────────────────────────────
+
+_avif_backend: str | None = None
+
+
+def _get_avif_backend() -> str:
+    """'cv2', 'pillow' or 'none' (checked once)."""
+    global _avif_backend
+    if _avif_backend is None:
+        _avif_backend = "none"
+        if hasattr(cv2, "IMWRITE_AVIF_QUALITY"):
+            ok, _ = cv2.imencode(".avif", np.zeros((16, 16, 3), np.uint8))
+            if ok:
+                _avif_backend = "cv2"
+        if _avif_backend == "none":
+            try:
+                from PIL import Image, features
+                try:
+                    import pillow_avif  # noqa: F401 — registers the AVIF plugin
+                except ImportError:
+                    pass
+                if features.check("avif") or "AVIF" in Image.SAVE:
+                    _avif_backend = "pillow"
+            except ImportError:
+                pass
+        if _avif_backend == "none":
+            _log("[encode] AVIF not available (no cv2 or Pillow AVIF writer) — avif jobs use webp")
+    return _avif_backend
+
+
+def _encode_once(img: np.ndarray, fmt: str, quality: int | None) -> bytes:
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_PROGRESSIVE, 1,
+                  cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+        ok, buf = cv2.imencode(".jpg", img, params)
+    elif fmt == "webp":
+        ok, buf = cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    elif fmt == "avif" and _get_avif_backend() == "cv2":
+        ok, buf = cv2.imencode(".avif", img, [cv2.IMWRITE_AVIF_QUALITY, quality])
+    elif fmt == "avif":
+        from PIL import Image
+        out = io.BytesIO()
+        Image.fromarray(np.ascontiguousarray(img[:, :, ::-1])).save(out, format="AVIF", quality=quality)
+        return out.getvalue()
+    else:
+        ok, buf = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+    if not ok:
+        raise ValueError(f"{fmt} encode failed")
+    return buf.tobytes()
+
+
+# ── Quality search ──────────────────────────────────────────────────
+
+def _luma_small(img: np.ndarray) -> np.ndarray:
+    h, w = img.shape[:2]
+    s = min(1.0, SSIM_MAX_SIDE / max(h, w))
+    if s < 1.0:
+        img = cv2.resize(img, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+
+def ssim(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean SSIM of two grayscale float32 images (Gaussian 11x11, sigma 1.5)."""
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)  # noqa: E731
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a * mu_a
+    var_b = blur(b * b) - mu_b * mu_b
+    cov = blur(a * b) - mu_a * mu_b
+    num = (2 * mu_a * mu_b + c1) * (2 * cov + c2)
+    den = (mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)
+    return float(np.mean(num / den))
+
+
+def _decoded_ssim(ref_luma: np.ndarray, data: bytes, shape: tuple) -> float:
+    decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if decoded is None:  # AVIF via Pillow when cv2 cannot read it
+        from PIL import Image
+        decoded = np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))[:, :, ::-1]
+    if decoded.shape[:2] != shape[:2]:
+        return 0.0
+    return ssim(ref_luma, _luma_small(decoded))
+
+
+def _search(img: np.ndarray, fmt: str, target_kb: float | None, target_ssim: float | None):
+    """Binary search over QUALITY_RANGE → (data, quality, ssim or None)."""
+    lo, hi = QUALITY_RANGE[fmt]
+    ref = _luma_small(img) if target_ssim is not None else None
+    best = None  # (data, quality, ssim) satisfying every target
+    fallback = None  # smallest output tried, when nothing satisfies the size target
+    for _ in range(ENCODE_SEARCH_STEPS):
+        if lo > hi:
+            break
+        q = (lo + hi) // 2
+        data = _encode_once(img, fmt, q)
+        score = _decoded_ssim(ref, data, img.shape) if ref is not None else None
+        fits = target_kb is None or len(data) <= target_kb * 1024
+        good = target_ssim is None or score >= target_ssim
+        if fallback is None or len(data) < len(fallback[0]):
+            fallback = (data, q, score)
+        if fits and good:
+            best = (data, q, score)
+        if not fits:
+            hi = q - 1  # too big: lower quality
+        elif target_ssim is not None:
+            if good:
+                hi = q - 1  # quality to spare: look for a smaller file
+            else:
+                lo = q + 1
+        else:
+            lo = q + 1  # size-only: highest quality that still fits
+    return best or fallback
+
+
+# ── Public API ──────────────────────────────────────────────────────
+
+def encode(
+    img: np.ndarray,
+    fmt: str | None = None,
+    quality: int | None = None,
+    target_kb: float | None = None,
+    target_ssim: float | None = None,
+) -> Encoded:
+    """Encode a BGR uint8 image. Targets override quality; png ignores all three."""
+    t0 = time.time()
+    fmt = normalize_format(fmt)
+    if fmt == "avif" and _get_avif_backend() == "none":
+        fmt = "webp"
+    h, w = img.shape[:2]
+    score = None
+    if fmt == "png":
+        quality = None
+        data = _encode_once(img, fmt, None)
+    elif target_kb or target_ssim:
+        data, quality, score = _search(img, fmt, target_kb or None, target_ssim or None)
+    else:
+        quality = int(quality or DEFAULT_QUALITY[fmt])
+        data = _encode_once(img, fmt, quality)
+    return Encoded(data, fmt, quality, w, h, time.time() - t0, score)
+
+
+def encode_batch(images: list[np.ndarray], workers: int = ENCODE_WORKERS, **kwargs) -> list[Encoded]:
+    """encode() every image on a thread pool; order is preserved."""
+    if workers <= 1 or len(images) <= 1:
+        return [encode(img, **kwargs) for img in images]
+    with ThreadPoolExecutor(max_workers=min(workers, len(images)), thread_name_prefix="encode") as pool:
+        return list(pool.map(lambda img: encode(img, **kwargs), images))
+
+
+def save(path: str, img: np.ndarray, **kwargs) -> Encoded:
+    """encode() with the format taken from path's extension, written to path."""
+    enc = encode(img, normalize_format(os.path.splitext(path)[1] or None), **kwargs)
+    with open(path, "wb") as f:
+        f.write(enc.data)
+    return enc
+
+
+def job_number(params: dict, key: str, cast=float, hi: float | None = None):
+    """
+    Positive number from params[key] (None when absent / empty), coerced with
+    cast. Raises ValueError naming the key for anything else.
+    """
+    value = params.get(key)
+    if value is None or value == "":
+        return None
+    kind = "whole number" if cast is int else "number"
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a {kind}, got {value!r}") from None
+    if not math.isfinite(number) or (cast is int and not number.is_integer()):
+        raise ValueError(f"{key} must be a {kind}, got {value!r}")
+    if number <= 0 or (hi is not None and number > hi):
+        raise ValueError(f"{key} must be in (0, {hi}], got {value!r}" if hi is not None
+                         else f"{key} must be > 0, got {value!r}")
+    return cast(number)
+
+
+def job_options(params: dict) -> dict:
+    """
+    encode() kwargs from job input keys output_format / output_quality /
+    target_kb / target_ssim. Raises ValueError for values encode() can't use,
+    so handlers can reject the job up front.
+    """
+    fmt = params.get("output_format")
+    if fmt is not None and fmt != "":
+        name = fmt.lower().lstrip(".") if isinstance(fmt, str) else None
+        if _ALIASES.get(name, name) not in FORMATS:
+            raise ValueError(f"output_format must be one of {sorted(FORMATS)}, got {fmt!r}")
+    opts = {"fmt": fmt or None}
+    quality = job_number(params, "output_quality", int, 100)
+    if quality:
+        opts["quality"] = quality
+    target_kb = job_number(params, "target_kb")
+    if target_kb:
+        opts["target_kb"] = target_kb
+    target_ssim = job_number(params, "target_ssim", hi=1)
+    if target_ssim:
+        opts["target_ssim"] = target_ssim
+    return opts
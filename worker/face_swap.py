@@ -3,28 +3,48 @@
 Production face swap pipeline.
 
 Primary:  HyperSwap 1c (256x256, embedding-based, FaceFusion Labs 2025)
-Fallback: inswapper_128 (128x128, InsightFace legacy)
+Fallback: inswapper_128 (128x128, direct ONNX with a cached per-identity latent)
 
 Pipeline:
   1. Extract ArcFace embeddings from ALL source photos → average into one identity
   2. Detect face in target (FLUX-generated) image
   3. Swap using HyperSwap 1c 256 with averaged embedding [fallback: inswapper_128]
   4. Custom paste-back: feathered convex-hull mask + cv2.seamlessClone(MIXED_CLONE)
+     [FACE_SWAP_BLEND_MODE=laplacian|alpha for faster blending]
   5. LAB color histogram match (target skin → swapped face)
-  6. CodeFormer face restoration (fidelity 0.75)  [fallback: GFPGAN ONNX]
+  6. CodeFormer restoration of the swapped face (fidelity 0.75)  [fallback: GFPGAN ONNX]
   7. Real-ESRGAN x2 upscale                       [fallback: Lanczos]
+
+swap_faces_batch() runs one identity onto many targets (scenario packs): the
+identity is computed once and aligned target crops are batched through the
+swap model.
+
+Pipeline profiles (PIPELINE_PROFILES: preview / standard / premium) pick the
+detection sizes, blend mode and whether restoration and upscaling run; an
+optional latency budget drops those stages when the earlier ones ran slow.
+Within a profile, restoration and upscaling are skipped per image when cheap
+measurements (face-ROI sharpness, face size, output resolution) say they are
+not needed; the measurements and decisions go into the job stats.
 """
 
 import os
 import sys
 import base64
-import tempfile
+import copy
+import hashlib
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 import cv2
 import numpy as np
 
-from storage import download_from_url
+import encode
+import model_registry
+import ort_sessions
+from scratch import job_scratch
+from storage import download_from_url, upload_bytes_to_uploads
 
 
 # ---------------------------------------------------------------------------
@@ -37,43 +57,55 @@ def _log(msg: str):
 
 
 # ---------------------------------------------------------------------------
-# Model search paths (Docker image + ComfyUI pod + default insightface)
+# Model lookup (model_registry: image manifest, else one scan of MODEL_DIRS)
 # ---------------------------------------------------------------------------
 
-_MODEL_DIRS = [
-    os.path.expanduser("~/.insightface/models"),
-    "/usr/local/lib/python3.10/dist-packages/.assets/models",
-    "/workspace/ComfyUI/models",
-    "/workspace/ComfyUI/models/insightface/models",
-    "/workspace/ComfyUI/models/facerestore_models",
-    "/workspace/ComfyUI/models/upscale_models",
-    "/app/models",
-]
+def _find_model(filename: str) -> str | None:
+    """Resolve a model file through the registry (manifest or one-time scan)."""
+    return model_registry.resolve(filename)
 
 
-def _find_model(filename: str) -> str | None:
-    """Search common directories for a model file."""
-    for d in _MODEL_DIRS:
-        p = os.path.join(d, filename)
-        if os.path.isfile(p):
-            return p
-        # Also check one level deeper (e.g. buffalo_l/model.onnx)
-        for sub in os.listdir(d) if os.path.isdir(d) else []:
-            p2 = os.path.join(d, sub, filename)
-            if os.path.isfile(p2):
-                return p2
-    return None
+# Model tiers: "int8" prefers <name>.int8.onnx (quantize_models.py) over the fp32
+# file for the swap and restore models; "auto" does so only when no CUDA
+# provider is available (CPU fallback nodes). Missing int8 files fall back to fp32.
+MODEL_TIER = os.environ.get("FACE_SWAP_MODEL_TIER", "auto")
+
+
+def _tier_model(filename: str) -> str | None:
+    """Path for an ONNX model at the configured tier (int8 variant when selected and present)."""
+    tier = MODEL_TIER
+    if tier == "auto":
+        tier = "fp32" if "CUDAExecutionProvider" in _get_ort_providers() else "int8"
+    if tier == "int8" and filename.endswith(".onnx"):
+        path = _find_model(filename[:-len(".onnx")] + ".int8.onnx")
+        if path:
+            return path
+    return _find_model(filename)
 
 
 # ---------------------------------------------------------------------------
 # Lazy-loaded singletons
 # ---------------------------------------------------------------------------
 
-_face_app = None
-_swapper = None       # ("hyperswap", ort_session) or ("inswapper", insightface_model)
+_face_apps = {}       # profile → FaceAnalysis view over the shared pack
+_face_app_names = {}  # profile → model pack that loaded (recorded with stored identities)
+_face_pack = None     # (model_name, FaceAnalysis) holding every module the profiles read
+_swapper = None       # (kind, ort_session), kind "hyperswap" or "inswapper"
+_inswapper_emap = None  # inswapper embedding → latent projection (last graph initializer)
 _restorer = None
 _upscaler = None
 
+# One lock per model so a job that needs a model still being loaded by warmup()
+# blocks until that load finishes instead of starting a second one.
+_model_locks: dict[str, threading.Lock] = {}
+_model_locks_guard = threading.Lock()
+
+
+def _model_lock(name: str) -> threading.Lock:
+    with _model_locks_guard:
+        return _model_locks.setdefault(name, threading.Lock())
+
+
 # ArcFace alignment template for HyperSwap (128x128 crop, same as arcface_128)
 # 5-point landmarks: left_eye, right_eye, nose, left_mouth, right_mouth
 _ARCFACE_TEMPLATE_128 = np.array([
@@ -87,65 +119,180 @@ _ARCFACE_TEMPLATE_128 = np.array([
 
 def _get_ort_providers() -> list[str]:
     """Get available ONNX Runtime providers, preferring CUDA."""
-    try:
-        import onnxruntime as ort
-        available = ort.get_available_providers()
-        return [p for p in ["CUDAExecutionProvider", "CPUExecutionProvider"] if p in available]
-    except Exception:
-        return ["CPUExecutionProvider"]
-
-
-def _get_face_app():
-    """InsightFace FaceAnalysis — face detection + ArcFace embedding."""
-    global _face_app
-    if _face_app is not None:
-        return _face_app
+    return ort_sessions.providers()
+
+
+# FaceAnalysis profiles: each call site runs only the insightface modules it
+# reads instead of every buffalo_l model per get(). The modules are loaded once
+# into a shared pack (one SCRFD, one ArcFace); each profile is a shallow copy
+# of it whose .models holds just its own modules.
+#   detect    → bbox + 5-point kps                (restoration fallback)
+#   landmarks → + landmark_2d_106                 (target: swap kps + mask hull)
+#   embed     → + ArcFace normed_embedding        (source identity)
+#   full      → every model in the pack (gender/age, 3D68 pose, ...)
+FACE_PROFILES = {
+    "detect": ["detection"],
+    "landmarks": ["detection", "landmark_2d_106"],
+    "embed": ["detection", "recognition"],
+    "full": None,
+}
+
+
+def _get_face_app(profile: str = "full"):
+    """InsightFace FaceAnalysis restricted to one profile's modules."""
+    app = _face_apps.get(profile)
+    if app is not None:
+        return app
+    with _model_lock(f"face:{profile}"):
+        return _load_face_app(profile)
+
+
+def _load_face_pack():
+    """FaceAnalysis with the union of the profiles' modules, built once."""
+    global _face_pack
+    if _face_pack is not None:
+        return _face_pack
 
     from insightface.app import FaceAnalysis
 
-    providers = _get_ort_providers()
-
+    ort_kwargs = ort_sessions.insightface_kwargs()
+    allowed = sorted({m for mods in FACE_PROFILES.values() if mods for m in mods})
     for model_name in ("buffalo_l", "antelopev2"):
         try:
-            app = FaceAnalysis(name=model_name, providers=providers)
-            app.prepare(ctx_id=0, det_size=(640, 640))
-            _face_app = app
-            _log(f"[face_swap] FaceAnalysis loaded: {model_name}")
-            return _face_app
+            t0 = time.time()
+            pack = FaceAnalysis(name=model_name, allowed_modules=allowed, **ort_kwargs)
+            pack.prepare(ctx_id=0, det_size=(640, 640))
+            _face_pack = (model_name, pack)
+            _log(f"[face_swap] FaceAnalysis pack loaded: {model_name} modules={sorted(pack.models)} "
+                 f"({time.time()-t0:.1f}s)")
+            return _face_pack
         except Exception as e:
             _log(f"[face_swap] FaceAnalysis({model_name}) failed: {e}")
 
     raise RuntimeError("No InsightFace model pack available (tried buffalo_l, antelopev2)")
 
 
+def _load_face_app(profile: str):
+    app = _face_apps.get(profile)
+    if app is not None:
+        return app
+
+    allowed = FACE_PROFILES[profile]
+    # One FaceAnalysis construction at a time across profiles: on a cold host
+    # the first one downloads and unzips the pack into ~/.insightface/models,
+    # and concurrent warmup loaders would race on that extraction.
+    with _model_lock("insightface_pack"):
+        model_name, pack = _load_face_pack()
+        if allowed is None:
+            # full: every module in the pack dir; the shared ones replace
+            # their freshly loaded duplicates so only one copy stays resident.
+            from insightface.app import FaceAnalysis
+            t0 = time.time()
+            app = FaceAnalysis(name=model_name, **ort_sessions.insightface_kwargs())
+            app.prepare(ctx_id=0, det_size=(640, 640))
+            app.models.update(pack.models)
+            app.det_model = pack.det_model
+            _log(f"[face_swap] FaceAnalysis loaded: {model_name} profile=full "
+                 f"modules={sorted(app.models)} ({time.time()-t0:.1f}s)")
+        else:
+            app = copy.copy(pack)
+            app.models = {task: model for task, model in pack.models.items() if task in allowed}
+    _face_apps[profile] = app
+    _face_app_names[profile] = model_name
+    return app
+
+
+# Adaptive detection resolution. FLUX targets and upscaled outputs are 1–2k px
+# with one large face, which SCRFD finds at 320 as reliably as at 640 for a
+# quarter of the compute. Each pass INTER_AREA-downscales the image to the pass
+# size, detects, and maps bbox/kps back to full resolution; the next (larger)
+# pass only runs when nothing was found or the best score is below
+# DET_RETRY_SCORE. Landmark / recognition models then run on the full image.
+DET_SIZES = [int(s) for s in os.environ.get("FACE_SWAP_DET_SIZES", "320,640").split(",") if s.strip()]
+DET_RETRY_SCORE = float(os.environ.get("FACE_SWAP_DET_RETRY_SCORE", "0.6"))
+
+
+def _detect_faces(img: np.ndarray, profile: str = "landmarks", stats: dict | None = None,
+                  sizes: list[int] | None = None) -> list:
+    """FaceAnalysis.get() with coarse-to-fine detection; same Face objects out."""
+    from insightface.app.common import Face
+
+    app = _get_face_app(profile)
+    h, w = img.shape[:2]
+    best_bboxes, best_kpss, best_score, used = None, None, -1.0, None
+    passes = 0
+
+    for size in sizes or DET_SIZES:
+        scale = min(1.0, size / max(h, w))
+        small = img if scale == 1.0 else cv2.resize(
+            img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        bboxes, kpss = app.det_model.detect(small, input_size=(size, size), max_num=0, metric="default")
+        passes += 1
+        score = float(bboxes[:, 4].max()) if len(bboxes) else 0.0
+        if score > best_score:
+            if scale != 1.0:
+                bboxes = bboxes.copy()
+                bboxes[:, :4] /= scale
+                if kpss is not None:
+                    kpss = kpss / scale
+            best_bboxes, best_kpss, best_score, used = bboxes, kpss, score, size
+        if score >= DET_RETRY_SCORE:
+            break
+
+    if stats is not None:
+        det = stats.setdefault("detection", {"passes": 0, "sizes": []})
+        det["passes"] += passes
+        det["sizes"].append(used)
+
+    faces = []
+    for i in range(0 if best_bboxes is None else len(best_bboxes)):
+        face = Face(bbox=best_bboxes[i, :4], kps=None if best_kpss is None else best_kpss[i],
+                    det_score=best_bboxes[i, 4])
+        for task, model in app.models.items():
+            if task != "detection":
+                model.get(img, face)
+        faces.append(face)
+    return faces
+
+
 def _get_swapper():
+    if _swapper is not None:
+        return _swapper
+    with _model_lock("swapper"):
+        return _load_swapper()
+
+
+def _load_swapper():
     """
     Load swap model. Preference order:
       1. hyperswap_1c_256.onnx (256x256, best quality, direct ONNX)
-      2. inswapper_128.onnx (128x128, legacy InsightFace API)
+      2. inswapper_128.onnx (128x128, same direct ONNX path; its emap is read
+         from the graph once for the source-latent projection)
     """
-    global _swapper
+    global _swapper, _inswapper_emap
     if _swapper is not None:
         return _swapper
 
-    import onnxruntime as ort
-
     # --- Primary: HyperSwap 1c 256 ---
     for name in ("hyperswap_1c_256.onnx", "hyperswap_1b_256.onnx", "hyperswap_1a_256.onnx"):
-        path = _find_model(name)
+        path = _tier_model(name)
         if path:
-            session = ort.InferenceSession(path, providers=_get_ort_providers())
+            session = ort_sessions.create_bound_session(path)
             _swapper = ("hyperswap", session)
             _log(f"[face_swap] PRIMARY: {name} loaded from {path}")
             return _swapper
 
-    # --- Fallback: inswapper_128 via InsightFace ---
-    path = _find_model("inswapper_128.onnx")
+    # --- Fallback: inswapper_128 ---
+    path = _tier_model("inswapper_128.onnx")
     if path:
-        import insightface
-        model = insightface.model_zoo.get_model(path)
-        _swapper = ("inswapper", model)
-        _log(f"[face_swap] FALLBACK: inswapper_128 loaded from {path}")
+        import onnx
+        from onnx import numpy_helper
+        graph = onnx.load(path).graph
+        _inswapper_emap = numpy_helper.to_array(graph.initializer[-1]).astype(np.float32)
+        del graph
+        session = ort_sessions.create_bound_session(path)
+        _swapper = ("inswapper", session)
+        _log(f"[face_swap] FALLBACK: inswapper_128 loaded from {path} (emap {_inswapper_emap.shape})")
         return _swapper
 
     raise RuntimeError("No swap model found (tried hyperswap_1c/1b/1a_256, inswapper_128)")
@@ -156,6 +303,13 @@ def _get_swapper():
 # ---------------------------------------------------------------------------
 
 def _get_restorer():
+    if _restorer is not None:
+        return _restorer
+    with _model_lock("restorer"):
+        return _load_restorer()
+
+
+def _load_restorer():
     """Load CodeFormer if available, else GFPGAN ONNX, else None."""
     global _restorer
     if _restorer is not None:
@@ -188,12 +342,9 @@ def _get_restorer():
 
     # Fallback: GFPGAN via ONNX (available in Docker image)
     try:
-        import onnxruntime as ort
-        gfpgan_path = _find_model("gfpgan_1.4.onnx")
+        gfpgan_path = _tier_model("gfpgan_1.4.onnx")
         if gfpgan_path:
-            providers = [p for p in ["CUDAExecutionProvider", "CPUExecutionProvider"]
-                         if p in ort.get_available_providers()]
-            session = ort.InferenceSession(gfpgan_path, providers=providers)
+            session = ort_sessions.create_bound_session(gfpgan_path)
             _restorer = ("gfpgan_onnx", session, None)
             _log(f"[face_swap] GFPGAN ONNX loaded from {gfpgan_path}")
             return _restorer
@@ -210,35 +361,32 @@ def _get_restorer():
 # ---------------------------------------------------------------------------
 
 def _get_upscaler():
-    """Load Real-ESRGAN if available, else None."""
+    if _upscaler is not None:
+        return _upscaler
+    with _model_lock("upscaler"):
+        return _load_upscaler()
+
+
+def _load_upscaler():
+    """Load the tiled Real-ESRGAN engine (upscaler.py) if available, else "none"."""
     global _upscaler
     if _upscaler is not None:
         return _upscaler
 
     try:
-        from realesrgan import RealESRGANer
-        from basicsr.archs.rrdbnet_arch import RRDBNet
-        import torch
+        from upscaler import get_upscaler
 
         model_path = (_find_model("RealESRGAN_x2plus.pth")
                       or _find_model("RealESRGAN_x4plus.pth"))
         if not model_path:
             raise FileNotFoundError("No Real-ESRGAN model found")
 
-        is_x2 = "x2" in os.path.basename(model_path).lower()
-        scale = 2 if is_x2 else 4
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64,
-                        num_block=23, num_grow_ch=32, scale=scale)
-        half = torch.cuda.is_available()
-        upsampler = RealESRGANer(
-            scale=scale, model_path=model_path, model=model,
-            tile=0, tile_pad=10, pre_pad=0, half=half,
-        )
-        _upscaler = upsampler
-        _log(f"[face_swap] Real-ESRGAN loaded from {model_path} (scale={scale})")
-        return _upscaler
-    except ImportError:
-        _log("[face_swap] Real-ESRGAN not available (missing realesrgan/basicsr)")
+        upsampler = get_upscaler(model_path)
+        if upsampler is not None:
+            _upscaler = upsampler
+            _log(f"[face_swap] Real-ESRGAN loaded from {model_path} (scale={upsampler.scale})")
+            return _upscaler
+        _log("[face_swap] Real-ESRGAN not available (missing basicsr/torch)")
     except Exception as e:
         _log(f"[face_swap] Real-ESRGAN load failed: {e}")
 
@@ -267,11 +415,10 @@ def average_embeddings(images: list[np.ndarray]) -> np.ndarray:
     Uses the largest detected face in each image.
     Raises ValueError if no face found in ANY image.
     """
-    app = _get_face_app()
     embeddings = []
 
     for i, img in enumerate(images):
-        faces = app.get(img)
+        faces = _detect_faces(img, "embed")
         if not faces:
             _log(f"[embed] No face in source image {i} — skipping")
             continue
@@ -291,6 +438,121 @@ def average_embeddings(images: list[np.ndarray]) -> np.ndarray:
     return avg
 
 
+# ---------------------------------------------------------------------------
+# 1b. Identity cache — averaged embedding per source-photo set
+# ---------------------------------------------------------------------------
+# The same user's photos are resubmitted for every scene. Lookups go:
+#   1. in-process LRU keyed by the content hash of the set (order-independent)
+#   2. persistent identity_store: the stored average for this exact source set
+#   3. decode + detect + average, written back to both
+# Hits at 1 or 2 skip source decode and detection entirely.
+
+IDENTITY_CACHE_SIZE = int(os.environ.get("FACE_SWAP_IDENTITY_CACHE_SIZE", "64"))
+
+_identity_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_identity_cache_stats = {"hits": 0, "misses": 0}
+_identity_lock = threading.Lock()
+
+
+def _source_digests(source_paths: list[str]) -> list[str]:
+    digests = []
+    for p in source_paths:
+        try:
+            with open(p, "rb") as f:
+                digests.append(hashlib.sha256(f.read()).hexdigest())
+        except OSError:
+            continue
+    return digests
+
+
+def _source_set_key(digests: list[str]) -> str | None:
+    if not digests:
+        return None
+    return hashlib.sha256("".join(sorted(digests)).encode("ascii")).hexdigest()
+
+
+def _identity_model_version() -> str:
+    _get_face_app("embed")
+    return f"insightface/{_face_app_names['embed']}"
+
+
+def _identity_from_store(key: str, digests: list[str]) -> np.ndarray | None:
+    from identity_store import get_store
+    store = get_store()
+    if store is None:
+        return None
+    try:
+        return store.get(f"sources:{key}", model_version=_identity_model_version(), source_hashes=digests)
+    except Exception as e:
+        _log(f"[embed] identity store read failed: {e}")
+    return None
+
+
+def _identity_to_store(key: str, digests: list[str], embedding: np.ndarray) -> None:
+    from identity_store import get_store
+    store = get_store()
+    if store is None:
+        return
+    try:
+        store.put(f"sources:{key}", embedding, model_version=_identity_model_version(), source_hashes=digests)
+    except Exception as e:
+        _log(f"[embed] identity store write failed: {e}")
+
+
+def _identity_for_sources(source_paths: list[str], stats: dict | None = None) -> np.ndarray:
+    """
+    Averaged normed embedding for a set of source photos, via the caches above.
+
+    Raises ValueError when no source is readable or no face is found.
+    """
+    digests = _source_digests(source_paths)
+    key = _source_set_key(digests)
+    cached = None
+    if key is not None:
+        with _identity_lock:
+            cached = _identity_cache.get(key)
+            if cached is not None:
+                _identity_cache.move_to_end(key)
+                _identity_cache_stats["hits"] += 1
+            else:
+                _identity_cache_stats["misses"] += 1
+
+    source = "memory"
+    if cached is not None:
+        _log(f"[embed] Identity cache HIT ({key[:12]})")
+        embedding = cached
+    else:
+        embedding = _identity_from_store(key, digests) if key is not None else None
+        if embedding is not None:
+            source = "store"
+            _log(f"[embed] Identity store HIT ({key[:12]})")
+        else:
+            source = "computed"
+            sources = _load_sources(source_paths)
+            if not sources:
+                raise ValueError("no readable sources")
+            embedding = average_embeddings(sources)
+            if key is not None:
+                _identity_to_store(key, digests, embedding)
+        if key is not None and IDENTITY_CACHE_SIZE > 0:
+            with _identity_lock:
+                _identity_cache[key] = embedding
+                _identity_cache.move_to_end(key)
+                while len(_identity_cache) > IDENTITY_CACHE_SIZE:
+                    _identity_cache.popitem(last=False)
+
+    if stats is not None:
+        with _identity_lock:
+            stats["identity_cache"] = {
+                "hit": cached is not None,
+                "source": source,
+                "hits": _identity_cache_stats["hits"],
+                "misses": _identity_cache_stats["misses"],
+                "size": len(_identity_cache),
+            }
+    return embedding.copy()
+
+
 # ---------------------------------------------------------------------------
 # 2. Face mask creation
 # ---------------------------------------------------------------------------
@@ -299,27 +561,30 @@ def _create_face_mask(
     img_shape: tuple[int, int, int],
     face,
     blur_radius: int = 21,
+    origin: tuple[int, int] = (0, 0),
 ) -> np.ndarray:
     """
     Create a feathered face mask from face landmarks.
 
     Uses the convex hull of 2D landmarks (or kps fallback),
     then Gaussian blurs for soft edges.
-    Returns float32 mask [0..1] at image resolution.
+    Returns float32 mask [0..1] at img_shape resolution; origin is the (x, y)
+    of that array's top-left corner in image coordinates (ROI masks).
     """
     h, w = img_shape[:2]
     mask = np.zeros((h, w), dtype=np.float32)
+    offset = np.array(origin, dtype=np.float32)
 
     # Prefer detailed landmarks, fall back to key points
     if hasattr(face, "landmark_2d_106") and face.landmark_2d_106 is not None:
-        pts = face.landmark_2d_106.astype(np.int32)
+        pts = (face.landmark_2d_106 - offset).astype(np.int32)
     elif hasattr(face, "landmark_3d_68") and face.landmark_3d_68 is not None:
-        pts = face.landmark_3d_68[:, :2].astype(np.int32)
+        pts = (face.landmark_3d_68[:, :2] - offset).astype(np.int32)
     elif hasattr(face, "kps") and face.kps is not None:
-        pts = face.kps.astype(np.int32)
+        pts = (face.kps - offset).astype(np.int32)
     else:
         # Last resort: bbox-based ellipse
-        x1, y1, x2, y2 = face.bbox.astype(int)
+        x1, y1, x2, y2 = (face.bbox - np.tile(offset, 2)).astype(int)
         cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
         rx, ry = (x2 - x1) // 2, (y2 - y1) // 2
         cv2.ellipse(mask, (cx, cy), (rx, ry), 0, 0, 360, 1.0, -1)
@@ -336,6 +601,27 @@ def _create_face_mask(
     return mask
 
 
+def _face_points(face) -> np.ndarray:
+    """Every point the mask can be built from, plus the bbox corners."""
+    pts = [np.asarray(face.bbox, dtype=np.float32).reshape(2, 2)]
+    for attr in ("landmark_2d_106", "landmark_3d_68", "kps"):
+        p = getattr(face, attr, None)
+        if p is not None:
+            pts.append(np.asarray(p, dtype=np.float32)[:, :2])
+    return np.concatenate(pts, axis=0)
+
+
+def _composite_roi(face, shape: tuple, pad: int) -> tuple[int, int, int, int]:
+    """Face bounding rect grown by pad (blur + Poisson margin), clipped to the image."""
+    pts = _face_points(face)
+    h, w = shape[:2]
+    x1 = max(0, int(np.floor(pts[:, 0].min())) - pad)
+    y1 = max(0, int(np.floor(pts[:, 1].min())) - pad)
+    x2 = min(w, int(np.ceil(pts[:, 0].max())) + pad + 1)
+    y2 = min(h, int(np.ceil(pts[:, 1].max())) + pad + 1)
+    return x1, y1, x2, y2
+
+
 # ---------------------------------------------------------------------------
 # 3. LAB color histogram matching
 # ---------------------------------------------------------------------------
@@ -377,115 +663,169 @@ def _color_match_lab(
 # 4. CodeFormer / GFPGAN face restoration
 # ---------------------------------------------------------------------------
 
-def _restore_face(img: np.ndarray, fidelity: float = 0.75) -> np.ndarray:
+def _valid_face_geometry(face, shape: tuple) -> bool:
+    """True when face.bbox is finite, non-degenerate and overlaps the image."""
+    bbox = getattr(face, "bbox", None)
+    if bbox is None:
+        return False
+    bbox = np.asarray(bbox, dtype=np.float64)
+    if bbox.shape != (4,) or not np.all(np.isfinite(bbox)):
+        return False
+    h, w = shape[:2]
+    x1, y1, x2, y2 = bbox
+    return x2 - x1 >= 8 and y2 - y1 >= 8 and x2 > 0 and y2 > 0 and x1 < w and y1 < h
+
+
+def _restore_roi(bbox, shape: tuple) -> tuple[int, int, int, int]:
+    """Face bbox expanded by 30% for context, clamped to the image."""
+    x1, y1, x2, y2 = np.asarray(bbox).astype(int)
+    h, w = shape[:2]
+    pad_x = int((x2 - x1) * 0.15)
+    pad_y = int((y2 - y1) * 0.15)
+    return max(0, x1 - pad_x), max(0, y1 - pad_y), min(w, x2 + pad_x), min(h, y2 + pad_y)
+
+
+# Crops per restoration call are capped by a memory budget. Rough peak
+# activation cost of one 512x512 crop in fp32 for each model; batches that
+# still run out of CUDA memory are halved and retried.
+RESTORE_MEMORY_BUDGET_MB = int(os.environ.get("FACE_SWAP_RESTORE_MEMORY_MB", "1024"))
+_RESTORE_CROP_MB = {"codeformer": 160, "gfpgan_onnx": 96}
+_RESTORE_SIZE = 512
+
+
+def _restore_batch_size(kind: str) -> int:
+    return max(1, RESTORE_MEMORY_BUDGET_MB // _RESTORE_CROP_MB.get(kind, 128))
+
+
+def _restore_faces(images: list[np.ndarray], faces: list[list], fidelity: float = 0.75) -> list[np.ndarray]:
     """
-    Apply face restoration to the full image.
+    Restore every listed face in every image with batched model calls.
 
-    Uses CodeFormer (preferred) or GFPGAN ONNX (fallback).
-    Processes only detected face crops, pastes back.
+    faces[i] holds the detections for images[i] (the swapped target face for
+    the swap pipeline). Crops from all images are resized to 512x512 and go
+    through the restorer _restore_batch_size() at a time, then are pasted back.
+    Images whose faces are missing or have invalid geometry are re-detected.
     """
-    t0 = time.time()
     kind, model, device = _get_restorer()
 
     if kind == "none":
         _log("[restore] No restoration model — skipping")
-        return img
+        return images
+
+    results = [img.copy() for img in images]
+    crops, where = [], []  # where[k] = (image index, roi) for crops[k]
+    for i, (img, img_faces) in enumerate(zip(images, faces)):
+        valid = [f for f in img_faces or [] if f is not None and _valid_face_geometry(f, img.shape)]
+        if not valid:
+            detected = _detect_faces(img, "detect")
+            if not detected:
+                _log(f"[restore] Image {i}: no face found for restoration — skipping")
+                continue
+            valid = [_largest_face(detected)]
+            _log(f"[restore] Image {i}: target geometry unavailable — re-detected face")
+        for f in valid:
+            cx1, cy1, cx2, cy2 = roi = _restore_roi(f.bbox, img.shape)
+            crops.append(cv2.resize(img[cy1:cy2, cx1:cx2], (_RESTORE_SIZE, _RESTORE_SIZE),
+                                    interpolation=cv2.INTER_LANCZOS4))
+            where.append((i, roi))
+
+    if not crops:
+        return results
 
+    t0 = time.time()
+    batch_size = _restore_batch_size(kind)
     if kind == "codeformer":
-        return _restore_codeformer(img, model, device, fidelity)
-
-    if kind == "gfpgan_onnx":
-        return _restore_gfpgan_onnx(img, model)
+        restored = _restore_codeformer(crops, model, device, fidelity, batch_size)
+    elif kind == "gfpgan_onnx":
+        restored = _restore_gfpgan_onnx(crops, model, batch_size)
+    else:
+        return results
 
-    return img
+    for (i, (cx1, cy1, cx2, cy2)), out in zip(where, restored):
+        results[i][cy1:cy2, cx1:cx2] = cv2.resize(out, (cx2 - cx1, cy2 - cy1),
+                                                  interpolation=cv2.INTER_LANCZOS4)
+    _log(f"[restore] {kind}: {len(crops)} face(s) across {len(images)} image(s), "
+         f"batch={batch_size} ({time.time()-t0:.2f}s)")
+    return results
 
 
-def _restore_codeformer(
-    img: np.ndarray, net, device, fidelity: float
-) -> np.ndarray:
-    """CodeFormer: crop face, restore at 512x512, paste back."""
-    import torch
-    from basicsr.utils import img2tensor, tensor2img
+def _restore_face(img: np.ndarray, fidelity: float = 0.75, face=None) -> np.ndarray:
+    """
+    Restore the swapped face only.
 
-    app = _get_face_app()
-    faces = app.get(img)
-    if not faces:
-        _log("[restore] No face found for restoration — skipping")
-        return img
+    Uses CodeFormer (preferred) or GFPGAN ONNX (fallback) on the face ROI.
+    `face` is the target detection carried through the pipeline; its geometry is
+    valid for the composited image (paste-back does not move the face), so a
+    second detection pass only runs when that geometry is missing or invalid.
+    """
+    return _restore_faces([img], [[face]], fidelity)[0]
 
-    result = img.copy()
-    for face in faces:
-        x1, y1, x2, y2 = face.bbox.astype(int)
-        # Expand crop by 30% for context
-        h, w = img.shape[:2]
-        pad_x = int((x2 - x1) * 0.15)
-        pad_y = int((y2 - y1) * 0.15)
-        cx1 = max(0, x1 - pad_x)
-        cy1 = max(0, y1 - pad_y)
-        cx2 = min(w, x2 + pad_x)
-        cy2 = min(h, y2 + pad_y)
 
-        crop = result[cy1:cy2, cx1:cx2]
-        crop_resized = cv2.resize(crop, (512, 512), interpolation=cv2.INTER_LANCZOS4)
+def _is_oom(e: Exception) -> bool:
+    return "out of memory" in str(e).lower()
 
-        # BGR [0,255] → RGB tensor [0,1] → normalize
-        inp = img2tensor(crop_resized / 255.0, bgr2rgb=True, float32=True)
-        inp = inp.unsqueeze(0).to(device)
 
-        with torch.no_grad():
-            output = net(inp, w=fidelity, adain=True)[0]
+def _restore_codeformer(
+    crops: list[np.ndarray], net, device, fidelity: float, batch_size: int
+) -> list[np.ndarray]:
+    """CodeFormer on 512x512 BGR crops, batch_size per forward pass."""
+    import torch
+    from basicsr.utils import img2tensor, tensor2img
 
-        restored = tensor2img(output, rgb2bgr=True, min_max=(-1, 1))
-        restored = restored.astype(np.uint8)
-        restored = cv2.resize(restored, (cx2 - cx1, cy2 - cy1),
-                              interpolation=cv2.INTER_LANCZOS4)
-        result[cy1:cy2, cx1:cx2] = restored
+    out: list[np.ndarray] = []
+    i = 0
+    while i < len(crops):
+        chunk = crops[i:i + batch_size]
+        # BGR [0,255] → RGB tensor [0,1] → normalize
+        inp = torch.stack([img2tensor(c / 255.0, bgr2rgb=True, float32=True) for c in chunk]).to(device)
+        try:
+            with torch.no_grad():
+                output = net(inp, w=fidelity, adain=True)[0]
+        except RuntimeError as e:
+            if batch_size > 1 and _is_oom(e):
+                batch_size //= 2
+                torch.cuda.empty_cache()
+                _log(f"[restore] CodeFormer OOM — retrying with batch={batch_size}")
+                continue
+            raise
+        out.extend(tensor2img(o, rgb2bgr=True, min_max=(-1, 1)).astype(np.uint8) for o in output)
+        i += len(chunk)
 
     _log(f"[restore] CodeFormer done (fidelity={fidelity})")
-    return result
-
+    return out
 
-def _restore_gfpgan_onnx(img: np.ndarray, session) -> np.ndarray:
-    """GFPGAN via ONNX: crop face, enhance at 512x512, paste back."""
-    app = _get_face_app()
-    faces = app.get(img)
-    if not faces:
-        _log("[restore] No face found for GFPGAN — skipping")
-        return img
 
-    result = img.copy()
-    for face in faces:
-        x1, y1, x2, y2 = face.bbox.astype(int)
-        h, w = img.shape[:2]
-        pad_x = int((x2 - x1) * 0.15)
-        pad_y = int((y2 - y1) * 0.15)
-        cx1 = max(0, x1 - pad_x)
-        cy1 = max(0, y1 - pad_y)
-        cx2 = min(w, x2 + pad_x)
-        cy2 = min(h, y2 + pad_y)
-
-        crop = result[cy1:cy2, cx1:cx2]
-        crop_512 = cv2.resize(crop, (512, 512), interpolation=cv2.INTER_LANCZOS4)
+def _restore_gfpgan_onnx(crops: list[np.ndarray], session, batch_size: int) -> list[np.ndarray]:
+    """GFPGAN via ONNX on 512x512 BGR crops; batched when the graph's batch axis is dynamic."""
+    inp = session.get_inputs()[0]
+    if inp.shape and isinstance(inp.shape[0], int):
+        batch_size = 1
 
+    out: list[np.ndarray] = []
+    i = 0
+    while i < len(crops):
+        chunk = crops[i:i + batch_size]
         # Preprocess: BGR→RGB, [0,1], HWC→NCHW
-        blob = crop_512[:, :, ::-1].astype(np.float32) / 255.0
+        blob = np.stack(chunk)[..., ::-1].astype(np.float32) / 255.0
         blob = (blob - 0.5) / 0.5  # normalize to [-1, 1]
-        blob = blob.transpose(2, 0, 1)[np.newaxis, ...]
-
-        inp_name = session.get_inputs()[0].name
-        out = session.run(None, {inp_name: blob})[0]
-
-        # Postprocess: NCHW→HWC, [-1,1]→[0,255], RGB→BGR
-        out = out.squeeze(0).transpose(1, 2, 0)
-        out = np.clip((out + 1) * 127.5, 0, 255).astype(np.uint8)
-        out = out[:, :, ::-1]  # RGB→BGR
-
-        out = cv2.resize(out, (cx2 - cx1, cy2 - cy1),
-                         interpolation=cv2.INTER_LANCZOS4)
-        result[cy1:cy2, cx1:cx2] = out
+        blob = np.ascontiguousarray(blob.transpose(0, 3, 1, 2))
+        try:
+            pred = session.run(None, {inp.name: blob})[0]
+        except Exception as e:
+            if batch_size > 1 and _is_oom(e):
+                batch_size //= 2
+                _log(f"[restore] GFPGAN OOM — retrying with batch={batch_size}")
+                continue
+            raise
+
+        # Postprocess: NCHW→NHWC, [-1,1]→[0,255], RGB→BGR
+        pred = pred.transpose(0, 2, 3, 1)
+        pred = np.clip((pred + 1) * 127.5, 0, 255).astype(np.uint8)
+        out.extend(np.ascontiguousarray(p[:, :, ::-1]) for p in pred)
+        i += len(chunk)
 
     _log("[restore] GFPGAN ONNX done")
-    return result
+    return out
 
 
 # ---------------------------------------------------------------------------
@@ -502,7 +842,7 @@ def _upscale(img: np.ndarray, outscale: int = 2) -> np.ndarray:
                           interpolation=cv2.INTER_LANCZOS4)
 
     t0 = time.time()
-    output, _ = upscaler.enhance(img, outscale=outscale)
+    output = upscaler.enhance(img, outscale=outscale)
     _log(f"[upscale] Real-ESRGAN x{outscale} done ({time.time()-t0:.1f}s)")
     return output
 
@@ -535,116 +875,557 @@ def _run_swap(
     """
     Execute face swap using the loaded model.
 
-    HyperSwap path:
-      - Align target face to arcface_128 template at 256x256
-      - Run ONNX: source=normed_embedding(1,512), target=preprocessed_crop(1,3,256,256)
+    Both models run as direct ONNX sessions through the same steps:
+      - Align target face to the model's arcface template (_SWAP_SPECS crop)
+      - Run ONNX: source=latent(1,512), target=preprocessed_crop(1,3,S,S)
+        (HyperSwap: normed embedding, inswapper: embedding @ emap, see _source_latent)
       - Inverse-warp swapped crop back to original coords
       - Alpha composite onto target
-
-    inswapper_128 path:
-      - Use InsightFace's .get() API directly (handles alignment + paste internally)
     """
-    if kind == "hyperswap":
-        return _run_hyperswap(model, target, target_face, source_face)
-    elif kind == "inswapper":
-        try:
-            return model.get(target.copy(), target_face, source_face, paste_back=True)
-        except Exception as e:
-            _log(f"[swap] inswapper_128 failed: {e}")
+    if kind not in _SWAP_SPECS:
+        return None
+    try:
+        aligned = _swap_align(kind, target, target_face)
+        if aligned is None:
             return None
-    return None
+        blob, M = aligned
+        pred = _swap_infer(kind, model, source_face, blob[np.newaxis, ...])[0]
+        result = _swap_paste(target, pred, M)
+        _log(f"[swap] {kind} {pred.shape[0]}x{pred.shape[1]} swap done, pred range=[{pred.min()},{pred.max()}]")
+        return result
+
+    except Exception as e:
+        _log(f"[swap] {kind} FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+# Per-model crop size, alignment template and input normalization
+# ((x - mean) / std on RGB in [0, 1]; outputs are mapped back the same way).
+# inswapper was trained on insightface's norm_crop alignment (arcface_dst
+# shifted by 8 px for a 128 crop), HyperSwap on the arcface_128 template.
+_INSWAPPER_TEMPLATE_128 = np.array([
+    [46.2946, 51.6963],
+    [81.5318, 51.5014],
+    [64.0252, 71.7366],
+    [49.5493, 92.3655],
+    [78.7299, 92.2041],
+], dtype=np.float32)
+
+_SWAP_SPECS = {
+    "hyperswap": {"crop": 256, "template": _ARCFACE_TEMPLATE_128, "mean": 0.5, "std": 0.5},
+    "inswapper": {"crop": 128, "template": _INSWAPPER_TEMPLATE_128, "mean": 0.0, "std": 1.0},
+}
+
+# Projected source latent per (model, identity): inswapper feeds
+# normalize(embedding @ emap) instead of the raw embedding. Keyed by the
+# embedding bytes, so every job reusing a cached identity skips the projection.
+_latent_cache: "OrderedDict[tuple[str, str], np.ndarray]" = OrderedDict()
+_latent_lock = threading.Lock()
+
+
+def _source_latent(kind: str, source_face: _SyntheticFace) -> np.ndarray:
+    """(1, 512) float32 source input for the swap model."""
+    emb = np.asarray(source_face.normed_embedding, dtype=np.float32).reshape(1, -1)
+    if kind != "inswapper":
+        return emb
+    key = (kind, hashlib.sha1(emb.tobytes()).hexdigest())
+    with _latent_lock:
+        latent = _latent_cache.get(key)
+        if latent is not None:
+            _latent_cache.move_to_end(key)
+            return latent
+    latent = emb @ _inswapper_emap
+    latent = (latent / np.linalg.norm(latent)).astype(np.float32)
+    with _latent_lock:
+        _latent_cache[key] = latent
+        while len(_latent_cache) > IDENTITY_CACHE_SIZE:
+            _latent_cache.popitem(last=False)
+    return latent
+
+
+def _swap_align(kind: str, target: np.ndarray, target_face) -> tuple[np.ndarray, np.ndarray] | None:
+    """Align the target face to the model's template → (blob (3,S,S), M)."""
+    spec = _SWAP_SPECS[kind]
+    kps = target_face.kps if hasattr(target_face, "kps") and target_face.kps is not None else None
+    if kps is None or len(kps) < 5:
+        _log(f"[swap] No 5-point kps on target face — aborting {kind}")
+        return None
+    aligned, M = _align_face_to_template(target, kps, spec["template"], spec["crop"])
 
+    # Preprocess target crop: BGR→RGB, [0,1], normalize, CHW
+    blob = aligned[:, :, ::-1].astype(np.float32) / 255.0
+    blob = (blob - spec["mean"]) / spec["std"]  # HyperSwap → [-1, 1], inswapper stays [0, 1]
+    return blob.transpose(2, 0, 1), M
 
-def _run_hyperswap(
+
+def _swap_infer(
+    kind: str,
     session,
-    target: np.ndarray,
-    target_face,
     source_face: _SyntheticFace,
-) -> np.ndarray | None:
-    """HyperSwap 256: align, swap via ONNX, paste back."""
-    try:
-        h, w = target.shape[:2]
-        crop_size = 256
+    target_blobs: np.ndarray,
+    chunk_size: int = 1,
+) -> np.ndarray:
+    """
+    Run the swap model on N aligned crops (N,3,S,S) → N BGR uint8 crops (N,S,S,3).
 
-        # Get 5-point keypoints from target face
-        kps = target_face.kps if hasattr(target_face, "kps") and target_face.kps is not None else None
-        if kps is None or len(kps) < 5:
-            _log("[hyperswap] No 5-point kps on target face — aborting")
-            return None
+    Crops go through the model chunk_size at a time when the exported graph has a
+    dynamic batch axis; models with a fixed batch of 1 run one crop per call.
+    """
+    spec = _SWAP_SPECS[kind]
+    inputs = session.get_inputs()
+    source_name = target_name = None
+    for inp in inputs:
+        if "source" in inp.name.lower():
+            source_name = inp.name
+        elif "target" in inp.name.lower():
+            target_name = inp.name
+        elif inp.shape and len(inp.shape) == 2:
+            source_name = inp.name  # guess by shape
+        else:
+            target_name = inp.name
+    target_input = next(i for i in inputs if i.name == target_name)
+    batch_dim = target_input.shape[0] if target_input.shape else 1
+    if isinstance(batch_dim, int):
+        chunk_size = 1
 
-        # Align target face to arcface template at 256x256
-        aligned, M = _align_face_to_template(target, kps, _ARCFACE_TEMPLATE_128, crop_size)
-
-        # Preprocess target crop: BGR→RGB, [0,1], normalize, NCHW
-        target_blob = aligned[:, :, ::-1].astype(np.float32) / 255.0
-        target_blob = (target_blob - 0.5) / 0.5  # → [-1, 1]
-        target_blob = target_blob.transpose(2, 0, 1)[np.newaxis, ...]  # (1,3,256,256)
-
-        # Source embedding: normed ArcFace embedding
-        source_blob = source_face.normed_embedding.reshape(1, -1).astype(np.float32)
-
-        # Get ONNX input names
-        inputs = session.get_inputs()
-        input_map = {}
-        for inp in inputs:
-            if "source" in inp.name.lower():
-                input_map[inp.name] = source_blob
-            elif "target" in inp.name.lower():
-                input_map[inp.name] = target_blob
-            else:
-                # Guess by shape
-                if inp.shape and len(inp.shape) == 2:
-                    input_map[inp.name] = source_blob
-                else:
-                    input_map[inp.name] = target_blob
+    # Source: normed ArcFace embedding, projected through emap for inswapper
+    source_blob = _source_latent(kind, source_face)
 
-        # Run ONNX inference
-        outputs = session.run(None, input_map)
-        pred = outputs[0]  # (1, 3, 256, 256) RGB [-1, 1]
+    preds = []
+    for i in range(0, len(target_blobs), chunk_size):
+        chunk = np.ascontiguousarray(target_blobs[i:i + chunk_size], dtype=np.float32)
+        feeds = {source_name: np.repeat(source_blob, len(chunk), axis=0), target_name: chunk}
+        preds.append(session.run(None, feeds)[0])  # (n, 3, S, S) RGB, normalized like the input
+    pred = np.concatenate(preds, axis=0)
 
-        # Postprocess: NCHW→HWC, [-1,1]→[0,255], RGB→BGR
-        pred = pred.squeeze(0).transpose(1, 2, 0)
-        pred = np.clip((pred + 1) * 127.5, 0, 255).astype(np.uint8)
-        pred = pred[:, :, ::-1]  # RGB→BGR
-
-        # Inverse-warp back to original image coordinates
-        M_inv = cv2.invertAffineTransform(M)
-        warped = cv2.warpAffine(pred, M_inv, (w, h), borderMode=cv2.BORDER_REPLICATE)
-
-        # Create mask in aligned space, warp back for compositing
-        mask_256 = np.ones((crop_size, crop_size), dtype=np.float32)
-        # Shrink edges to avoid border artifacts
-        border = 8
-        mask_256[:border, :] = 0
-        mask_256[-border:, :] = 0
-        mask_256[:, :border] = 0
-        mask_256[:, -border:] = 0
-        mask_256 = cv2.GaussianBlur(mask_256, (15, 15), 5)
-        mask_full = cv2.warpAffine(mask_256, M_inv, (w, h))
-
-        # Alpha composite
-        mask_3ch = np.stack([mask_full] * 3, axis=-1)
-        result = (target.astype(np.float32) * (1 - mask_3ch) +
-                  warped.astype(np.float32) * mask_3ch)
-        result = np.clip(result, 0, 255).astype(np.uint8)
-
-        _log(f"[hyperswap] 256x256 swap done, pred range=[{pred.min()},{pred.max()}]")
-        return result
+    # Postprocess: NCHW→NHWC, de-normalize → [0,255], RGB→BGR
+    pred = pred.transpose(0, 2, 3, 1)
+    pred = np.clip((pred * spec["std"] + spec["mean"]) * 255.0, 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(pred[..., ::-1])
 
-    except Exception as e:
-        _log(f"[hyperswap] FAILED: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+
+def _swap_paste(target: np.ndarray, pred: np.ndarray, M: np.ndarray, roi: bool = True) -> np.ndarray:
+    """
+    Inverse-warp a swapped square crop back onto the target with a feathered border.
+
+    With roi=True the warp and blend cover only the crop's footprint in the
+    target (the mask is zero everywhere else); roi=False is the full-frame path,
+    kept for benchmarking.
+    """
+    h, w = target.shape[:2]
+    crop_size = pred.shape[0]
+
+    M_inv = cv2.invertAffineTransform(M)
+    x1, y1, x2, y2 = 0, 0, w, h
+    if roi:
+        corners = np.array([[0, 0], [crop_size, 0], [0, crop_size], [crop_size, crop_size]], dtype=np.float32)
+        foot = corners @ M_inv[:, :2].T + M_inv[:, 2]
+        x1 = max(0, int(np.floor(foot[:, 0].min())) - 1)
+        y1 = max(0, int(np.floor(foot[:, 1].min())) - 1)
+        x2 = min(w, int(np.ceil(foot[:, 0].max())) + 2)
+        y2 = min(h, int(np.ceil(foot[:, 1].max())) + 2)
+        if x2 <= x1 or y2 <= y1:
+            return target.copy()
+        M_inv = M_inv.copy()
+        M_inv[:, 2] -= (x1, y1)
+    rw, rh = x2 - x1, y2 - y1
+
+    # Inverse-warp back to original image coordinates
+    warped = cv2.warpAffine(pred, M_inv, (rw, rh), borderMode=cv2.BORDER_REPLICATE)
+
+    # Create mask in aligned space, warp back for compositing
+    mask_crop = np.ones((crop_size, crop_size), dtype=np.float32)
+    # Shrink edges to avoid border artifacts (8 px at 256, scaled with the crop)
+    border = max(4, crop_size // 32)
+    mask_crop[:border, :] = 0
+    mask_crop[-border:, :] = 0
+    mask_crop[:, :border] = 0
+    mask_crop[:, -border:] = 0
+    mask_crop = cv2.GaussianBlur(mask_crop, (15, 15), 5 * crop_size / 256)
+    mask_roi = cv2.warpAffine(mask_crop, M_inv, (rw, rh))
+
+    # Alpha composite
+    mask_3ch = mask_roi[..., np.newaxis]
+    region = target[y1:y2, x1:x2]
+    blended = (region.astype(np.float32) * (1 - mask_3ch) +
+               warped.astype(np.float32) * mask_3ch)
+    result = target.copy()
+    result[y1:y2, x1:x2] = np.clip(blended, 0, 255).astype(np.uint8)
+    return result
 
 
 # ---------------------------------------------------------------------------
 # 7. Core swap pipeline
 # ---------------------------------------------------------------------------
 
+def _load_sources(source_paths: list[str]) -> list[np.ndarray]:
+    sources = []
+    for p in source_paths:
+        img = cv2.imread(p)
+        if img is not None:
+            sources.append(img)
+        else:
+            _log(f"[swap_faces] Unreadable source: {p}")
+    return sources
+
+
+def _largest_face(faces):
+    return max(faces, key=lambda f: (f.bbox[2]-f.bbox[0]) * (f.bbox[3]-f.bbox[1]))
+
+
+# Margin around the face landmarks for ROI compositing: covers the mask blur
+# (21px kernel) and gives seamlessClone a boundary strip inside the crop.
+COMPOSITE_PAD = 48
+
+# Blend engine for step 6:
+#   poisson   → cv2.seamlessClone(MIXED_CLONE); best seams, slowest CPU stage
+#   laplacian → multi-band pyramid blend with the feathered mask; near-Poisson
+#               seams on skin at a fraction of the cost
+#   alpha     → single-band feathered alpha; cheapest, visible seams on hard edges
+BLEND_MODES = ("poisson", "laplacian", "alpha")
+BLEND_MODE = os.environ.get("FACE_SWAP_BLEND_MODE", "poisson")
+LAPLACIAN_LEVELS = int(os.environ.get("FACE_SWAP_LAPLACIAN_LEVELS", "5"))
+
+
+def _alpha_blend(src: np.ndarray, dst: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    mask_3ch = mask[..., np.newaxis]
+    out = dst.astype(np.float32) * (1 - mask_3ch) + src.astype(np.float32) * mask_3ch
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def _laplacian_blend(src: np.ndarray, dst: np.ndarray, mask: np.ndarray, levels: int = LAPLACIAN_LEVELS) -> np.ndarray:
+    """Burt–Adelson multi-band blend: each Laplacian band mixed with the mask's Gaussian level."""
+    h, w = dst.shape[:2]
+    levels = max(1, min(levels, int(np.log2(max(2, min(h, w)))) - 3))
+    gs, gd, gm = [src.astype(np.float32)], [dst.astype(np.float32)], [mask.astype(np.float32)]
+    for _ in range(levels):
+        gs.append(cv2.pyrDown(gs[-1]))
+        gd.append(cv2.pyrDown(gd[-1]))
+        gm.append(cv2.pyrDown(gm[-1]))
+
+    m = gm[-1][..., np.newaxis]
+    out = gs[-1] * m + gd[-1] * (1 - m)
+    for i in range(levels - 1, -1, -1):
+        size = (gs[i].shape[1], gs[i].shape[0])
+        ls = gs[i] - cv2.pyrUp(gs[i + 1], dstsize=size)
+        ld = gd[i] - cv2.pyrUp(gd[i + 1], dstsize=size)
+        m = gm[i][..., np.newaxis]
+        out = cv2.pyrUp(out, dstsize=size) + ls * m + ld * (1 - m)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def _composite(
+    target: np.ndarray,
+    target_face,
+    swapped: np.ndarray,
+    roi: bool = True,
+    blend_mode: str | None = None,
+) -> np.ndarray:
+    """
+    Steps 4–6: mask → LAB match → blend (BLEND_MODE unless given), onto target.
+
+    With roi=True all three run on a padded crop around the face and the result
+    is pasted back; pixels outside the crop are target pixels either way (the
+    mask is zero there). roi=False runs the same chain on the full frame.
+    """
+    if roi:
+        pad = max(COMPOSITE_PAD, int(0.1 * max(target_face.bbox[2] - target_face.bbox[0],
+                                               target_face.bbox[3] - target_face.bbox[1])))
+        x1, y1, x2, y2 = _composite_roi(target_face, target.shape, pad)
+    else:
+        x1, y1, x2, y2 = 0, 0, target.shape[1], target.shape[0]
+    tgt = target[y1:y2, x1:x2]
+    src = swapped[y1:y2, x1:x2]
+
+    # ── 4. Create feathered face mask ────────────────────────────────
+    mask = _create_face_mask(tgt.shape, target_face, blur_radius=21, origin=(x1, y1))
+    _log(f"[swap_faces] Mask created on {x2-x1}x{y2-y1} region, "
+         f"coverage={mask.sum()/mask.size*100:.1f}%")
+
+    # ── 5. LAB color match (swapped → target skin tone) ─────────────
+    src = _color_match_lab(src, tgt, mask)
+    _log("[swap_faces] LAB color match done")
+
+    # ── 6. Blend (poisson / laplacian / alpha) ──────────────────────
+    mode = blend_mode or BLEND_MODE
+    if mode not in BLEND_MODES:
+        _log(f"[swap_faces] Unknown blend mode {mode!r} — using poisson")
+        mode = "poisson"
+
+    if mode == "laplacian":
+        blended = _laplacian_blend(src, tgt, mask)
+        _log("[swap_faces] Laplacian pyramid blend done")
+    elif mode == "alpha":
+        blended = _alpha_blend(src, tgt, mask)
+        _log("[swap_faces] Alpha blend done")
+    else:
+        mask_u8 = (mask * 255).astype(np.uint8)
+        _, mask_binary = cv2.threshold(mask_u8, 1, 255, cv2.THRESH_BINARY)
+
+        moments = cv2.moments(mask_binary)
+        if moments["m00"] > 0:
+            cx = int(moments["m10"] / moments["m00"])
+            cy = int(moments["m01"] / moments["m00"])
+            blended = cv2.seamlessClone(src, tgt, mask_binary, (cx, cy), cv2.MIXED_CLONE)
+            _log("[swap_faces] seamlessClone(MIXED_CLONE) done")
+        else:
+            # Fallback: alpha blend with feathered mask
+            blended = _alpha_blend(src, tgt, mask)
+            _log("[swap_faces] Alpha blend fallback (seamlessClone center failed)")
+
+    if not roi:
+        return blended
+    result = target.copy()
+    result[y1:y2, x1:x2] = blended
+    return result
+
+
+# Pipeline profiles: detection sizes (None = DET_SIZES), blend mode (None =
+# BLEND_MODE) and the optional stages each runs. standard is the full pipeline.
+# adaptive: restore / upscale only the images whose measurements call for it
+# (see _assess); premium always runs both.
+PIPELINE_PROFILES = {
+    "preview": {"det_sizes": [320], "blend_mode": "alpha", "restore": False, "upscale": False,
+                "adaptive": True},
+    "standard": {"det_sizes": None, "blend_mode": None, "restore": True, "upscale": True,
+                 "adaptive": True},
+    "premium": {"det_sizes": [640, 1024], "blend_mode": "poisson", "restore": True, "upscale": True,
+                "adaptive": False},
+}
+PIPELINE_PROFILE = os.environ.get("FACE_SWAP_PROFILE", "standard")
+
+# Optional stages, most expensive first: the order they are dropped in when a
+# latency budget would be exceeded. Cost estimates are per unit (restore: per
+# face, upscale: per input megapixel), smoothed over previous runs.
+OPTIONAL_STAGES = ("upscale", "restore")
+_STAGE_COST_DEFAULT = {"restore": 0.4, "upscale": 0.8}
+_stage_cost: dict[str, float] = {}
+_STAGE_COST_ALPHA = 0.3
+
+
+def _resolve_profile(name: str | None) -> tuple[str, dict]:
+    name = name or PIPELINE_PROFILE
+    if name not in PIPELINE_PROFILES:
+        _log(f"[swap_faces] Unknown profile {name!r} — using standard")
+        name = "standard"
+    return name, PIPELINE_PROFILES[name]
+
+
+def job_object_path(params: dict, key: str) -> str | None:
+    """Uploads-bucket object path from params[key]; ValueError unless relative."""
+    value = params.get(key)
+    if value is None or value == "":
+        return None
+    if (not isinstance(value, str) or value.startswith("/") or "\\" in value
+            or ".." in value.split("/")):
+        raise ValueError(f"{key} must be a relative uploads-bucket path, got {value!r}")
+    return value
+
+
+def job_swap_options(params: dict, path_key: str = "output_path") -> dict:
+    """
+    do_face_swap (path_key output_path) / do_face_swap_batch (output_prefix)
+    kwargs from job input keys profile / latency_budget_sec / output_side /
+    path_key plus the encode options (encode.job_options). Raises ValueError
+    for values the pipeline can't use, so handlers can reject the job up front.
+    """
+    profile = params.get("profile")
+    if profile is not None and profile != "" and profile not in PIPELINE_PROFILES:
+        raise ValueError(f"profile must be one of {sorted(PIPELINE_PROFILES)}, got {profile!r}")
+    return {
+        "profile": profile or None,
+        "budget_sec": encode.job_number(params, "latency_budget_sec"),
+        "output_side": encode.job_number(params, "output_side", int),
+        path_key: job_object_path(params, path_key),
+        "encode_opts": encode.job_options(params),
+    }
+
+
+def _record_stage_cost(stage: str, seconds: float, units: float) -> None:
+    if units <= 0:
+        return
+    per_unit = seconds / units
+    prev = _stage_cost.get(stage)
+    _stage_cost[stage] = per_unit if prev is None else prev + _STAGE_COST_ALPHA * (per_unit - prev)
+
+
+def _estimate_stage(stage: str, units: float) -> float:
+    return _stage_cost.get(stage, _STAGE_COST_DEFAULT[stage]) * units
+
+
+def _plan_stages(profile: dict, units: dict[str, float], remaining: float | None,
+                 skipped: dict[str, str]) -> list[str]:
+    """
+    Optional stages to run: those the profile enables, minus the most expensive
+    ones (OPTIONAL_STAGES order) until the estimates fit the remaining budget.
+    Dropped stages are recorded in skipped with the reason.
+    """
+    planned = []
+    for stage in OPTIONAL_STAGES:
+        if profile.get(stage):
+            planned.append(stage)
+        else:
+            skipped.setdefault(stage, "profile")
+    if remaining is None:
+        return planned
+    for stage in OPTIONAL_STAGES:
+        if stage in planned and sum(_estimate_stage(s, units[s]) for s in planned) > remaining:
+            planned.remove(stage)
+            skipped[stage] = "budget"
+    return planned
+
+
+# Adaptive skipping thresholds. A face is restored unless it is too small for
+# restoration to show (< RESTORE_MIN_FACE_PX on its short side) or already
+# sharp (Laplacian variance of the inner face ROI, measured at <= 512 px, at
+# least RESTORE_SHARPNESS_MIN). An image is upscaled while its long side is
+# below the requested output side (job output_side, else UPSCALE_TARGET_SIDE).
+RESTORE_SHARPNESS_MIN = float(os.environ.get("FACE_SWAP_RESTORE_SHARPNESS_MIN", "120"))
+RESTORE_MIN_FACE_PX = int(os.environ.get("FACE_SWAP_RESTORE_MIN_FACE_PX", "48"))
+UPSCALE_TARGET_SIDE = int(os.environ.get("FACE_SWAP_UPSCALE_TARGET_SIDE", "2048"))
+_SHARPNESS_MAX_SIDE = 512
+
+
+def _face_sharpness(img: np.ndarray, face) -> tuple[float, int]:
+    """(Laplacian variance of the inner 80% of the face box, face short side in px)."""
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = face.bbox[:4]
+    size = int(min(x2 - x1, y2 - y1))
+    mx, my = (x2 - x1) * 0.1, (y2 - y1) * 0.1
+    x1, y1 = max(0, int(x1 + mx)), max(0, int(y1 + my))
+    x2, y2 = min(w, int(x2 - mx)), min(h, int(y2 - my))
+    if x2 - x1 < 8 or y2 - y1 < 8:
+        return 0.0, max(size, 0)
+    roi = cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+    s = _SHARPNESS_MAX_SIDE / max(roi.shape)
+    if s < 1.0:
+        roi = cv2.resize(roi, (max(1, int(roi.shape[1] * s)), max(1, int(roi.shape[0] * s))),
+                         interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(roi, cv2.CV_32F).var()), size
+
+
+def _assess(images: list[np.ndarray], faces: list[list], profile: dict,
+            output_side: int | None, records: list[dict]) -> dict[str, list[bool]]:
+    """
+    Per-image restore / upscale decisions from cheap measurements.
+
+    records[i] receives the measurements, thresholds and decisions for
+    images[i] (returned in job stats so the thresholds can be tuned offline);
+    _run_optional adds whether each stage actually ran (restore / upscale).
+    """
+    want = output_side or UPSCALE_TARGET_SIDE
+    needs = {"restore": [], "upscale": []}
+    for img, img_faces, rec in zip(images, faces, records):
+        measured = [_face_sharpness(img, f) for f in img_faces if f is not None]
+        sharpness = min((m[0] for m in measured), default=0.0)
+        face_px = max((m[1] for m in measured), default=0)
+        long_side = max(img.shape[:2])
+        if not profile.get("adaptive"):
+            restore, r_why = True, "forced"
+            upscale, u_why = True, "forced"
+        else:
+            if not measured:
+                restore, r_why = True, "no_face_box"
+            elif face_px < RESTORE_MIN_FACE_PX:
+                restore, r_why = False, "face_small"
+            elif sharpness >= RESTORE_SHARPNESS_MIN:
+                restore, r_why = False, "face_sharp"
+            else:
+                restore, r_why = True, "face_soft"
+            upscale, u_why = (True, "below_output_side") if long_side < want else (False, "resolution_met")
+        rec.update({
+            "sharpness": round(sharpness, 1), "face_px": face_px, "long_side": long_side,
+            "output_side": want, "sharpness_min": RESTORE_SHARPNESS_MIN, "min_face_px": RESTORE_MIN_FACE_PX,
+            "restore_needed": restore, "restore_reason": r_why,
+            "upscale_needed": upscale, "upscale_reason": u_why,
+        })
+        needs["restore"].append(restore)
+        needs["upscale"].append(upscale)
+    return needs
+
+
+def _run_optional(images: list[np.ndarray], faces: list[list], profile: dict, stats: dict,
+                  deadline: float | None, records: list[dict],
+                  output_side: int | None = None) -> list[np.ndarray]:
+    """
+    Steps 7–8 (restore, upscale) for the images that need them (_assess),
+    planned against the deadline; upscale is re-checked after restore.
+    """
+    run = stats.setdefault("stages_run", [])
+    skipped = stats.setdefault("stages_skipped", {})
+    t_assess = time.time()
+    needs = _assess(images, faces, profile, output_side, records)
+    stats["assess_sec"] = round(stats.get("assess_sec", 0.0) + time.time() - t_assess, 4)
+    images = list(images)
+
+    restore_idx = [i for i, need in enumerate(needs["restore"]) if need]
+    upscale_idx = [i for i, need in enumerate(needs["upscale"]) if need]
+    units = {"restore": sum(len(faces[i]) for i in restore_idx),
+             "upscale": sum(images[i].shape[0] * images[i].shape[1] for i in upscale_idx) / 1e6}
+    remaining = None if deadline is None else deadline - time.time()
+    stages = _plan_stages(profile, units, remaining, skipped)
+    for stage, idx in (("restore", restore_idx), ("upscale", upscale_idx)):
+        if stage in stages and not idx:
+            stages.remove(stage)
+            skipped[stage] = "not_needed"
+    for stage in OPTIONAL_STAGES:
+        for rec, need in zip(records, needs[stage]):
+            rec[stage] = need and stage in stages
+
+    if "restore" in stages:
+        t0 = time.time()
+        # ── 7. CodeFormer / GFPGAN restoration ───────────────────────
+        restored = _restore_faces([images[i] for i in restore_idx], [faces[i] for i in restore_idx],
+                                  fidelity=0.75)
+        for i, img in zip(restore_idx, restored):
+            images[i] = img
+        _record_stage_cost("restore", time.time() - t0, units["restore"])
+        stats["restore_sec"] = round(stats.get("restore_sec", 0.0) + time.time() - t0, 3)
+        run.append("restore")
+    if "upscale" in stages:
+        if deadline is not None and time.time() + _estimate_stage("upscale", units["upscale"]) > deadline:
+            skipped["upscale"] = "budget"
+            for rec in records:
+                rec["upscale"] = False
+            _log("[swap_faces] Latency budget: upscale dropped after restore")
+            return images
+        t0 = time.time()
+        # ── 8. Real-ESRGAN x2 upscale ────────────────────────────────
+        for i in upscale_idx:
+            images[i] = _upscale(images[i], outscale=2)
+        _record_stage_cost("upscale", time.time() - t0, units["upscale"])
+        stats["upscale_sec"] = round(stats.get("upscale_sec", 0.0) + time.time() - t0, 3)
+        run.append("upscale")
+    return images
+
+
+def _finish_swap(
+    target: np.ndarray,
+    target_face,
+    swapped: np.ndarray,
+    profile: dict | None = None,
+    stats: dict | None = None,
+    deadline: float | None = None,
+    output_side: int | None = None,
+) -> np.ndarray:
+    """Steps 4–8: mask → LAB match → blend → restore → upscale, per profile and deadline."""
+    profile = profile or PIPELINE_PROFILES["standard"]
+    stats = stats if stats is not None else {}
+    result = _composite(target, target_face, swapped, blend_mode=profile.get("blend_mode"))
+    stats.setdefault("stages_run", []).append("composite")
+    quality = stats.setdefault("quality", {})
+    return _run_optional([result], [[target_face]], profile, stats, deadline, [quality], output_side)[0]
+
+
 def swap_faces(
     source_paths: list[str],
     target_path: str,
+    stats: dict | None = None,
+    profile: str | None = None,
+    budget_sec: float | None = None,
+    output_side: int | None = None,
 ) -> np.ndarray | None:
     """
     Full pipeline: multi-image identity → swap → blend → color → restore → upscale.
@@ -652,35 +1433,35 @@ def swap_faces(
     Args:
         source_paths: 1+ paths to source face photos (all same person)
         target_path:  path to target image (FLUX-generated scene)
+        stats:        optional dict filled with per-run metadata (identity cache,
+                      profile, stages_run / stages_skipped, ...)
+        profile:      PIPELINE_PROFILES key (default PIPELINE_PROFILE)
+        budget_sec:   optional latency budget; restore / upscale are dropped
+                      (upscale first) when their estimates would exceed it
+        output_side:  requested long side of the output; upscaling is skipped
+                      once the image reaches it (default UPSCALE_TARGET_SIDE)
 
     Returns:
         Final BGR image or None on failure.
     """
     t0 = time.time()
-    _log(f"[swap_faces] ENTER: {len(source_paths)} source(s), target={target_path}")
-
-    # ── Load images ──────────────────────────────────────────────────
-    sources = []
-    for p in source_paths:
-        img = cv2.imread(p)
-        if img is not None:
-            sources.append(img)
-        else:
-            _log(f"[swap_faces] Unreadable source: {p}")
-    if not sources:
-        _log("[swap_faces] FAIL: no readable sources")
-        return None
+    stats = stats if stats is not None else {}
+    profile, prof = _resolve_profile(profile)
+    stats["profile"] = profile
+    deadline = t0 + budget_sec if budget_sec else None
+    _log(f"[swap_faces] ENTER: {len(source_paths)} source(s), target={target_path}, profile={profile}")
 
+    # ── Load target ──────────────────────────────────────────────────
     target = cv2.imread(target_path)
     if target is None:
         _log("[swap_faces] FAIL: target unreadable")
         return None
 
-    _log(f"[swap_faces] Loaded {len(sources)} source(s), target={target.shape}")
+    _log(f"[swap_faces] Loaded target={target.shape}")
 
-    # ── 1. Extract & average embeddings ──────────────────────────────
+    # ── 1. Extract & average embeddings (cached per source set) ─────
     try:
-        avg_embedding = average_embeddings(sources)
+        avg_embedding = _identity_for_sources(source_paths, stats)
     except ValueError as e:
         _log(f"[swap_faces] FAIL: {e}")
         return None
@@ -688,14 +1469,12 @@ def swap_faces(
     synthetic_face = _SyntheticFace(avg_embedding)
 
     # ── 2. Detect face in target ─────────────────────────────────────
-    app = _get_face_app()
-    target_faces = app.get(target)
+    target_faces = _detect_faces(target, "landmarks", stats, sizes=prof["det_sizes"])
     if not target_faces:
         _log("[swap_faces] FAIL: no face in target image")
         return None
 
-    target_face = max(target_faces,
-                      key=lambda f: (f.bbox[2]-f.bbox[0]) * (f.bbox[3]-f.bbox[1]))
+    target_face = _largest_face(target_faces)
     _log(f"[swap_faces] Target face bbox: {target_face.bbox.astype(int).tolist()}")
 
     # ── 3. Swap with averaged embedding ──────────────────────────────
@@ -705,117 +1484,391 @@ def swap_faces(
         _log("[swap_faces] FAIL: swap returned None")
         return None
     _log(f"[swap_faces] Swap done ({swap_kind}), shape={swapped.shape}")
+    stats.setdefault("stages_run", []).extend(["detect", "swap"])
 
-    # ── 4. Create feathered face mask ────────────────────────────────
-    mask = _create_face_mask(target.shape, target_face, blur_radius=21)
-    _log(f"[swap_faces] Mask created, coverage={mask.sum()/mask.size*100:.1f}%")
+    # ── 4–8. Blend, color, restore, upscale ─────────────────────────
+    result = _finish_swap(target, target_face, swapped, prof, stats, deadline, output_side)
 
-    # ── 5. LAB color match (swapped → target skin tone) ─────────────
-    swapped = _color_match_lab(swapped, target, mask)
-    _log("[swap_faces] LAB color match done")
+    elapsed = round(time.time() - t0, 2)
+    _log(f"[swap_faces] DONE: {result.shape}, {elapsed}s total")
+    return result
 
-    # ── 6. seamlessClone with feathered mask ─────────────────────────
-    mask_u8 = (mask * 255).astype(np.uint8)
-    _, mask_binary = cv2.threshold(mask_u8, 1, 255, cv2.THRESH_BINARY)
 
-    moments = cv2.moments(mask_binary)
-    if moments["m00"] > 0:
-        cx = int(moments["m10"] / moments["m00"])
-        cy = int(moments["m01"] / moments["m00"])
-        result = cv2.seamlessClone(swapped, target, mask_binary, (cx, cy), cv2.MIXED_CLONE)
-        _log("[swap_faces] seamlessClone(MIXED_CLONE) done")
-    else:
-        # Fallback: alpha blend with feathered mask
-        mask_3ch = np.stack([mask] * 3, axis=-1)
-        result = (target.astype(np.float32) * (1 - mask_3ch) +
-                  swapped.astype(np.float32) * mask_3ch)
-        result = np.clip(result, 0, 255).astype(np.uint8)
-        _log("[swap_faces] Alpha blend fallback (seamlessClone center failed)")
+SWAP_BATCH_SIZE = int(os.environ.get("FACE_SWAP_BATCH_SIZE", "8"))
 
-    # ── 7. CodeFormer / GFPGAN restoration ───────────────────────────
-    result = _restore_face(result, fidelity=0.75)
 
-    # ── 8. Real-ESRGAN x2 upscale ───────────────────────────────────
-    result = _upscale(result, outscale=2)
+def swap_faces_batch(
+    source_paths: list[str],
+    target_paths: list[str],
+    chunk_size: int = SWAP_BATCH_SIZE,
+    profile: str | None = None,
+    budget_sec: float | None = None,
+    output_side: int | None = None,
+) -> tuple[list[np.ndarray | None], dict]:
+    """
+    One identity onto many targets (scenario packs).
+
+    The averaged source embedding is computed once; aligned target crops go
+    through the swap model chunk_size at a time, each result is
+    composited, all faces are restored in shared batches, then each image is
+    upscaled. profile / budget_sec / output_side work as in swap_faces, the
+    budget over the whole pack; per_image[i]["quality"] holds the adaptive
+    restore / upscale measurements and decisions.
+
+    Returns (results, stats): results[i] is the BGR image for target_paths[i]
+    or None when that target failed; stats holds per-image seconds and
+    aggregate throughput.
+    """
+    t0 = time.time()
+    profile, prof = _resolve_profile(profile)
+    deadline = t0 + budget_sec if budget_sec else None
+    _log(f"[swap_faces_batch] ENTER: {len(source_paths)} source(s), {len(target_paths)} target(s), "
+         f"profile={profile}")
+    results: list[np.ndarray | None] = [None] * len(target_paths)
+    per_image = [{"target": os.path.basename(p), "ok": False, "seconds": 0.0} for p in target_paths]
+    stats = {"images": len(target_paths), "succeeded": 0, "per_image": per_image, "profile": profile,
+             "stages_run": ["detect", "swap", "composite"], "stages_skipped": {}}
 
-    elapsed = round(time.time() - t0, 2)
-    _log(f"[swap_faces] DONE: {result.shape}, {elapsed}s total")
-    return result
+    try:
+        synthetic_face = _SyntheticFace(_identity_for_sources(source_paths, stats))
+    except ValueError as e:
+        _log(f"[swap_faces_batch] FAIL: {e}")
+        return results, stats
+    stats["identity_sec"] = round(time.time() - t0, 3)
+
+    # ── Detect + align every target ─────────────────────────────────
+    swap_kind, swap_model = _get_swapper()
+    prepared = []  # (index, target, target_face, blob, M)
+    for i, path in enumerate(target_paths):
+        t_img = time.time()
+        try:
+            target = cv2.imread(path)
+            if target is None:
+                _log(f"[swap_faces_batch] Target {i} unreadable: {path}")
+                per_image[i]["error"] = "unreadable"
+                continue
+            faces = _detect_faces(target, "landmarks", stats, sizes=prof["det_sizes"])
+            if not faces:
+                _log(f"[swap_faces_batch] Target {i}: no face")
+                per_image[i]["error"] = "no face"
+                continue
+            face = _largest_face(faces)
+            aligned = _swap_align(swap_kind, target, face)
+            if aligned is None:
+                per_image[i]["error"] = "alignment failed"
+                continue
+            prepared.append((i, target, face, *aligned))
+        except Exception as e:
+            _log(f"[swap_faces_batch] Target {i} FAILED in detect/align: {e}")
+            per_image[i]["error"] = str(e)[:200]
+        finally:
+            per_image[i]["seconds"] += time.time() - t_img
+
+    # ── Batched swap inference ──────────────────────────────────────
+    t_swap = time.time()
+    preds = []
+    if prepared:
+        try:
+            preds = list(_swap_infer(swap_kind, swap_model, synthetic_face,
+                                     np.stack([p[3] for p in prepared]), chunk_size=chunk_size))
+        except Exception as e:
+            # Isolate the bad crop: retry one at a time, dropping those that fail.
+            _log(f"[swap_faces_batch] {swap_kind} batch FAILED: {e} — retrying per target")
+            kept = []
+            for p in prepared:
+                try:
+                    preds.append(_swap_infer(swap_kind, swap_model, synthetic_face, p[3][np.newaxis])[0])
+                    kept.append(p)
+                except Exception as e_one:
+                    _log(f"[swap_faces_batch] Target {p[0]} swap FAILED: {e_one}")
+                    per_image[p[0]]["error"] = str(e_one)[:200]
+            prepared = kept
+    stats["swap_infer_sec"] = round(time.time() - t_swap, 3)
+    infer_share = (time.time() - t_swap) / max(len(prepared), 1)
+
+    # ── Composite each result ───────────────────────────────────────
+    composited = []  # (index, image, face)
+    for j, (i, target, face, _blob, M) in enumerate(prepared):
+        t_img = time.time()
+        try:
+            swapped = _swap_paste(target, preds[j], M)
+            composited.append((i, _composite(target, face, swapped, blend_mode=prof["blend_mode"]), face))
+        except Exception as e:
+            _log(f"[swap_faces_batch] Target {i} FAILED: {e}")
+            per_image[i]["error"] = str(e)[:200]
+        per_image[i]["seconds"] += time.time() - t_img + infer_share
+
+    # ── Restore all faces in shared batches, then upscale ───────────
+    t_opt = time.time()
+    images = [c[1] for c in composited]
+    records = [per_image[c[0]].setdefault("quality", {}) for c in composited]
+    try:
+        images = _run_optional(images, [[c[2]] for c in composited], prof, stats, deadline, records, output_side)
+    except Exception as e:
+        _log(f"[swap_faces_batch] Restore / upscale FAILED: {e} — keeping composited")
+        for stage in OPTIONAL_STAGES:
+            if stage not in stats["stages_run"]:
+                stats["stages_skipped"].setdefault(stage, "error")
+    opt_share = (time.time() - t_opt) / max(len(composited), 1)
+
+    for (i, _img, _face), img in zip(composited, images):
+        results[i] = img
+        per_image[i]["ok"] = True
+        per_image[i]["seconds"] += opt_share
+
+    for item in per_image:
+        item["seconds"] = round(item["seconds"], 3)
+    total = time.time() - t0
+    stats["succeeded"] = sum(1 for item in per_image if item["ok"])
+    stats["total_sec"] = round(total, 3)
+    stats["images_per_sec"] = round(stats["succeeded"] / total, 3) if total > 0 else 0.0
+    _log(f"[swap_faces_batch] DONE: {stats['succeeded']}/{len(target_paths)} in {total:.2f}s "
+         f"({stats['images_per_sec']} img/s, swap={swap_kind}, chunk={chunk_size})")
+    return results, stats
 
 
 # ---------------------------------------------------------------------------
 # Public API — download, swap, encode
 # ---------------------------------------------------------------------------
 
-def warmup():
-    """Pre-load models at worker startup."""
-    _log("[face_swap] Warmup: loading models...")
-    try:
-        _get_face_app()
-    except Exception as e:
-        _log(f"[face_swap] Warmup FaceAnalysis failed: {e}")
+# Warmup tiers: the worker accepts jobs once the critical tier (source
+# embedding, target detection + landmarks, swap model) is loaded; the rest
+# keeps loading in the background. A job reaching a background model first
+# blocks on that model's lock until its load completes.
+WARMUP_TIERS = {
+    "critical": {
+        "face:embed": lambda: _get_face_app("embed"),
+        "face:landmarks": lambda: _get_face_app("landmarks"),
+        "swapper": lambda: _get_swapper(),
+    },
+    "background": {
+        "face:detect": lambda: _get_face_app("detect"),
+        "restorer": lambda: _get_restorer(),
+        "upscaler": lambda: _get_upscaler(),
+    },
+}
+
+_warmup_futures: dict[str, Future] = {}
+_warmup_timings: dict[str, dict] = {}
+
+
+def _warm_one(tier: str, name: str, load) -> None:
+    t0 = time.time()
+    ok = True
     try:
-        _get_swapper()
+        load()
     except Exception as e:
-        _log(f"[face_swap] Warmup inswapper failed: {e}")
-    _get_restorer()
-    _get_upscaler()
-    _log("[face_swap] Warmup done")
+        ok = False
+        _log(f"[face_swap] Warmup {name} failed: {e}")
+    _warmup_timings[name] = {"tier": tier, "sec": round(time.time() - t0, 2), "ok": ok}
+    _log(f"[face_swap] Warmup {name}: {_warmup_timings[name]['sec']}s ({tier})")
+
+
+def warmup(wait_critical: bool = True) -> dict:
+    """
+    Load all models concurrently; return once the critical tier is ready.
+
+    Returns warmup_status() at that point; background loads keep running.
+    """
+    t0 = time.time()
+    _log("[face_swap] Warmup: loading models...")
+    loaders = [(tier, name, load) for tier, models in WARMUP_TIERS.items() for name, load in models.items()]
+    pool = ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="warmup")
+    for tier, name, load in loaders:
+        _warmup_futures[name] = pool.submit(_warm_one, tier, name, load)
+    pool.shutdown(wait=False)
+
+    done_lock = threading.Lock()
+    logged = []
+
+    def _all_done(_fut):
+        with done_lock:
+            if logged or not all(f.done() for f in _warmup_futures.values()):
+                return
+            logged.append(True)
+        _log(f"[face_swap] Warmup done ({time.time()-t0:.1f}s): {_warmup_timings}")
+
+    for fut in _warmup_futures.values():
+        fut.add_done_callback(_all_done)
+
+    if wait_critical:
+        wait([_warmup_futures[name] for name in WARMUP_TIERS["critical"]])
+        _log(f"[face_swap] Critical models ready ({time.time()-t0:.1f}s) — "
+             f"background: {sorted(n for n in WARMUP_TIERS['background'] if not _warmup_futures[n].done())}")
+    return warmup_status()
+
+
+def warmup_status() -> dict:
+    """Per-tier readiness and per-model load timings so far."""
+    return {
+        "ready": {
+            tier: all(n in _warmup_futures and _warmup_futures[n].done() for n in models)
+            for tier, models in WARMUP_TIERS.items()
+        },
+        "models": dict(_warmup_timings),
+    }
+
+
+def _deliver(enc: encode.Encoded, output_path: str | None, tag: str) -> dict:
+    """
+    Hand an encoded result back as a job payload.
+
+    With output_path (an uploads-bucket object path; its extension is replaced
+    by the encoded format's) the bytes are posted straight to storage and only
+    the path + metadata are returned; without it, or when the upload fails, the
+    payload carries image_base64 as before.
+    """
+    meta = enc.meta()
+    if output_path:
+        output_path = os.path.splitext(output_path)[0] + enc.ext
+        t0 = time.time()
+        url, err = upload_bytes_to_uploads(enc.data, output_path, enc.content_type)
+        if url:
+            _log(f"[{tag}] OK: {len(enc.data)} bytes {enc.format} → uploads/{output_path} "
+                 f"({time.time()-t0:.2f}s)")
+            return {"output_path": output_path, "output_url": url,
+                    "sha256": hashlib.sha256(enc.data).hexdigest(), **meta}
+        _log(f"[{tag}] Upload to {output_path} failed ({err}) — falling back to base64")
+        meta["output_error"] = err
+
+    b64 = base64.b64encode(enc.data).decode("ascii")
+    _log(f"[{tag}] OK: {len(b64)} chars base64 ({enc.format})")
+    return {"image_base64": b64, **meta}
+
+
+def _download_sources(scratch, user_photo_urls: list[str], tag: str) -> list[str]:
+    source_paths = []
+    for i, url in enumerate(user_photo_urls):
+        path = scratch.path(f"source_{i}.jpg", size_hint=8 * 1024 * 1024)
+        if download_from_url(url, path):
+            _log(f"[{tag}] Source {i}: {os.path.getsize(path)} bytes")
+            source_paths.append(path)
+        else:
+            _log(f"[{tag}] Source {i} download failed — skipping")
+    return source_paths
 
 
 def do_face_swap(
     user_photo_urls: list[str] | str,
     scenario_image_url: str,
-) -> str | None:
+    stats: dict | None = None,
+    output_path: str | None = None,
+    encode_opts: dict | None = None,
+    profile: str | None = None,
+    budget_sec: float | None = None,
+    output_side: int | None = None,
+) -> dict | None:
     """
-    Download images, run full swap pipeline, return base64-encoded JPEG.
+    Download images, run full swap pipeline, return the result payload.
 
+    The result is encoded with encode.encode(**encode_opts) (format, quality or
+    size / SSIM target). The payload is {output_path, output_url, ...metadata}
+    when output_path is given and the upload succeeds, else
+    {image_base64, ...metadata} (see _deliver).
     Accepts a list of source URLs (or single URL for backward compat).
+    If stats is given it is filled with run metadata for the job result.
+    profile / budget_sec / output_side select the quality tier (see
+    swap_faces); the budget counts from the start of the pipeline, after
+    downloads.
     """
     if isinstance(user_photo_urls, str):
         user_photo_urls = [user_photo_urls]
 
     _log(f"[do_face_swap] ENTER: {len(user_photo_urls)} source(s)")
 
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with job_scratch("ot_swap_") as scratch:
         try:
             # Download all source photos
-            source_paths = []
-            for i, url in enumerate(user_photo_urls):
-                path = os.path.join(tmpdir, f"source_{i}.jpg")
-                if download_from_url(url, path):
-                    _log(f"[do_face_swap] Source {i}: {os.path.getsize(path)} bytes")
-                    source_paths.append(path)
-                else:
-                    _log(f"[do_face_swap] Source {i} download failed — skipping")
+            source_paths = _download_sources(scratch, user_photo_urls, "do_face_swap")
 
             if not source_paths:
                 _log("[do_face_swap] FAIL: all source downloads failed")
                 return None
 
             # Download target
-            target_path = os.path.join(tmpdir, "target.jpg")
+            target_path = scratch.path("target.jpg", size_hint=8 * 1024 * 1024)
             if not download_from_url(scenario_image_url, target_path):
                 _log("[do_face_swap] FAIL: target download failed")
                 return None
 
             # Run pipeline
-            result = swap_faces(source_paths, target_path)
+            result = swap_faces(source_paths, target_path, stats, profile, budget_sec, output_side)
             if result is None:
                 _log("[do_face_swap] FAIL: swap_faces returned None")
                 return None
 
-            # Encode
-            ok, buf = cv2.imencode(".jpg", result, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            if not ok:
-                _log("[do_face_swap] FAIL: imencode failed")
-                return None
-
-            b64 = base64.b64encode(buf.tobytes()).decode("ascii")
-            _log(f"[do_face_swap] OK: {len(b64)} chars base64")
-            return b64
+            # Encode + upload (or base64)
+            return _deliver(encode.encode(result, **(encode_opts or {})), output_path, "do_face_swap")
 
         except Exception as e:
             import traceback
             _log(f"[do_face_swap] EXCEPTION: {e}\n{traceback.format_exc()}")
             return None
+
+
+def do_face_swap_batch(
+    user_photo_urls: list[str] | str,
+    scenario_image_urls: list[str],
+    output_prefix: str | None = None,
+    encode_opts: dict | None = None,
+    profile: str | None = None,
+    budget_sec: float | None = None,
+    output_side: int | None = None,
+) -> tuple[list[dict | None], dict]:
+    """
+    Download one identity's sources and a scenario pack, run swap_faces_batch,
+    return (result payload per scenario — None where it failed, stats).
+
+    Results are encoded together on encode's thread pool. With output_prefix,
+    scenario i is uploaded to <output_prefix>/<i><ext>. stats["per_image"][i]
+    describes scenario i (download failures included). An unexpected error
+    returns the payloads delivered so far with stats["error"] set.
+    """
+    if isinstance(user_photo_urls, str):
+        user_photo_urls = [user_photo_urls]
+
+    _log(f"[do_face_swap_batch] ENTER: {len(user_photo_urls)} source(s), {len(scenario_image_urls)} scenario(s)")
+    encoded: list[dict | None] = [None] * len(scenario_image_urls)
+    stats = {"images": len(scenario_image_urls), "succeeded": 0}
+
+    with job_scratch("ot_swap_batch_") as scratch:
+        try:
+            source_paths = _download_sources(scratch, user_photo_urls, "do_face_swap_batch")
+            if not source_paths:
+                _log("[do_face_swap_batch] FAIL: all source downloads failed")
+                return encoded, stats
+
+            target_paths, target_index = [], []
+            for i, url in enumerate(scenario_image_urls):
+                path = scratch.path(f"target_{i}.jpg", size_hint=8 * 1024 * 1024)
+                if download_from_url(url, path):
+                    target_paths.append(path)
+                    target_index.append(i)
+                else:
+                    _log(f"[do_face_swap_batch] Scenario {i} download failed — skipping")
+
+            results, stats = swap_faces_batch(source_paths, target_paths, profile=profile, budget_sec=budget_sec,
+                                              output_side=output_side)
+            # per_image is indexed like target_paths: re-key it by scenario
+            per_image = [{"target": f"target_{i}.jpg", "ok": False, "seconds": 0.0, "error": "download failed"}
+                         for i in range(len(scenario_image_urls))]
+            for i, item in zip(target_index, stats.get("per_image", [])):
+                per_image[i] = item
+            stats["per_image"] = per_image
+            stats["images"] = len(scenario_image_urls)
+
+            done = [(i, r) for i, r in zip(target_index, results) if r is not None]
+            t_enc = time.time()
+            encs = encode.encode_batch([r for _i, r in done], **(encode_opts or {}))
+            stats["encode_sec"] = round(time.time() - t_enc, 3)
+            for (i, _result), enc in zip(done, encs):
+                path = f"{output_prefix.rstrip('/')}/{i:03d}{enc.ext}" if output_prefix else None
+                encoded[i] = _deliver(enc, path, f"do_face_swap_batch:{i}")
+            return encoded, stats
+
+        except Exception as e:
+            import traceback
+            _log(f"[do_face_swap_batch] EXCEPTION: {e}\n{traceback.format_exc()}")
+            stats["error"] = f"{type(e).__name__}: {str(e)[:200]}"
+            stats["succeeded"] = sum(1 for p in encoded if p)
+            return encoded, stats
@@ -31,6 +31,14 @@ UPSCALE_FACTOR = 2  # 2x or 4x
 
 
 def load_upscaler():
+    """Tiled RRDBNet engine when local weights exist, else the realesrgan package (downloads weights)."""
+    try:
+        from upscaler import get_upscaler
+        tiled = get_upscaler(scale=UPSCALE_FACTOR)
+        if tiled is not None:
+            return tiled
+    except Exception as e:
+        print("Tiled upscaler unavailable, trying realesrgan package:", e, file=sys.stderr)
     try:
         from realesrgan import RealESRGAN
         device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -150,7 +158,12 @@ def generate(
         upscaler = load_upscaler()
         if upscaler is not None:
             try:
-                sr_image = upscaler.predict(image)
+                if hasattr(upscaler, "enhance"):
+                    import numpy as np
+                    bgr = np.asarray(image.convert("RGB"))[:, :, ::-1]
+                    sr_image = np.ascontiguousarray(upscaler.enhance(bgr, outscale=UPSCALE_FACTOR)[:, :, ::-1])
+                else:
+                    sr_image = upscaler.predict(image)
                 if hasattr(sr_image, "save"):
                     sr_image.save(output_path)
                 else:
@@ -9,9 +9,9 @@ Result: person in scene with the correct facial identity.
 import gc
 import os
 import shutil
-import tempfile
 
-import cv2
+import encode
+from scratch import job_scratch
 
 
 def generate_and_swap(
@@ -27,6 +27,7 @@ def generate_and_swap(
     seed: int = None,
     width: int = 1024,
     height: int = 1024,
+    swap_profile: str = None,
 ):
     """
     Generate a scene image with FLUX, then swap the source face onto it.
@@ -42,16 +43,15 @@ def generate_and_swap(
         num_inference_steps: FLUX inference steps.
         guidance_scale: FLUX guidance scale.
         seed: Optional seed for reproducibility.
+        swap_profile: face_swap pipeline profile (preview / standard / premium).
     """
     from generate_flux import generate
     from face_swap import swap_faces
 
     # Step 1: Generate base scene image with FLUX.
     # Do NOT upscale here — face_swap pipeline handles upscale after swap.
-    base_fd, base_path = tempfile.mkstemp(suffix=".png", prefix="flux_base_")
-    os.close(base_fd)
-
-    try:
+    with job_scratch("flux_base_") as scratch:
+        base_path = scratch.path("base.png", size_hint=16 * 1024 * 1024)
         print(f"[generate_swap] Step 1: FLUX generation (lora={'yes' if lora_path else 'no'})", flush=True)
         generate(
             prompt=prompt,
@@ -84,7 +84,7 @@ def generate_and_swap(
 
         # Step 2: Swap the source face onto the generated scene.
         print(f"[generate_swap] Step 2: FaceFusion face swap (source={source_face_path})", flush=True)
-        result = swap_faces([source_face_path], base_path)
+        result = swap_faces([source_face_path], base_path, profile=swap_profile)
 
         if result is None:
             print("[generate_swap] Face swap returned None — using FLUX output as fallback", flush=True)
@@ -92,11 +92,6 @@ def generate_and_swap(
             # Do NOT reload FLUX for upscale — that would OOM. Just copy the base.
             shutil.copy(base_path, output_path)
         else:
-            cv2.imwrite(output_path, result, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            print(f"[generate_swap] Done: {result.shape}, saved to {output_path}", flush=True)
-    finally:
-        if os.path.isfile(base_path):
-            try:
-                os.remove(base_path)
-            except OSError:
-                pass
+            enc = encode.save(output_path, result)
+            print(f"[generate_swap] Done: {result.shape}, saved to {output_path} "
+                  f"({enc.format}, {len(enc.data)} bytes)", flush=True)
@@ -47,17 +47,21 @@ def handler(job):
     start = time.time()
     try:
         if job_type == "faceswap":
-            from face_swap import do_face_swap
+            from face_swap import do_face_swap, job_swap_options
             user_photo_urls = inp.get("user_photo_urls") or []
             if not user_photo_urls and inp.get("user_photo_url"):
                 user_photo_urls = [inp["user_photo_url"]]
             scenario_image_url = inp.get("scenario_image_url") or ""
             if not user_photo_urls or not scenario_image_url:
                 return {"status": "failed", "error": "Missing user_photo_urls or scenario_image_url"}
-            result_b64 = do_face_swap(user_photo_urls, scenario_image_url)
-            if not result_b64:
+            try:
+                swap_opts = job_swap_options(inp, "output_path")
+            except ValueError as e:
+                return {"status": "failed", "error": f"Invalid job input: {e}"}
+            payload = do_face_swap(user_photo_urls, scenario_image_url, **swap_opts)
+            if not payload:
                 return {"status": "failed", "error": "Face swap processing failed"}
-            return {"status": "completed", "output": {"image_base64": result_b64}}
+            return {"status": "completed", "output": payload}
         if job_type == "decode_watermark":
             from watermark import decode_from_url
             image_url = inp.get("image_url") or ""
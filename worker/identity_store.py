@@ -0,0 +1,233 @@
+"""
+Persistent identity store: one embedding row per identity in a memory-mapped
+array file, plus a JSON index (id → row, source hashes, model version).
+
+Layout under IDENTITY_STORE_DIR:
+  embeddings.bin   (capacity, dim) array, float16 by default (IDENTITY_STORE_DTYPE)
+  index.json       {"dim", "dtype", "capacity", "rows": {id: {...}}}
+  .lock            flock guarding writers; readers take it shared
+
+A record is only returned when its model version (and, if given, its source
+hashes) match the caller's, so a changed photo set or recognition model falls
+through to recomputation. A record may carry a small JSON meta dict (e.g. the
+face box an embedding came from).
+
+The store holds at most IDENTITY_STORE_MAX_ROWS identities. Past that, writes
+evict the oldest rows (by updated_at; cache rows such as "sources:" before
+"subject:" rows) and reuse their slots, so the array and index stop growing.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+IDENTITY_STORE_DTYPE = os.environ.get("IDENTITY_STORE_DTYPE", "float16")
+IDENTITY_STORE_MAX_ROWS = int(os.environ.get("IDENTITY_STORE_MAX_ROWS", "20000"))
+EMBEDDING_DIM = 512
+_GROW_ROWS = 256
+
+
+def _default_root() -> str:
+    if os.environ.get("IDENTITY_STORE_DIR"):
+        return os.environ["IDENTITY_STORE_DIR"]
+    if os.path.isdir("/runpod-volume"):
+        return "/runpod-volume/identity_store"
+    return os.path.expanduser("~/.cache/onlytwins/identity_store")
+
+
+@dataclass
+class IdentityRecord:
+    identity_id: str
+    embedding: np.ndarray
+    source_hashes: list[str] = field(default_factory=list)
+    model_version: str = ""
+    meta: dict = field(default_factory=dict)
+
+
+class IdentityStore:
+    def __init__(self, root: str | None = None, dim: int = EMBEDDING_DIM, dtype: str = IDENTITY_STORE_DTYPE,
+                 max_rows: int = IDENTITY_STORE_MAX_ROWS):
+        self.root = root or _default_root()
+        self.max_rows = max(1, max_rows)
+        os.makedirs(self.root, exist_ok=True)
+        self._data_path = os.path.join(self.root, "embeddings.bin")
+        self._index_path = os.path.join(self.root, "index.json")
+        self._lock_path = os.path.join(self.root, ".lock")
+        self._mutex = threading.Lock()
+        self._index: dict | None = None
+        self._index_mtime = 0.0
+        self._mm: np.memmap | None = None
+        self._mm_capacity = 0
+        self._default_dim = dim
+        self._default_dtype = dtype
+
+    # ── reads ───────────────────────────────────────────────────────
+
+    def get(
+        self,
+        identity_id: str,
+        *,
+        model_version: str,
+        source_hashes: list[str] | None = None,
+    ) -> np.ndarray | None:
+        """Stored float32 embedding, or None if missing / stale."""
+        with self._mutex, self._flock(exclusive=False):
+            index = self._load_index()
+            rec = index["rows"].get(identity_id)
+            if rec is None or rec.get("model_version") != model_version:
+                return None
+            if source_hashes is not None and sorted(source_hashes) != rec.get("source_hashes"):
+                return None
+            mm = self._map(index, writable=False)
+            return np.array(mm[rec["row"]], dtype=np.float32)
+
+    def get_many(self, identity_ids: list[str], *, model_version: str) -> dict[str, IdentityRecord]:
+        """Records (with meta) for the ids present at model_version, under one lock."""
+        out: dict[str, IdentityRecord] = {}
+        with self._mutex, self._flock(exclusive=False):
+            index = self._load_index()
+            mm = None
+            for rid in identity_ids:
+                rec = index["rows"].get(rid)
+                if rec is None or rec.get("model_version") != model_version:
+                    continue
+                if mm is None:
+                    mm = self._map(index, writable=False)
+                out[rid] = IdentityRecord(rid, np.array(mm[rec["row"]], dtype=np.float32),
+                                          list(rec.get("source_hashes", [])), model_version,
+                                          dict(rec.get("meta", {})))
+        return out
+
+    # ── writes ──────────────────────────────────────────────────────
+
+    def put(
+        self,
+        identity_id: str,
+        embedding: np.ndarray,
+        *,
+        model_version: str,
+        source_hashes: list[str] | None = None,
+        meta: dict | None = None,
+    ) -> None:
+        self.put_many([IdentityRecord(identity_id, embedding, list(source_hashes or []), model_version,
+                                      dict(meta or {}))])
+
+    def put_many(self, records: list[IdentityRecord]) -> None:
+        """Insert or overwrite several identities under one lock + one index write."""
+        if not records:
+            return
+        with self._mutex, self._flock(exclusive=True):
+            index = self._load_index()
+            rows = index["rows"]
+            ids = {r.identity_id for r in records}
+            new_ids = ids - rows.keys()
+            self._evict(rows, len(rows) + len(new_ids) - self.max_rows, keep=ids)
+            used = {r["row"] for r in rows.values()}
+            free = [i for i in range(index["capacity"]) if i not in used]
+            if len(new_ids) > len(free):
+                old = index["capacity"]
+                index["capacity"] = old + len(new_ids) - len(free) + _GROW_ROWS
+                self._resize(index)
+                free += range(old, index["capacity"])
+            free.reverse()  # pop() hands out the lowest free slot first
+            mm = self._map(index, writable=True)
+            now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            for rec in records:
+                emb = np.asarray(rec.embedding, dtype=np.float32).reshape(-1)
+                if emb.shape[0] != index["dim"]:
+                    raise ValueError(f"embedding dim {emb.shape[0]} != store dim {index['dim']}")
+                entry = rows.get(rec.identity_id)
+                if entry is None:
+                    entry = rows[rec.identity_id] = {"row": free.pop()}
+                mm[entry["row"]] = emb
+                entry["source_hashes"] = sorted(rec.source_hashes)
+                entry["model_version"] = rec.model_version
+                if rec.meta:
+                    entry["meta"] = rec.meta
+                else:
+                    entry.pop("meta", None)
+                entry["updated_at"] = now
+            mm.flush()
+            self._write_index(index)
+
+    # ── internals ───────────────────────────────────────────────────
+
+    @staticmethod
+    def _evict(rows: dict, count: int, keep: set) -> None:
+        """Drop count rows: cache rows (sources:, face:) before subject rows, oldest first."""
+        if count <= 0:
+            return
+        victims = sorted((rid for rid in rows if rid not in keep),
+                         key=lambda rid: (rid.startswith("subject:"), rows[rid].get("updated_at", "")))
+        for rid in victims[:count]:
+            del rows[rid]
+
+    def _flock(self, exclusive: bool):
+        f = open(self._lock_path, "a+")
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return f
+
+    def _load_index(self) -> dict:
+        try:
+            mtime = os.path.getmtime(self._index_path)
+        except OSError:
+            self._index = {"dim": self._default_dim, "dtype": self._default_dtype, "capacity": 0, "rows": {}}
+            self._index_mtime = 0.0
+            return self._index
+        if self._index is None or mtime != self._index_mtime:
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    def _write_index(self, index: dict) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, self._index_path)
+        self._index_mtime = os.path.getmtime(self._index_path)
+
+    def _resize(self, index: dict) -> None:
+        itemsize = np.dtype(index["dtype"]).itemsize
+        with open(self._data_path, "ab") as f:
+            f.truncate(index["capacity"] * index["dim"] * itemsize)
+        self._mm = None  # remap at the new size
+
+    def _map(self, index: dict, writable: bool) -> np.memmap:
+        if self._mm is None or self._mm_capacity != index["capacity"] or (writable and self._mm.mode != "r+"):
+            self._mm = np.memmap(
+                self._data_path,
+                dtype=index["dtype"],
+                mode="r+" if writable else "r",
+                shape=(index["capacity"], index["dim"]),
+            )
+            self._mm_capacity = index["capacity"]
+        return self._mm
+
+
+_store: IdentityStore | None = None
+_store_failed = False
+
+
+def get_store() -> IdentityStore | None:
+    """Process-wide store, or None when IDENTITY_STORE_DISABLED / dir unusable."""
+    global _store, _store_failed
+    if _store is not None or _store_failed:
+        return _store
+    if os.environ.get("IDENTITY_STORE_DISABLED") == "1":
+        _store_failed = True
+        return None
+    try:
+        _store = IdentityStore()
+    except OSError as e:
+        print(f"[identity_store] disabled: {e}", flush=True)
+        _store_failed = True
+    return _store
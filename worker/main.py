@@ -8,7 +8,6 @@ Generation: FLUX + LoRA + IP-Adapter + ControlNet -> Real-ESRGAN -> upload to up
 """
 
 import os
-import tempfile
 import time
 import uuid
 import requests
@@ -24,23 +23,28 @@ from storage import (
     download_from_url,
     download_many_from_uploads,
     download_from_model_artifacts,
+    upload_bytes_to_uploads,
     upload_to_model_artifacts,
-    upload_to_uploads,
 )
+from scratch import job_scratch
 
 APP_URL = os.environ.get("APP_URL", "").rstrip("/")
 WORKER_SECRET = os.environ.get("WORKER_SECRET", "")
+# Stable per process: the jobs API leases generation jobs to this id, so a
+# re-poll returns the jobs still leased to us and omits reassigned ones.
+WORKER_ID = os.environ.get("WORKER_ID") or f"worker-{uuid.uuid4()}"
 
 
 def headers():
     return {
         "Authorization": f"Bearer {WORKER_SECRET}",
         "Content-Type": "application/json",
+        "X-Worker-Id": WORKER_ID,
     }
 
 
 def poll_jobs():
-    """Fetch pending training and generation jobs from app internal API."""
+    """Fetch pending training and generation jobs from app internal API (None, None on failure)."""
     if not APP_URL or not WORKER_SECRET:
         print("Poll skip: APP_URL or WORKER_SECRET not set")
         return None, None
@@ -48,12 +52,12 @@ def poll_jobs():
         r = requests.get(f"{APP_URL}/api/internal/worker/jobs", headers=headers(), timeout=30)
         if r.status_code != 200:
             print(f"Poll HTTP {r.status_code} (check WORKER_SECRET and APP_URL)")
-            return [], []
+            return None, None
         data = r.json()
         return data.get("training_jobs", []), data.get("generation_jobs", [])
     except Exception as e:
         print(f"Poll error: {e}")
-        return [], []
+        return None, None
 
 
 def subject_consent_allowed(subject_id: str) -> bool:
@@ -144,6 +148,62 @@ def get_preset(preset_id: str) -> dict:
     return {}
 
 
+# ── Input fetching (prefetch-aware) ───────────────────────────────
+# main() stages the inputs of queued jobs while the current one runs; these
+# helpers take a staged copy when one exists and download otherwise.
+
+_prefetcher = None
+
+
+def _download_reference(reference_image_path: str, dest: str) -> bool:
+    if reference_image_path.strip().startswith("http"):
+        return download_from_url(reference_image_path, dest)
+    return download_from_uploads(reference_image_path, dest)
+
+
+def _download_lora(lora_model_reference: str, dest: str) -> bool:
+    if lora_model_reference.startswith("model_artifacts/"):
+        return download_from_model_artifacts(lora_model_reference.replace("model_artifacts/", "", 1), dest)
+    storage_path = lora_model_reference
+    if storage_path.startswith("uploads/"):
+        storage_path = storage_path.replace("uploads/", "", 1)
+    return download_from_uploads(storage_path, dest)
+
+
+def _job_inputs(job: dict) -> list:
+    """(key, fetch(dest) -> bool) for every remote input a job reads."""
+    inputs = []
+    for path in job.get("sample_paths") or []:
+        inputs.append((f"sample:{path}", lambda dest, p=path: download_from_uploads(p, dest)))
+    ref = job.get("reference_image_path") or ""
+    if ref:
+        inputs.append((f"ref:{ref}", lambda dest, r=ref: _download_reference(r, dest)))
+    lora = job.get("lora_model_reference")
+    if lora:
+        inputs.append((f"lora:{lora}", lambda dest, r=lora: _download_lora(r, dest)))
+    return inputs
+
+
+def _fetch_input(job_id: str, key: str, dest: str, download) -> bool:
+    if _prefetcher is not None and _prefetcher.take(job_id, key, dest):
+        return True
+    return download(dest)
+
+
+def _fetch_samples(job_id: str, sample_paths: list, dest_dir: str) -> list:
+    """Same naming/result contract as storage.download_many_from_uploads."""
+    if _prefetcher is None:
+        return download_many_from_uploads(sample_paths, dest_dir)
+    os.makedirs(dest_dir, exist_ok=True)
+    local_paths = []
+    for i, path in enumerate(sample_paths):
+        name = path.split("/")[-1] if "/" in path else path
+        local = os.path.join(dest_dir, f"{i:04d}_{name}")
+        if _fetch_input(job_id, f"sample:{path}", local, lambda dest, p=path: download_from_uploads(p, dest)):
+            local_paths.append(local)
+    return local_paths
+
+
 def run_training_job(job: dict) -> None:
     """
     Run LoRA training for one job.
@@ -163,9 +223,9 @@ def run_training_job(job: dict) -> None:
 
     update_training_job(job_id, "running", "Training started", started_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
 
-    with tempfile.TemporaryDirectory() as tmp:
-        samples_dir = os.path.join(tmp, "samples")
-        local_paths = download_many_from_uploads(sample_paths, samples_dir)
+    with job_scratch("ot_train_") as scratch:
+        samples_dir = scratch.dir("samples", size_hint=len(sample_paths) * 8 * 1024 * 1024)
+        local_paths = _fetch_samples(job_id, sample_paths, samples_dir)
         if len(local_paths) < 10:
             update_training_job(job_id, "failed", f"Could not download enough samples (got {len(local_paths)}).")
             return
@@ -174,11 +234,11 @@ def run_training_job(job: dict) -> None:
         # Filters raw uploads (no-face / wrong-person / blurry / too-small /
         # duplicate), crops usable tiles, and emits a structured report.
         # Training consumes ONLY the filtered tiles.
-        preproc_dir = os.path.join(tmp, "preproc")
+        preproc_dir = scratch.dir("preproc", size_hint=64 * 1024 * 1024)
         try:
             from preprocess_intake import preprocess_folder
             from pathlib import Path as _Path
-            report = preprocess_folder(_Path(samples_dir), _Path(preproc_dir))
+            report = preprocess_folder(_Path(samples_dir), _Path(preproc_dir), subject_id=subject_id)
         except ImportError as e:
             update_training_job(
                 job_id, "failed",
@@ -202,7 +262,7 @@ def run_training_job(job: dict) -> None:
 
         tiles_dir = os.path.join(preproc_dir, "tiles")
 
-        out_dir = os.path.join(tmp, "lora_out")
+        out_dir = scratch.dir("lora_out", size_hint=256 * 1024 * 1024)
         try:
             from train_lora import train_and_save
             lora_file = train_and_save(
@@ -247,6 +307,13 @@ def run_generation_job(job: dict) -> tuple[bool, str | None]:
         update_generation_job(job_id, "failed", None)
         return False, "consent_not_approved"
 
+    from encode import encode, job_options
+    try:
+        enc_opts = job_options(job)
+    except ValueError as e:
+        update_generation_job(job_id, "failed", None)
+        return False, f"invalid_job_input: {e}"
+
     update_generation_job(job_id, "running")
 
     preset_id = job.get("preset_id")
@@ -255,32 +322,26 @@ def run_generation_job(job: dict) -> tuple[bool, str | None]:
     negative_prompt = (preset.get("negative_prompt") or "").strip()
     lora_model_reference = job.get("lora_model_reference")
 
-    with tempfile.TemporaryDirectory() as tmp:
-        ref_local = os.path.join(tmp, "ref.jpg")
-        if reference_image_path.strip().startswith("http"):
-            if not download_from_url(reference_image_path, ref_local):
-                update_generation_job(job_id, "failed", None)
-                return False, f"ref_download_url_failed: {reference_image_path[:80]}"
-        else:
-            if not download_from_uploads(reference_image_path, ref_local):
-                update_generation_job(job_id, "failed", None)
-                return False, f"ref_download_uploads_failed: {reference_image_path[:80]}"
+    with job_scratch("ot_gen_") as scratch:
+        ref_local = scratch.path("ref.jpg", size_hint=8 * 1024 * 1024)
+        if not _fetch_input(
+            job_id, f"ref:{reference_image_path}", ref_local,
+            lambda dest: _download_reference(reference_image_path, dest),
+        ):
+            update_generation_job(job_id, "failed", None)
+            source = "url" if reference_image_path.strip().startswith("http") else "uploads"
+            return False, f"ref_download_{source}_failed: {reference_image_path[:80]}"
 
-        out_local = os.path.join(tmp, "out.png")
+        out_local = scratch.path("out.png", size_hint=32 * 1024 * 1024)
 
         # Download LoRA weights before generation (used by both paths)
         lora_local = None
         if lora_model_reference:
-            lora_local = os.path.join(tmp, "lora.safetensors")
-            downloaded = False
-            if lora_model_reference.startswith("model_artifacts/"):
-                storage_path = lora_model_reference.replace("model_artifacts/", "", 1)
-                downloaded = download_from_model_artifacts(storage_path, lora_local)
-            else:
-                storage_path = lora_model_reference
-                if storage_path.startswith("uploads/"):
-                    storage_path = storage_path.replace("uploads/", "", 1)
-                downloaded = download_from_uploads(storage_path, lora_local)
+            lora_local = scratch.path("lora.safetensors", size_hint=256 * 1024 * 1024)
+            downloaded = _fetch_input(
+                job_id, f"lora:{lora_model_reference}", lora_local,
+                lambda dest: _download_lora(lora_model_reference, dest),
+            )
             if not downloaded:
                 print(f"LoRA download failed for reference: {lora_model_reference}", flush=True)
                 lora_local = None
@@ -294,6 +355,8 @@ def run_generation_job(job: dict) -> tuple[bool, str | None]:
         override_steps = int(job.get("num_inference_steps", 0)) or None
         override_guidance = float(job.get("guidance_scale", 0)) or None
         skip_face_swap = job.get("skip_face_swap", False)
+        # Cheap mode swaps with the preview profile (no restore / upscale)
+        swap_profile = job.get("swap_profile") or ("preview" if cheap_mode else None)
 
         gen_kwargs = {}
         if override_width:
@@ -331,6 +394,7 @@ def run_generation_job(job: dict) -> tuple[bool, str | None]:
                         negative_prompt=negative_prompt,
                         upscale=True,
                         lora_path=lora_local,
+                        swap_profile=swap_profile,
                         **gen_kwargs,
                     )
                 except ImportError:
@@ -364,11 +428,28 @@ def run_generation_job(job: dict) -> tuple[bool, str | None]:
                 update_generation_job(job_id, "failed", None)
                 return False, f"watermark_failed: {e}"
 
+        # Final encode in the job's format (output_format / output_quality /
+        # target_kb / target_ssim); out_local is the lossless pipeline output.
+        # Watermarked finals stay PNG: the dwtDct mark is embedded in the
+        # pixels and a lossy re-encode after embed can wipe it out.
+        import cv2
+        final = cv2.imread(out_local)
+        if final is None:
+            update_generation_job(job_id, "failed", None)
+            return False, "output_unreadable"
+        if watermark_hash:
+            ignored = sorted(k for k, v in enc_opts.items() if v)
+            if ignored:
+                print(f"[generation:{job_id}] watermarked output: ignoring {ignored}, keeping png",
+                      flush=True)
+            enc_opts = {"fmt": "png"}
+        enc = encode(final, **enc_opts)
+        print(f"[generation:{job_id}] encoded {enc.format} q={enc.quality}: {len(enc.data)} bytes "
+              f"({enc.seconds:.2f}s)", flush=True)
+
         user_prefix = reference_image_path.split("/")[0] if "/" in reference_image_path and not reference_image_path.startswith("http") else "leads"
-        output_path = f"{user_prefix}/generated/{job_id}-{uuid.uuid4().hex[:8]}.jpg"
-        upload_result = upload_to_uploads(out_local, output_path)
-        # upload_to_uploads now returns (public_url, error_message)
-        uploaded_url, upload_err = upload_result if isinstance(upload_result, tuple) else (upload_result, None)
+        output_path = f"{user_prefix}/generated/{job_id}-{uuid.uuid4().hex[:8]}{enc.ext}"
+        uploaded_url, upload_err = upload_bytes_to_uploads(enc.data, output_path, enc.content_type)
         if not uploaded_url:
             print(f"Upload to uploads bucket failed: {upload_err}", flush=True)
             update_generation_job(job_id, "failed", None)
@@ -397,9 +478,39 @@ def run_generation_job(job: dict) -> tuple[bool, str | None]:
     return True, None
 
 
+def _still_queued(job_ids: set) -> set:
+    """
+    Re-check between jobs: the subset of job_ids still pending for this worker.
+
+    Uses the read-only status route (poll_jobs would re-lease the whole queue to
+    this worker). Prefetches for the others (reassigned / cancelled while the
+    previous job ran) are dropped. When the lookup fails every id is kept.
+    """
+    if not job_ids or not APP_URL or not WORKER_SECRET:
+        return job_ids
+    try:
+        r = requests.get(f"{APP_URL}/api/internal/worker/jobs/status", headers=headers(),
+                         params={"ids": ",".join(sorted(job_ids))}, timeout=15)
+        if r.status_code != 200:
+            print(f"Job status HTTP {r.status_code}")
+            return job_ids
+        data = r.json()
+    except Exception as e:
+        print(f"Job status error: {e}")
+        return job_ids
+    queued = set(data.get("training_job_ids", [])) | set(data.get("generation_job_ids", []))
+    if _prefetcher is not None:
+        _prefetcher.retain(queued & job_ids)
+    return queued & job_ids
+
+
 def main():
+    global _prefetcher
     poll_interval = int(os.environ.get("WORKER_POLL_INTERVAL_SEC", "15"))
     print(f"Worker started. Polling {APP_URL or 'APP_URL not set'} every {poll_interval}s.")
+    if os.environ.get("WORKER_PREFETCH", "1") != "0":
+        from prefetch import Prefetcher
+        _prefetcher = Prefetcher()
     last_idle_log = 0.0
     while True:
         training_jobs, generation_jobs = poll_jobs()
@@ -413,20 +524,32 @@ def main():
             if now - last_idle_log >= 60:
                 print("Polling... (no jobs)")
                 last_idle_log = now
-        for job in training_jobs:
-            try:
-                run_training_job(job)
-            except Exception as e:
-                print(f"Training job error: {e}")
-                import traceback
-                traceback.print_exc()
-        for job in generation_jobs:
+        queued = [(run_training_job, "Training", job) for job in training_jobs]
+        queued += [(run_generation_job, "Generation", job) for job in generation_jobs]
+        if _prefetcher is not None:
+            _prefetcher.retain(job.get("id") for _run, _kind, job in queued)
+            for _run, _kind, job in queued:
+                _prefetcher.schedule(job.get("id"), _job_inputs(job))
+        pending = {job.get("id") for _run, _kind, job in queued}
+        for i, (run_job, kind, job) in enumerate(queued):
+            job_id = job.get("id")
+            if i > 0:
+                # The previous job may have run for minutes: re-check assignment
+                # before this one takes its (prefetched) inputs.
+                pending = _still_queued(pending)
+                if job_id not in pending:
+                    print(f"{kind} job {job_id} no longer queued for this worker — skipping")
+                    continue
             try:
-                run_generation_job(job)
+                run_job(job)
             except Exception as e:
-                print(f"Generation job error: {e}")
+                print(f"{kind} job error: {e}")
                 import traceback
                 traceback.print_exc()
+            finally:
+                pending.discard(job_id)
+                if _prefetcher is not None:
+                    _prefetcher.release(job_id)
         time.sleep(poll_interval)
 
 
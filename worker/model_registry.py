@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Model registry: one index of every model file the worker can load.
+
+face_swap used to walk each model directory (and each of its subdirectories)
+for every filename it looked up. The registry instead:
+
+  - loads a prebuilt manifest (MODEL_MANIFEST, baked into the image by
+    `python model_registry.py build`) or scans MODEL_DIRS once
+  - resolves filenames with a dict lookup, same precedence as the old walk:
+    directory order, then dir/<file> before dir/<sub>/<file>
+  - records size, sha256 and format per entry; size is checked on every
+    resolve, the checksum when MODEL_REGISTRY_VERIFY=1 (once per entry)
+  - rescans on a miss at most every MODEL_REGISTRY_RESCAN_SEC, for models
+    fetched after startup (insightface packs, volume mounts)
+
+CLI:
+    python model_registry.py build [--out manifest.json] [--no-checksum]
+    python model_registry.py list
+    python model_registry.py verify
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+MODEL_DIRS = [
+    os.path.expanduser("~/.insightface/models"),
+    "/usr/local/lib/python3.10/dist-packages/.assets/models",
+    "/workspace/ComfyUI/models",
+    "/workspace/ComfyUI/models/insightface/models",
+    "/workspace/ComfyUI/models/facerestore_models",
+    "/workspace/ComfyUI/models/upscale_models",
+    "/app/models",
+]
+MODEL_MANIFEST = os.environ.get("MODEL_MANIFEST", "/app/models/manifest.json")
+MODEL_REGISTRY_VERIFY = os.environ.get("MODEL_REGISTRY_VERIFY") == "1"
+MODEL_REGISTRY_RESCAN_SEC = float(os.environ.get("MODEL_REGISTRY_RESCAN_SEC", "30"))
+
+_FORMATS = {".onnx": "onnx", ".pth": "torch", ".pt": "torch", ".ckpt": "torch",
+            ".safetensors": "safetensors", ".bin": "bin"}
+
+
+@dataclass
+class ModelEntry:
+    name: str
+    path: str
+    size: int
+    format: str
+    sha256: str | None = None
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def scan(dirs: list[str], checksum: bool = False) -> dict[str, ModelEntry]:
+    """name → first entry in lookup precedence (dir order; top level before one level down)."""
+    entries: dict[str, ModelEntry] = {}
+
+    def add(path: str, name: str) -> None:
+        fmt = _FORMATS.get(os.path.splitext(name)[1].lower())
+        if fmt is None or name in entries:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        entries[name] = ModelEntry(name, path, size, fmt, _sha256(path) if checksum else None)
+
+    for d in dirs:
+        if not os.path.isdir(d):
+            continue
+        try:
+            names = os.listdir(d)
+        except OSError:
+            continue
+        for name in names:
+            p = os.path.join(d, name)
+            if os.path.isfile(p):
+                add(p, name)
+        for sub in names:
+            sd = os.path.join(d, sub)
+            if not os.path.isdir(sd):
+                continue
+            try:
+                for name in os.listdir(sd):
+                    p = os.path.join(sd, name)
+                    if os.path.isfile(p):
+                        add(p, name)
+            except OSError:
+                continue
+    return entries
+
+
+class ModelRegistry:
+    def __init__(self, dirs: list[str] | None = None, manifest: str | None = MODEL_MANIFEST):
+        self.dirs = list(dirs or MODEL_DIRS)
+        self.manifest = manifest
+        self._lock = threading.Lock()
+        self._entries: dict[str, ModelEntry] = {}
+        self._verified: set[str] = set()
+        self._last_scan = 0.0
+        self.source = "empty"
+        if manifest and self._load_manifest(manifest):
+            self.source = "manifest"
+        else:
+            self._rescan()
+
+    def _load_manifest(self, path: str) -> bool:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self._entries = {name: ModelEntry(**e) for name, e in data["models"].items()}
+            _log(f"[model_registry] {len(self._entries)} model(s) from manifest {path}")
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            _log(f"[model_registry] manifest {path} unreadable ({e}) — scanning")
+            return False
+
+    def _rescan(self) -> None:
+        t0 = time.time()
+        found = scan(self.dirs)
+        for name, entry in self._entries.items():
+            # keep manifest checksums for unchanged files
+            if name in found and found[name].path == entry.path and found[name].size == entry.size:
+                found[name].sha256 = entry.sha256
+        self._entries = found
+        self._last_scan = time.time()
+        self.source = "scan" if self.source == "empty" else self.source
+        _log(f"[model_registry] scanned {len(self.dirs)} dir(s): {len(found)} model(s) "
+             f"({time.time()-t0:.2f}s)")
+
+    def _valid(self, entry: ModelEntry) -> bool:
+        try:
+            if os.path.getsize(entry.path) != entry.size:
+                _log(f"[model_registry] {entry.name}: size changed ({entry.path})")
+                return False
+        except OSError:
+            return False
+        if MODEL_REGISTRY_VERIFY and entry.sha256 and entry.name not in self._verified:
+            if _sha256(entry.path) != entry.sha256:
+                _log(f"[model_registry] {entry.name}: checksum mismatch ({entry.path})")
+                return False
+            self._verified.add(entry.name)
+        return True
+
+    def get(self, name: str) -> ModelEntry | None:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and self._valid(entry):
+                return entry
+            if time.time() - self._last_scan >= MODEL_REGISTRY_RESCAN_SEC:
+                self._rescan()
+                entry = self._entries.get(name)
+                if entry is not None and self._valid(entry):
+                    return entry
+        return None
+
+    def resolve(self, name: str) -> str | None:
+        entry = self.get(name)
+        return entry.path if entry else None
+
+    def entries(self) -> list[ModelEntry]:
+        return sorted(self._entries.values(), key=lambda e: e.name)
+
+
+_registry: ModelRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
+
+
+def resolve(name: str) -> str | None:
+    """Path of a model file by name, or None."""
+    return get_registry().resolve(name)
+
+
+def _log(msg: str) -> None:
+    print(msg, flush=True)
+
+
+def write_manifest(path: str, dirs: list[str], checksum: bool = True) -> dict:
+    entries = scan(dirs, checksum=checksum)
+    data = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "dirs": dirs,
+        "models": {name: asdict(e) for name, e in sorted(entries.items())},
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+    return data
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Model registry manifest tool")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Scan model dirs and write the manifest")
+    b.add_argument("--out", default=MODEL_MANIFEST)
+    b.add_argument("--dirs", default=None, help="Colon-separated dirs (default: MODEL_DIRS)")
+    b.add_argument("--no-checksum", action="store_true")
+    sub.add_parser("list", help="Print resolved models")
+    sub.add_parser("verify", help="Check every entry's size and checksum")
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        dirs = args.dirs.split(":") if args.dirs else MODEL_DIRS
+        data = write_manifest(args.out, dirs, checksum=not args.no_checksum)
+        print(f"{len(data['models'])} model(s) → {args.out}")
+        return
+
+    reg = get_registry()
+    if args.cmd == "list":
+        for e in reg.entries():
+            print(f"{e.name:40s} {e.format:12s} {e.size:>12d}  {e.path}")
+        return
+
+    bad = 0
+    for e in reg.entries():
+        ok = os.path.isfile(e.path) and os.path.getsize(e.path) == e.size
+        if ok and e.sha256:
+            ok = _sha256(e.path) == e.sha256
+        print(f"{'OK  ' if ok else 'FAIL'} {e.name}  {e.path}")
+        bad += not ok
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
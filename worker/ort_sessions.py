@@ -0,0 +1,224 @@
+"""
+Shared ONNX Runtime session factory.
+
+Every ONNX model in the worker (HyperSwap, GFPGAN, and insightface's detection /
+landmark / recognition models via sess_options) is built from the same tunables:
+
+  ORT_INTRA_OP_THREADS   intra-op pool size (0 = ORT default: physical cores)
+  ORT_INTER_OP_THREADS   inter-op pool size, used in parallel mode (0 = default)
+  ORT_EXECUTION_MODE     sequential | parallel
+  ORT_GRAPH_OPT_LEVEL    disable | basic | extended | all
+  ORT_ALLOW_SPINNING     1 / 0 — spin-wait in idle pool threads (0 on shared CPUs)
+  ORT_OPTIMIZED_MODEL_DIR  where optimized graphs are cached ("" disables)
+
+The first session for a model saves its optimized graph under the cache dir,
+keyed by model identity, opt level and provider; later cold starts load that
+graph with optimization disabled instead of re-running the optimizer.
+
+BoundSession wraps a session whose input shapes are fixed per call site and
+runs it through IO binding with preallocated device buffers, so inputs are not
+re-allocated and copied through a fresh OrtValue on every run().
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import platform
+import threading
+
+import numpy as np
+
+ORT_INTRA_OP_THREADS = int(os.environ.get("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.environ.get("ORT_INTER_OP_THREADS", "0"))
+ORT_EXECUTION_MODE = os.environ.get("ORT_EXECUTION_MODE", "sequential")
+ORT_GRAPH_OPT_LEVEL = os.environ.get("ORT_GRAPH_OPT_LEVEL", "all")
+ORT_ALLOW_SPINNING = os.environ.get("ORT_ALLOW_SPINNING", "1")
+ORT_OPTIMIZED_MODEL_DIR = os.environ.get(
+    "ORT_OPTIMIZED_MODEL_DIR", os.path.expanduser("~/.cache/onlytwins/ort_optimized")
+)
+
+
+def _log(msg: str) -> None:
+    print(msg, flush=True)
+
+
+def providers() -> list[str]:
+    """Available providers, CUDA first."""
+    try:
+        import onnxruntime as ort
+        available = ort.get_available_providers()
+        return [p for p in ["CUDAExecutionProvider", "CPUExecutionProvider"] if p in available]
+    except Exception:
+        return ["CPUExecutionProvider"]
+
+
+def session_options(opt_level: str | None = None):
+    """SessionOptions from the ORT_* tunables (shared by insightface models)."""
+    import onnxruntime as ort
+
+    so = ort.SessionOptions()
+    if ORT_INTRA_OP_THREADS > 0:
+        so.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    if ORT_INTER_OP_THREADS > 0:
+        so.inter_op_num_threads = ORT_INTER_OP_THREADS
+    so.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if ORT_EXECUTION_MODE == "parallel"
+                         else ort.ExecutionMode.ORT_SEQUENTIAL)
+    so.graph_optimization_level = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    }.get(opt_level or ORT_GRAPH_OPT_LEVEL, ort.GraphOptimizationLevel.ORT_ENABLE_ALL)
+    so.add_session_config_entry("session.intra_op.allow_spinning", ORT_ALLOW_SPINNING)
+    return so
+
+
+def _cache_path(model_path: str, provider: str) -> str | None:
+    # "all" bakes in CPU-specific layout transforms, so the key includes the
+    # ORT build and machine along with the model and provider.
+    import onnxruntime as ort
+
+    if not ORT_OPTIMIZED_MODEL_DIR:
+        return None
+    st = os.stat(model_path)
+    key = (f"{os.path.abspath(model_path)}|{st.st_size}|{st.st_mtime_ns}|{ORT_GRAPH_OPT_LEVEL}|{provider}"
+           f"|{ort.__version__}|{platform.machine()}")
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(ORT_OPTIMIZED_MODEL_DIR, f"{name}.{digest}.onnx")
+
+
+def create_session(model_path: str, provider_list: list[str] | None = None):
+    """InferenceSession with shared options and the optimized-graph cache."""
+    import onnxruntime as ort
+
+    provider_list = provider_list or providers()
+    cached = None
+    try:
+        cached = _cache_path(model_path, provider_list[0])
+    except OSError:
+        pass
+
+    if cached and os.path.isfile(cached):
+        try:
+            session = ort.InferenceSession(cached, sess_options=session_options("disable"),
+                                           providers=provider_list)
+            _log(f"[ort] {os.path.basename(model_path)}: optimized graph from cache")
+            return session
+        except Exception as e:
+            _log(f"[ort] cached graph {cached} unusable ({e}) — rebuilding")
+
+    so = session_options()
+    tmp = None
+    if cached:
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            so.optimized_model_filepath = tmp
+        except OSError:
+            tmp = None
+    session = ort.InferenceSession(model_path, sess_options=so, providers=provider_list)
+    if tmp and os.path.isfile(tmp):
+        os.replace(tmp, cached)
+        _log(f"[ort] {os.path.basename(model_path)}: optimized graph cached → {cached}")
+    return session
+
+
+def insightface_kwargs() -> dict:
+    """kwargs for FaceAnalysis / model_zoo.get_model (forwarded to InferenceSession)."""
+    return {"providers": providers(), "sess_options": session_options()}
+
+
+_ONNX_TO_NUMPY = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+    "tensor(uint8)": np.uint8,
+}
+
+
+def _concrete_shape(shape, batch: int) -> list[int] | None:
+    """Output shape with a symbolic leading axis filled from the batch; None if other axes are symbolic."""
+    if not shape:
+        return None
+    dims = [batch if i == 0 and not isinstance(d, int) else d for i, d in enumerate(shape)]
+    return dims if all(isinstance(d, int) for d in dims) else None
+
+
+class BoundSession:
+    """
+    IO-bound runner for models whose inputs keep the same shapes per call site.
+
+    Input buffers (and outputs whose shape is known once the batch is) are
+    allocated on the session's device once per distinct input-shape signature
+    and reused; run() updates the inputs in place and returns CPU copies of the
+    outputs. Exposes get_inputs()/get_outputs()/run() like InferenceSession.
+    """
+
+    def __init__(self, session):
+        import onnxruntime as ort
+
+        self.session = session
+        self._ort = ort
+        self._device = "cuda" if session.get_providers()[0] == "CUDAExecutionProvider" else "cpu"
+        self._inputs = session.get_inputs()
+        self._outputs = session.get_outputs()
+        self._bindings: dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get_inputs(self):
+        return self._inputs
+
+    def get_outputs(self):
+        return self._outputs
+
+    def get_providers(self):
+        return self.session.get_providers()
+
+    def _binding_for(self, feeds: dict[str, np.ndarray]):
+        sig = tuple((name, arr.shape, arr.dtype.str) for name, arr in sorted(feeds.items()))
+        entry = self._bindings.get(sig)
+        if entry is None:
+            binding = self.session.io_binding()
+            values = {}
+            for name, arr in feeds.items():
+                value = self._ort.OrtValue.ortvalue_from_shape_and_type(arr.shape, arr.dtype.type, self._device, 0)
+                binding.bind_ortvalue_input(name, value)
+                values[name] = value
+            batch = next(iter(feeds.values())).shape[0]
+            for out in self._outputs:
+                shape = _concrete_shape(out.shape, batch)
+                if shape is None:
+                    binding.bind_output(out.name, self._device)
+                else:
+                    value = self._ort.OrtValue.ortvalue_from_shape_and_type(
+                        shape, _ONNX_TO_NUMPY.get(out.type, np.float32), self._device, 0)
+                    binding.bind_ortvalue_output(out.name, value)
+            entry = self._bindings[sig] = (binding, values)
+        return entry
+
+    def run(self, output_names, feeds: dict[str, np.ndarray]) -> list[np.ndarray]:
+        with self._lock:
+            binding, values = self._binding_for(feeds)
+            for name, arr in feeds.items():
+                values[name].update_inplace(np.ascontiguousarray(arr))
+            self.session.run_with_iobinding(binding)
+            outputs = binding.copy_outputs_to_cpu()
+        if output_names is None:
+            return outputs
+        index = {o.name: i for i, o in enumerate(self._outputs)}
+        return [outputs[index[n]] for n in output_names]
+
+
+def create_bound_session(model_path: str, provider_list: list[str] | None = None):
+    """create_session() wrapped in BoundSession; plain session if IO binding is unavailable."""
+    session = create_session(model_path, provider_list)
+    try:
+        import onnxruntime as ort
+        if not hasattr(ort.OrtValue, "update_inplace"):
+            return session
+        return BoundSession(session)
+    except Exception as e:
+        _log(f"[ort] IO binding unavailable for {os.path.basename(model_path)}: {e}")
+        return session
@@ -0,0 +1,197 @@
+"""
+Input prefetcher for jobs waiting in the worker's local queue.
+
+main.py polls a batch of jobs and runs them one at a time. While the current job
+computes, the prefetcher downloads the next jobs' inputs (reference images,
+training samples, LoRA artifacts) into a bounded staging area:
+
+  - small inputs are held in memory up to PREFETCH_MAX_MEMORY_BYTES
+  - larger ones are kept on disk under the staging dir up to PREFETCH_MAX_DISK_BYTES
+  - anything that does not fit is dropped and the job downloads it itself
+
+Jobs claim staged inputs with take(); prefetches for jobs that disappear from the
+next poll (reassigned / cancelled) are dropped with retain().
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+PREFETCH_MAX_MEMORY_BYTES = int(os.environ.get("PREFETCH_MAX_MEMORY_BYTES", str(256 * 1024 * 1024)))
+PREFETCH_MAX_DISK_BYTES = int(os.environ.get("PREFETCH_MAX_DISK_BYTES", str(4 * 1024 * 1024 * 1024)))
+PREFETCH_MEMORY_ITEM_MAX_BYTES = 32 * 1024 * 1024  # larger items always stage on disk
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "4"))
+PREFETCH_TAKE_TIMEOUT_SEC = float(os.environ.get("PREFETCH_TAKE_TIMEOUT_SEC", "120"))
+
+# fetch(dest_path) -> bool, same contract as storage.download_* helpers
+FetchFn = Callable[[str], bool]
+
+
+class _Staged:
+    """One prefetched input: in flight, in memory, on disk, or dropped."""
+
+    def __init__(self, job_id: str, key: str):
+        self.job_id = job_id
+        self.key = key
+        self.future: Optional[Future] = None
+        self.data: Optional[bytes] = None
+        self.path: Optional[str] = None
+        self.size = 0
+        self.cancelled = False
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        staging_dir: Optional[str] = None,
+        max_memory_bytes: int = PREFETCH_MAX_MEMORY_BYTES,
+        max_disk_bytes: int = PREFETCH_MAX_DISK_BYTES,
+        workers: int = PREFETCH_WORKERS,
+    ):
+        self.staging_dir = staging_dir or tempfile.mkdtemp(prefix="ot_prefetch_")
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._items: dict[tuple[str, str], _Staged] = {}
+        self._memory_used = 0
+        self._disk_used = 0
+
+    # ── scheduling ──────────────────────────────────────────────────
+
+    def schedule(self, job_id: str, inputs: Iterable[tuple[str, FetchFn]]) -> None:
+        """Start fetching a job's inputs. Already-scheduled keys are ignored."""
+        if not job_id:
+            return
+        with self._lock:
+            for key, fetch in inputs:
+                if not key or (job_id, key) in self._items:
+                    continue
+                item = _Staged(job_id, key)
+                self._items[(job_id, key)] = item
+                item.future = self._pool.submit(self._run, item, fetch)
+
+    def retain(self, job_ids: Iterable[str]) -> None:
+        """Drop every prefetch whose job is not in job_ids (e.g. reassigned)."""
+        keep = set(job_ids)
+        with self._lock:
+            stale = {item.job_id for item in self._items.values() if item.job_id not in keep}
+        for job_id in stale:
+            print(f"[prefetch] job {job_id} no longer queued — cancelling", flush=True)
+            self.release(job_id)
+
+    def release(self, job_id: str) -> None:
+        """Cancel in-flight fetches and free staged bytes for one job."""
+        with self._lock:
+            items = [item for (jid, _k), item in self._items.items() if jid == job_id]
+            for item in items:
+                del self._items[(item.job_id, item.key)]
+                item.cancelled = True
+                if item.future is not None:
+                    item.future.cancel()
+                self._free_locked(item)
+
+    # ── consumption ─────────────────────────────────────────────────
+
+    def take(self, job_id: str, key: str, dest_path: str) -> bool:
+        """Move a staged input to dest_path. Waits for an in-flight fetch.
+
+        Returns False when nothing usable was prefetched; the caller then
+        downloads the input itself.
+        """
+        with self._lock:
+            item = self._items.get((job_id, key))
+        if item is None:
+            return False
+        try:
+            if item.future is not None:
+                item.future.result(timeout=PREFETCH_TAKE_TIMEOUT_SEC)
+        except Exception:
+            pass
+        with self._lock:
+            if self._items.pop((job_id, key), None) is None:
+                return False
+            data, path = item.data, item.path
+            item.data = None
+            item.path = None
+            if data is not None:
+                self._memory_used -= item.size
+            elif path is not None:
+                self._disk_used -= item.size
+        try:
+            if data is not None:
+                with open(dest_path, "wb") as f:
+                    f.write(data)
+                return True
+            if path is not None:
+                shutil.move(path, dest_path)
+                return True
+        except OSError as e:
+            print(f"[prefetch] take {key[:80]} failed: {e}", flush=True)
+        return False
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    # ── internals ───────────────────────────────────────────────────
+
+    def _run(self, item: _Staged, fetch: FetchFn) -> None:
+        if item.cancelled:
+            return
+        with self._lock:
+            disk_full = self._disk_used >= self.max_disk_bytes
+        if disk_full:
+            return
+        path = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        try:
+            ok = fetch(path)
+        except Exception as e:
+            print(f"[prefetch] {item.key[:80]} failed: {e}", flush=True)
+            ok = False
+        if not ok or not os.path.isfile(path):
+            _unlink(path)
+            return
+        size = os.path.getsize(path)
+        data = None
+        if size <= PREFETCH_MEMORY_ITEM_MAX_BYTES:
+            with open(path, "rb") as f:
+                data = f.read()
+
+        with self._lock:
+            if item.cancelled:
+                tier = None
+            elif data is not None and self._memory_used + size <= self.max_memory_bytes:
+                self._memory_used += size
+                item.data, item.size, tier = data, size, "memory"
+            elif self._disk_used + size <= self.max_disk_bytes:
+                self._disk_used += size
+                item.path, item.size, tier = path, size, "disk"
+            else:
+                tier = None
+                print(f"[prefetch] {item.key[:80]} ({size} bytes) over budget — dropped", flush=True)
+        if tier != "disk":
+            _unlink(path)
+        if tier is not None:
+            print(f"[prefetch] staged {item.key[:80]} ({size} bytes, {tier}) for job {item.job_id}", flush=True)
+
+    def _free_locked(self, item: _Staged) -> None:
+        if item.data is not None:
+            self._memory_used -= item.size
+            item.data = None
+        elif item.path is not None:
+            self._disk_used -= item.size
+            _unlink(item.path)
+            item.path = None
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -133,13 +133,27 @@ REASON_UNREADABLE = "UNREADABLE"
 # ── FaceAnalysis loader (singleton) ────────────────────────────────
 
 _ANALYSIS = None
+_ANALYSIS_PACK = "buffalo_l"
+# Identity-store model versions: subject references, and per-photo face hits
+# (which also depend on the detector input size and the pose model).
+IDENTITY_MODEL_VERSION = f"insightface/{_ANALYSIS_PACK}"
+FACE_HITS_VERSION = f"{IDENTITY_MODEL_VERSION}/det640/3d68"
 
 def _get_analysis() -> FaceAnalysis:
     global _ANALYSIS
     if _ANALYSIS is not None:
         return _ANALYSIS
+    from ort_sessions import session_options
+
     providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
-    app = FaceAnalysis(name="buffalo_l", providers=providers)
+    # Only what intake reads: bbox/score, ArcFace embedding, and pose (from 3D68).
+    # Skips genderage and the 2D106 landmark model on every photo.
+    app = FaceAnalysis(
+        name=_ANALYSIS_PACK,
+        providers=providers,
+        sess_options=session_options(),
+        allowed_modules=["detection", "recognition", "landmark_3d_68"],
+    )
     # det_size kept moderate — upstream photos are often 1024–2048 wide
     app.prepare(ctx_id=0, det_size=(640, 640))
     _ANALYSIS = app
@@ -268,6 +282,96 @@ def _build_reference(all_hits: list[tuple[Path, list[FaceHit]]]) -> np.ndarray |
     return _normalize(ref)
 
 
+# ── Persistent reference (identity_store) ─────────────────────────
+
+def _file_digests(files: list[Path]) -> dict[Path, str]:
+    digests = {}
+    for p in files:
+        try:
+            digests[p] = hashlib.sha256(p.read_bytes()).hexdigest()
+        except OSError:
+            continue
+    return digests
+
+
+def _stored_reference(subject_id: str | None, digests: list[str]) -> np.ndarray | None:
+    if not subject_id:
+        return None
+    try:
+        from identity_store import get_store
+        store = get_store()
+        if store is None:
+            return None
+        return store.get(f"subject:{subject_id}", model_version=IDENTITY_MODEL_VERSION, source_hashes=digests)
+    except Exception as e:
+        print(f"[intake] identity store read failed: {e}", file=sys.stderr)
+        return None
+
+
+def _save_reference(subject_id: str | None, digests: list[str], reference: np.ndarray) -> None:
+    if not subject_id:
+        return
+    try:
+        from identity_store import get_store
+        store = get_store()
+        if store is not None:
+            store.put(f"subject:{subject_id}", reference,
+                      model_version=IDENTITY_MODEL_VERSION, source_hashes=digests)
+    except Exception as e:
+        print(f"[intake] identity store write failed: {e}", file=sys.stderr)
+
+
+def _stored_hits(digests: list[str]) -> dict[str, list[FaceHit]]:
+    """
+    Face hits (box, pose, embedding) of earlier intakes, per photo digest: rows
+    face:<digest>:<i>, each carrying the photo's face count so partial sets miss.
+    Photos without faces are not stored (detection alone is cheap for them).
+    """
+    if not digests:
+        return {}
+    try:
+        from identity_store import get_store
+        store = get_store()
+        if store is None:
+            return {}
+        firsts = store.get_many([f"face:{d}:0" for d in digests], model_version=FACE_HITS_VERSION)
+        rest = [f"face:{rid.split(':')[1]}:{i}" for rid, rec in firsts.items()
+                for i in range(1, int(rec.meta.get("faces", 1)))]
+        records = {**firsts, **store.get_many(rest, model_version=FACE_HITS_VERSION)}
+    except Exception as e:
+        print(f"[intake] identity store read failed: {e}", file=sys.stderr)
+        return {}
+    hits: dict[str, list[FaceHit]] = {}
+    for d in digests:
+        first = records.get(f"face:{d}:0")
+        if first is None:
+            continue
+        recs = [records.get(f"face:{d}:{i}") for i in range(int(first.meta.get("faces", 1)))]
+        if any(r is None for r in recs):
+            continue
+        hits[d] = [FaceHit(
+            bbox=tuple(r.meta["bbox"]), score=r.meta["score"], yaw=r.meta["yaw"], pitch=r.meta["pitch"],
+            embedding=r.embedding, short_side=_face_short_side(tuple(r.meta["bbox"])),
+        ) for r in recs]
+    return hits
+
+
+def _save_hits(hits_by_digest: dict[str, list[FaceHit]]) -> None:
+    try:
+        from identity_store import IdentityRecord, get_store
+        store = get_store()
+        if store is None:
+            return
+        store.put_many([
+            IdentityRecord(f"face:{d}:{i}", h.embedding, [d], FACE_HITS_VERSION,
+                           {"faces": len(hits), "bbox": list(h.bbox), "score": h.score, "yaw": h.yaw,
+                            "pitch": h.pitch})
+            for d, hits in hits_by_digest.items() for i, h in enumerate(hits)
+        ])
+    except Exception as e:
+        print(f"[intake] identity store write failed: {e}", file=sys.stderr)
+
+
 # ── Crop + upscale ─────────────────────────────────────────────────
 
 def _expand_bbox(bbox: tuple[int, int, int, int], img_w: int, img_h: int, factor: float) -> tuple[int, int, int, int]:
@@ -333,8 +437,15 @@ def preprocess_folder(
     *,
     min_tiles: int = MIN_FILTERED_TILES,
     cosine_threshold: float = IDENTITY_COSINE_THRESHOLD,
+    subject_id: str | None = None,
 ) -> IntakeReport:
-    """Run preprocessing end-to-end. Writes accepted tiles into output_dir/tiles/."""
+    """Run preprocessing end-to-end. Writes accepted tiles into output_dir/tiles/.
+
+    With subject_id, the identity store is checked before detection: the reference
+    embedding is reused when it was built from this exact photo set, and photos
+    seen by an earlier intake reuse their face hits instead of re-running
+    detection + embedding. Both are written back on a miss.
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
     tiles_dir = output_dir / "tiles"
     tiles_dir.mkdir(exist_ok=True)
@@ -343,7 +454,13 @@ def preprocess_folder(
     decisions: list[FileDecision] = []
     rejection_counts: dict[str, int] = {}
 
-    # Pass 1: detect faces on every file
+    digests = _file_digests(files) if subject_id else {}
+    reference = _stored_reference(subject_id, list(digests.values()))
+    stored_hits = _stored_hits(list(digests.values()))
+    new_hits: dict[str, list[FaceHit]] = {}
+    reused = 0
+
+    # Pass 1: detect faces on every file (stored hits skip detection + embedding)
     detected: list[tuple[Path, np.ndarray, list[FaceHit], float]] = []
     for path in files:
         img = _load_bgr(path)
@@ -356,11 +473,26 @@ def preprocess_folder(
             rejection_counts[REASON_UNREADABLE] = rejection_counts.get(REASON_UNREADABLE, 0) + 1
             continue
         blur = _blur_score(img)
-        hits = _detect(img)
+        digest = digests.get(path)
+        hits = stored_hits.get(digest) if digest else None
+        if hits is not None:
+            reused += 1
+        else:
+            hits = _detect(img)
+            if digest and hits:
+                new_hits[digest] = hits
         detected.append((path, img, hits, blur))
+    if new_hits:
+        _save_hits(new_hits)
+    if digests:
+        print(f"[intake] face hits: {reused} from identity store, {len(detected) - reused} detected",
+              file=sys.stderr)
 
     # Pass 2: build reference embedding from top-K frontal faces
-    reference = _build_reference([(p, h) for (p, _img, h, _b) in detected])
+    if reference is None:
+        reference = _build_reference([(p, h) for (p, _img, h, _b) in detected])
+        if reference is not None:
+            _save_reference(subject_id, list(digests.values()), reference)
     ref_sha = hashlib.sha1(reference.tobytes()).hexdigest() if reference is not None else None
 
     if reference is None:
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+INT8 variants of the swap / restore ONNX models for CPU-only nodes.
+
+    python worker/quantize_models.py --model /app/models/hyperswap_1c_256.onnx \
+        --kind hyperswap --mode static --faces ./calib_faces
+
+Writes <name>.int8.onnx next to the fp32 model (or under --out-dir), which
+face_swap picks up with FACE_SWAP_MODEL_TIER=int8 (or auto on CPU-only hosts).
+
+  dynamic  weights quantized ahead of time, activations at run time; no data
+           needed, but Conv-heavy graphs gain little
+  static   QDQ weights + activations, calibrated on aligned crops built from
+           --faces (detected, aligned and preprocessed exactly as face_swap does)
+
+Accuracy gate: the int8 model is run against fp32 on held-out crops; PSNR of
+the output crops and, for swap models, ArcFace cosine between the fp32 and int8
+outputs must clear --min-psnr / --min-cosine or the file is not kept.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+KINDS = ("hyperswap", "inswapper", "gfpgan")
+_CROP = {"hyperswap": 256, "inswapper": 128, "gfpgan": 512}
+
+
+def int8_path(model_path: str, out_dir: str | None = None) -> str:
+    base = os.path.basename(model_path).replace(".onnx", ".int8.onnx")
+    return os.path.join(out_dir or os.path.dirname(model_path), base)
+
+
+# ── Calibration / evaluation samples ─────────────────────────────────
+
+def load_faces(folder: str, limit: int = 0) -> list[tuple[np.ndarray, object]]:
+    """(image, largest face with kps + normed_embedding) for each usable photo."""
+    import face_swap
+    from bench_utils import load_images
+
+    samples = []
+    for name, img in load_images(folder, limit):
+        faces = face_swap._detect_faces(img, "embed")
+        if faces:
+            samples.append((img, face_swap._largest_face(faces)))
+        else:
+            print(f"[quantize] {name}: no face — skipped", file=sys.stderr)
+    if len(samples) < 2:
+        raise SystemExit("need at least two photos with a detectable face")
+    return samples
+
+
+def _inswapper_emap(model_path: str) -> np.ndarray:
+    import onnx
+    from onnx import numpy_helper
+
+    return numpy_helper.to_array(onnx.load(model_path).graph.initializer[-1])
+
+
+def _carry_emap(model_path: str, out_path: str) -> None:
+    """insightface reads inswapper's emap as the *last* initializer; the quantizer
+    drops or reorders it (no node consumes it), so append the fp32 one again."""
+    import onnx
+
+    emap = onnx.load(model_path).graph.initializer[-1]
+    out = onnx.load(out_path)
+    kept = [t for t in out.graph.initializer if t.name != emap.name]
+    del out.graph.initializer[:]
+    out.graph.initializer.extend(kept + [emap])
+    onnx.save(out, out_path)
+
+
+def _crop(kind: str, img: np.ndarray, face) -> np.ndarray:
+    """BGR uint8 crop exactly as face_swap feeds it to the model."""
+    import face_swap
+
+    size = _CROP[kind]
+    if kind == "gfpgan":
+        x1, y1, x2, y2 = face_swap._restore_roi(face.bbox, img.shape)
+        return cv2.resize(img[y1:y2, x1:x2], (size, size), interpolation=cv2.INTER_LANCZOS4)
+    aligned, _M = face_swap._align_face_to_template(img, face.kps, face_swap._SWAP_SPECS[kind]["template"], size)
+    return aligned
+
+
+def _blob(kind: str, crop: np.ndarray) -> np.ndarray:
+    rgb = crop[:, :, ::-1].astype(np.float32) / 255.0
+    if kind != "inswapper":
+        rgb = (rgb - 0.5) / 0.5
+    return np.ascontiguousarray(rgb.transpose(2, 0, 1)[np.newaxis])
+
+
+def _decode(kind: str, out: np.ndarray) -> np.ndarray:
+    img = out[0].transpose(1, 2, 0)
+    img = img * 255.0 if kind == "inswapper" else (img + 1) * 127.5
+    return np.ascontiguousarray(np.clip(img, 0, 255).astype(np.uint8)[:, :, ::-1])
+
+
+def build_feeds(kind: str, model_path: str, session, samples) -> list[dict[str, np.ndarray]]:
+    """One feed dict per sample; swap models get the next sample's identity as source."""
+    emap = _inswapper_emap(model_path) if kind == "inswapper" else None
+    feeds = []
+    for i, (img, face) in enumerate(samples):
+        feed = {}
+        for inp in session.get_inputs():
+            if len(inp.shape) == 2:
+                emb = samples[(i + 1) % len(samples)][1].normed_embedding.reshape(1, -1).astype(np.float32)
+                if emap is not None:
+                    emb = emb @ emap
+                    emb = emb / np.linalg.norm(emb)
+                feed[inp.name] = emb.astype(np.float32)
+            else:
+                feed[inp.name] = _blob(kind, _crop(kind, img, face))
+        feeds.append(feed)
+    return feeds
+
+
+class _FeedReader:
+    """CalibrationDataReader over precomputed feeds."""
+
+    def __init__(self, feeds):
+        self._it = iter(feeds)
+
+    def get_next(self):
+        return next(self._it, None)
+
+
+# ── Quantization ─────────────────────────────────────────────────────
+
+def quantize(model_path: str, out_path: str, mode: str, calib_feeds=None, per_channel: bool = True,
+             kind: str | None = None) -> None:
+    from onnxruntime.quantization import (CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_dynamic, quantize_static)
+
+    src = model_path
+    pre = out_path + ".pre.onnx"
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        quant_pre_process(model_path, pre)
+        src = pre
+    except Exception as e:
+        print(f"[quantize] pre-process skipped: {e}", file=sys.stderr)
+
+    try:
+        if mode == "dynamic":
+            quantize_dynamic(src, out_path, weight_type=QuantType.QInt8, per_channel=per_channel)
+        else:
+            quantize_static(
+                src, out_path, _FeedReader(calib_feeds),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=per_channel,
+                calibrate_method=CalibrationMethod.MinMax,
+            )
+    finally:
+        if src == pre and os.path.isfile(pre):
+            os.remove(pre)
+    if kind == "inswapper":
+        _carry_emap(model_path, out_path)
+
+
+# ── Accuracy evaluation ──────────────────────────────────────────────
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = float(np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2))
+    return 99.0 if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def _identity(crops: list[np.ndarray]) -> np.ndarray:
+    """ArcFace embeddings of aligned swap outputs (arcface_128 layout → 112 crop)."""
+    import face_swap
+
+    rec = face_swap._get_face_app("embed").models["recognition"]
+    aligned = []
+    for c in crops:
+        c128 = cv2.resize(c, (128, 128), interpolation=cv2.INTER_AREA) if c.shape[0] != 128 else c
+        aligned.append(np.ascontiguousarray(c128[:112, 8:120]))
+    emb = rec.get_feat(aligned)
+    return emb / np.linalg.norm(emb, axis=1, keepdims=True)
+
+
+def evaluate(kind: str, ref_session, test_session, feeds) -> dict:
+    """Latency of both sessions plus output agreement of test against ref."""
+    ref_t, test_t, psnrs, ref_out, test_out = [], [], [], [], []
+    for feed in feeds:
+        t0 = time.perf_counter()
+        a = _decode(kind, ref_session.run(None, feed)[0])
+        ref_t.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        b = _decode(kind, test_session.run(None, feed)[0])
+        test_t.append(time.perf_counter() - t0)
+        psnrs.append(psnr(a, b))
+        ref_out.append(a)
+        test_out.append(b)
+
+    result = {
+        "samples": len(feeds),
+        "ref_ms_p50": round(float(np.median(ref_t)) * 1000, 2),
+        "test_ms_p50": round(float(np.median(test_t)) * 1000, 2),
+        "speedup_p50": round(float(np.median(ref_t) / max(np.median(test_t), 1e-9)), 2),
+        "psnr_mean": round(float(np.mean(psnrs)), 2),
+        "psnr_min": round(float(np.min(psnrs)), 2),
+    }
+    if kind in ("hyperswap", "inswapper"):
+        cos = np.sum(_identity(ref_out) * _identity(test_out), axis=1)
+        result["identity_cosine_mean"] = round(float(cos.mean()), 4)
+        result["identity_cosine_min"] = round(float(cos.min()), 4)
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Quantize swap / restore ONNX models to INT8")
+    ap.add_argument("--model", required=True, help="fp32 .onnx model")
+    ap.add_argument("--kind", required=True, choices=KINDS)
+    ap.add_argument("--mode", default="static", choices=("static", "dynamic"))
+    ap.add_argument("--faces", required=True, help="Folder of face photos (calibration + held-out eval)")
+    ap.add_argument("--limit", type=int, default=64)
+    ap.add_argument("--holdout", type=float, default=0.25, help="Fraction of faces kept for evaluation")
+    ap.add_argument("--out-dir", default=None)
+    ap.add_argument("--no-per-channel", action="store_true")
+    ap.add_argument("--min-psnr", type=float, default=28.0)
+    ap.add_argument("--min-cosine", type=float, default=0.95)
+    ap.add_argument("--force", action="store_true", help="Keep the int8 model even if the gate fails")
+    args = ap.parse_args()
+
+    import json
+    from ort_sessions import create_session
+
+    cpu = ["CPUExecutionProvider"]
+    samples = load_faces(args.faces, args.limit)
+    n_eval = max(1, int(len(samples) * args.holdout))
+    calib, held_out = samples[n_eval:] or samples, samples[:n_eval]
+
+    ref = create_session(args.model, cpu)
+    out_path = int8_path(args.model, args.out_dir)
+    t0 = time.time()
+    quantize(args.model, out_path, args.mode,
+             calib_feeds=build_feeds(args.kind, args.model, ref, calib) if args.mode == "static" else None,
+             per_channel=not args.no_per_channel, kind=args.kind)
+    print(f"[quantize] {args.mode} int8 → {out_path} ({time.time()-t0:.1f}s)", file=sys.stderr)
+
+    test = create_session(out_path, cpu)
+    report = evaluate(args.kind, ref, test, build_feeds(args.kind, args.model, ref, held_out))
+    passed = report["psnr_mean"] >= args.min_psnr and report.get("identity_cosine_mean", 1.0) >= args.min_cosine
+    report.update({"model": args.model, "int8": out_path, "mode": args.mode, "gate_passed": passed,
+                   "fp32_mb": round(os.path.getsize(args.model) / 1e6, 1),
+                   "int8_mb": round(os.path.getsize(out_path) / 1e6, 1)})
+    print(json.dumps(report, indent=2))
+
+    if not passed and not args.force:
+        os.remove(out_path)
+        print(f"[quantize] accuracy gate failed — removed {out_path}", file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
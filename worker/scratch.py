@@ -0,0 +1,136 @@
+"""
+Per-job scratch space: RAM-backed (tmpfs / /dev/shm) up to a budget, spilling to
+the container disk beyond it.
+
+Container disks on the GPU hosts are network volumes, so small jobs used to spend
+most of their wall time in temp-file I/O. Usage:
+
+    with job_scratch("ot_swap_") as scratch:
+        src = scratch.path("source_0.jpg")
+        tiles = scratch.dir("preproc", size_hint=64 * 1024 * 1024)
+
+path()/dir() place the entry in RAM when the bytes already written to this
+process's RAM scratch plus size_hint fit SCRATCH_RAM_BUDGET_BYTES (and the tmpfs
+has room), otherwise on disk; disk_path() always places on disk, for files whose
+size isn't known up front. Both roots are removed when the block exits.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+SCRATCH_RAM_BUDGET_BYTES = int(os.environ.get("SCRATCH_RAM_BUDGET_BYTES", str(2 * 1024 * 1024 * 1024)))
+SCRATCH_RAM_ROOT = os.environ.get("SCRATCH_RAM_ROOT", "/dev/shm")
+SCRATCH_DISK_ROOT = os.environ.get("SCRATCH_DISK_ROOT") or tempfile.gettempdir()
+SCRATCH_RAM_HEADROOM_BYTES = 256 * 1024 * 1024  # always leave this much tmpfs free
+
+_active: set["JobScratch"] = set()
+_active_lock = threading.Lock()
+
+
+def _dir_bytes(root: str) -> int:
+    total = 0
+    for dirpath, _dirs, files in os.walk(root):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _ram_available() -> bool:
+    return SCRATCH_RAM_BUDGET_BYTES > 0 and os.path.isdir(SCRATCH_RAM_ROOT) and os.access(SCRATCH_RAM_ROOT, os.W_OK)
+
+
+class JobScratch:
+    def __init__(self, prefix: str = "ot_job_"):
+        self.prefix = prefix
+        self._ram_dir: Optional[str] = None
+        self._disk_dir: Optional[str] = None
+        self._reserved = 0  # size hints handed out for RAM entries
+
+    # ── placement ───────────────────────────────────────────────────
+
+    def path(self, name: str, size_hint: int = 0) -> str:
+        """Path for a scratch file; RAM-backed when it fits the budget."""
+        base = self._root_for(size_hint)
+        full = os.path.join(base, name)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        return full
+
+    def disk_path(self, name: str) -> str:
+        """Path for a scratch file that always goes to disk (unbounded size, e.g. video)."""
+        full = os.path.join(self._disk(), name)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        return full
+
+    def dir(self, name: str, size_hint: int = 0) -> str:
+        """Scratch directory; size_hint covers everything later written into it."""
+        full = os.path.join(self._root_for(size_hint), name)
+        os.makedirs(full, exist_ok=True)
+        return full
+
+    def _root_for(self, size_hint: int) -> str:
+        if self._fits_in_ram(size_hint):
+            self._reserved += size_hint
+            return self._ram()
+        if _ram_available():
+            print(f"[scratch] RAM budget exhausted — spilling {size_hint} bytes to {SCRATCH_DISK_ROOT}", flush=True)
+        return self._disk()
+
+    def _fits_in_ram(self, size_hint: int) -> bool:
+        if not _ram_available():
+            return False
+        with _active_lock:
+            used = sum(s.ram_bytes() for s in _active)
+        if used + size_hint > SCRATCH_RAM_BUDGET_BYTES:
+            return False
+        try:
+            st = os.statvfs(SCRATCH_RAM_ROOT)
+        except OSError:
+            return False
+        return st.f_bavail * st.f_frsize - size_hint > SCRATCH_RAM_HEADROOM_BYTES
+
+    def ram_bytes(self) -> int:
+        if self._ram_dir is None:
+            return 0
+        return max(_dir_bytes(self._ram_dir), self._reserved)
+
+    def _ram(self) -> str:
+        if self._ram_dir is None:
+            self._ram_dir = tempfile.mkdtemp(prefix=self.prefix, dir=SCRATCH_RAM_ROOT)
+        return self._ram_dir
+
+    def _disk(self) -> str:
+        if self._disk_dir is None:
+            self._disk_dir = tempfile.mkdtemp(prefix=self.prefix, dir=SCRATCH_DISK_ROOT)
+        return self._disk_dir
+
+    # ── lifecycle ───────────────────────────────────────────────────
+
+    def cleanup(self) -> None:
+        with _active_lock:
+            _active.discard(self)
+        for d in (self._ram_dir, self._disk_dir):
+            if d:
+                shutil.rmtree(d, ignore_errors=True)
+        self._ram_dir = self._disk_dir = None
+        self._reserved = 0
+
+    def __enter__(self) -> "JobScratch":
+        with _active_lock:
+            _active.add(self)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cleanup()
+
+
+@contextmanager
+def job_scratch(prefix: str = "ot_job_") -> Iterator[JobScratch]:
+    with JobScratch(prefix) as scratch:
+        yield scratch
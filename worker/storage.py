@@ -1,10 +1,23 @@
 """
 Supabase storage: download from uploads bucket or URL, upload to model_artifacts or uploads.
 Uses SUPABASE_SERVICE_ROLE_KEY only.
+Downloads are hedged against slow connections and retried with jittered backoff,
+and go through a shared read-through disk cache revalidated with ETag/Last-Modified.
 """
 
+import fcntl
+import hashlib
+import json
 import os
-from typing import List, Optional
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, TypeVar
+from urllib.parse import urlparse
 
 try:
     import requests
@@ -18,8 +31,341 @@ except ImportError:
     Client = None
 
 
+# ---------------------------------------------------------------------------
+# Hedged + retried fetches
+#
+# A stalled connection used to hold a job for the full timeout. Every fetch now
+# goes through _fetch(): the first attempt is hedged by a second identical
+# request once it has been outstanding longer than the host's observed p95, and
+# the first success wins. Failed attempts are retried with full-jitter
+# exponential backoff. Large transfers (caller flag, cached size or a
+# Content-Length above HEDGE_MAX_BYTES) are never duplicated: a second copy
+# would double the bandwidth and the in-memory payload of an already slow fetch.
+# ---------------------------------------------------------------------------
+
+T = TypeVar("T")
+
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_BACKOFF_BASE_SEC = float(os.environ.get("DOWNLOAD_BACKOFF_BASE_SEC", "0.25"))
+DOWNLOAD_BACKOFF_MAX_SEC = float(os.environ.get("DOWNLOAD_BACKOFF_MAX_SEC", "4.0"))
+HEDGE_ENABLED = os.environ.get("DOWNLOAD_HEDGE", "1") != "0"
+HEDGE_MIN_DELAY_SEC = float(os.environ.get("DOWNLOAD_HEDGE_MIN_DELAY_SEC", "0.2"))
+HEDGE_DEFAULT_DELAY_SEC = float(os.environ.get("DOWNLOAD_HEDGE_DEFAULT_DELAY_SEC", "2.0"))
+HEDGE_MAX_BYTES = int(os.environ.get("DOWNLOAD_HEDGE_MAX_BYTES", str(32 * 1024 * 1024)))
+HEDGE_MIN_SAMPLES = 20       # below this, use HEDGE_DEFAULT_DELAY_SEC
+HEDGE_WINDOW = 200           # latency samples kept per host
+
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fetch")
+
+
+class _HostLatency:
+    """Rolling per-host latency samples; p95 sets the hedge delay.
+
+    Only successful attempts are sampled: stalls that run into the timeout
+    would drag p95 up to the timeout (no hedge ever fires for exactly the
+    hosts that stall), and fast 404s / resets would drag it down. Failures
+    are counted separately.
+    """
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._window = window
+        self._samples: dict[str, deque] = {}
+        self._failures: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, host: str, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            if not ok:
+                self._failures[host] = self._failures.get(host, 0) + 1
+                return
+            q = self._samples.get(host)
+            if q is None:
+                q = self._samples[host] = deque(maxlen=self._window)
+            q.append(seconds)
+
+    def p95(self, host: str) -> Optional[float]:
+        with self._lock:
+            q = self._samples.get(host)
+            if not q or len(q) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(q)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def hedge_delay(self, host: str, timeout: float) -> float:
+        p95 = self.p95(host)
+        delay = HEDGE_DEFAULT_DELAY_SEC if p95 is None else p95
+        return max(HEDGE_MIN_DELAY_SEC, min(delay, timeout))
+
+    def snapshot(self) -> dict[str, dict]:
+        """Per-host sample count, failure count and p95 (seconds), for logging/diagnostics."""
+        with self._lock:
+            counts = {h: (len(self._samples.get(h, ())), self._failures.get(h, 0))
+                      for h in set(self._samples) | set(self._failures)}
+        return {h: {"samples": n, "failures": failed, "p95": self.p95(h)} for h, (n, failed) in counts.items()}
+
+
+host_latency = _HostLatency()
+
+
+def _timed(host: str, fn: Callable[[], T], large: Optional[threading.Event] = None) -> T:
+    """fn() with its latency recorded for host; large transfers are not sampled."""
+    t0 = time.monotonic()
+    ok = False
+    try:
+        result = fn()
+        ok = True
+        return result
+    finally:
+        if large is None or not large.is_set():
+            host_latency.record(host, time.monotonic() - t0, ok=ok)
+
+
+def _hedged(host: str, fn: Callable[[], T], timeout: float, large: Optional[threading.Event] = None) -> T:
+    """Run fn; if it has not finished after the host's p95, race a second copy.
+
+    The losing attempt is left to finish in the background (requests cannot be
+    cancelled mid-flight); its result is discarded. No copy is raced once
+    large is set (by the caller up front, or by fn on seeing a big
+    Content-Length).
+    """
+    if not HEDGE_ENABLED or (large is not None and large.is_set()):
+        return _timed(host, fn, large)
+    primary = _hedge_pool.submit(_timed, host, fn, large)
+    delay = host_latency.hedge_delay(host, timeout)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    if large is not None and large.is_set():
+        return primary.result()
+
+    print(f"[fetch] hedging {host} after {delay:.2f}s", flush=True)
+    pending = {primary, _hedge_pool.submit(_timed, host, fn, large)}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            exc = fut.exception()
+            if exc is None:
+                return fut.result()
+            error = exc
+    raise error
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return status >= 500 or status in (408, 429)
+    text = str(exc).lower()
+    if "404" in text or "not found" in text or "not_found" in text:
+        return False
+    return True
+
+
+def _fetch(label: str, host: str, fn: Callable[[], T], timeout: float,
+           large: Optional[threading.Event] = None) -> T:
+    """Hedged fetch with jittered exponential retries. Raises the last error."""
+    attempt = 0
+    while True:
+        try:
+            return _hedged(host, fn, timeout, large)
+        except Exception as e:
+            if attempt >= DOWNLOAD_RETRIES or not _is_retryable(e):
+                raise
+            backoff = random.uniform(0, min(DOWNLOAD_BACKOFF_MAX_SEC, DOWNLOAD_BACKOFF_BASE_SEC * (2 ** attempt)))
+            attempt += 1
+            print(f"[fetch] {label[:120]} attempt {attempt} failed ({e}); retrying in {backoff:.2f}s", flush=True)
+            time.sleep(backoff)
+
+
+# ---------------------------------------------------------------------------
+# Read-through disk cache
+#
+# Scenario images, subject photos and LoRA artifacts recur across jobs. Entries
+# are keyed by object path (bucket/path for Supabase URLs, whatever the signing
+# token) or by the full URL otherwise, revalidated with If-None-Match /
+# If-Modified-Since, and evicted LRU (by mtime, touched on every hit) once the
+# directory exceeds STORAGE_CACHE_MAX_BYTES. Writes are atomic renames and the
+# directory is guarded by an flock, so several worker processes can share it.
+# ---------------------------------------------------------------------------
+
+STORAGE_CACHE_DIR = os.environ.get("STORAGE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "ot_storage_cache")
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get("STORAGE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+_SUPABASE_OBJECT_RE = re.compile(r"/storage/v1/object/(?:sign/|public/|authenticated/)?([^/]+)/(.+)$")
+
+
+class _DiskCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        if self.enabled:
+            try:
+                os.makedirs(root, exist_ok=True)
+            except OSError as e:
+                print(f"[cache] disabled: {e}", flush=True)
+                self.enabled = False
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        h = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, h + ".bin"), os.path.join(self.root, h + ".json")
+
+    def _lock(self, exclusive: bool):
+        f = open(os.path.join(self.root, ".lock"), "a+")
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return f
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """Cached validators for key, or None on miss/corrupt entry."""
+        if not self.enabled:
+            return None
+        blob, meta_path = self._paths(key)
+        with self._lock(exclusive=False):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                if os.path.getsize(blob) != meta.get("size"):
+                    return None
+            except (OSError, ValueError):
+                return None
+        return meta
+
+    def read(self, key: str) -> Optional[bytes]:
+        """Cached bytes for key (marks the entry as recently used)."""
+        blob, _ = self._paths(key)
+        with self._lock(exclusive=False):
+            try:
+                with open(blob, "rb") as f:
+                    data = f.read()
+                os.utime(blob)
+            except OSError:
+                return None
+        return data
+
+    def store(self, key: str, data: bytes, etag: Optional[str], last_modified: Optional[str]) -> None:
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        blob, meta_path = self._paths(key)
+        meta = {"key": key, "size": len(data), "etag": etag, "last_modified": last_modified}
+        try:
+            fd, tmp_blob = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            fd, tmp_meta = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(meta, f)
+            with self._lock(exclusive=True):
+                os.replace(tmp_blob, blob)
+                os.replace(tmp_meta, meta_path)
+                self._evict_locked()
+        except OSError as e:
+            print(f"[cache] store {key[:120]} failed: {e}", flush=True)
+
+    def _evict_locked(self) -> None:
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            for p in (path, path[:-4] + ".json"):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+
+
+disk_cache = _DiskCache(STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES)
+
+
+def _cache_key(url: str) -> str:
+    """bucket/path for Supabase storage URLs (signed or public), else the URL."""
+    m = _SUPABASE_OBJECT_RE.search(urlparse(url).path)
+    if m:
+        return f"{m.group(1)}/{m.group(2)}"
+    return url
+
+
+def _large_flag(hedge: bool, expected_size: Optional[int]) -> threading.Event:
+    """Event that disables hedging: set up front when the caller or a cached size says so."""
+    large = threading.Event()
+    if not hedge or (expected_size or 0) > HEDGE_MAX_BYTES:
+        large.set()
+    return large
+
+
+def _get_body(url: str, headers: dict, timeout: float, large: threading.Event):
+    """GET whose body is read after the headers, flagging large once Content-Length is known."""
+    r = requests.get(url, headers=headers, timeout=timeout, stream=True)
+    if int(r.headers.get("content-length") or 0) > HEDGE_MAX_BYTES:
+        large.set()
+    _ = r.content  # read the body inside the timed / hedged attempt
+    return r
+
+
+def _cached_get(key: str, host: str, url: str, headers: dict, timeout: float, hedge: bool = True) -> bytes:
+    """Hedged/retried GET through the disk cache with conditional revalidation."""
+    cached = disk_cache.lookup(key)
+    req_headers = dict(headers)
+    if cached:
+        if cached.get("etag"):
+            req_headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            req_headers["If-Modified-Since"] = cached["last_modified"]
+    large = _large_flag(hedge, cached.get("size") if cached else None)
+
+    def _get():
+        r = _get_body(url, req_headers, timeout, large)
+        if r.status_code == 304 and cached:
+            return r
+        if r.status_code != 200:
+            print(f"[download] error body: {r.text[:500]}", flush=True)
+        r.raise_for_status()
+        return r
+
+    r = _fetch(url, host, _get, timeout, large)
+    if r.status_code == 304:
+        data = disk_cache.read(key)
+        if data is not None:
+            print(f"[cache] HIT (304) {key[:120]} ({len(data)} bytes)", flush=True)
+            return data
+        # Entry evicted between lookup and read: refetch unconditionally.
+        return _cached_get_unconditional(key, host, url, headers, timeout, hedge)
+    print(f"[download] status={r.status_code}, content-type={r.headers.get('content-type','?')}, length={len(r.content)}", flush=True)
+    disk_cache.store(key, r.content, r.headers.get("etag"), r.headers.get("last-modified"))
+    return r.content
+
+
+def _cached_get_unconditional(key: str, host: str, url: str, headers: dict, timeout: float,
+                              hedge: bool = True) -> bytes:
+    large = _large_flag(hedge, None)
+
+    def _get():
+        r = _get_body(url, headers, timeout, large)
+        r.raise_for_status()
+        return r
+
+    r = _fetch(url, host, _get, timeout, large)
+    disk_cache.store(key, r.content, r.headers.get("etag"), r.headers.get("last-modified"))
+    return r.content
+
+
 def download_from_url(url: str, dest_path: str, timeout: int = 30) -> bool:
-    """Download one file from HTTP(S) URL to local path."""
+    """Download one file from HTTP(S) URL to local path (cached, hedged, with retries)."""
     if not url or not url.strip().startswith("http"):
         print(f"[download] Invalid URL: {url}", flush=True)
         return False
@@ -29,13 +375,44 @@ def download_from_url(url: str, dest_path: str, timeout: int = 30) -> bool:
     try:
         clean_url = url.strip()
         print(f"[download] GET {clean_url[:120]}", flush=True)
-        r = requests.get(clean_url, timeout=timeout)
-        print(f"[download] status={r.status_code}, content-type={r.headers.get('content-type','?')}, length={len(r.content)}", flush=True)
-        if r.status_code != 200:
-            print(f"[download] error body: {r.text[:500]}", flush=True)
-        r.raise_for_status()
+        data = _cached_get(_cache_key(clean_url), urlparse(clean_url).netloc, clean_url, {}, timeout)
         with open(dest_path, "wb") as f:
-            f.write(r.content)
+            f.write(data)
+        return True
+    except Exception as e:
+        print(f"[download] FAILED {url[:120]}: {e}", flush=True)
+        return False
+
+
+def download_stream_to_file(url: str, dest_path: str, timeout: int = 60, chunk_size: int = 1024 * 1024) -> bool:
+    """Stream a large file (e.g. a video clip) from an HTTP(S) URL straight to dest_path.
+
+    Retried like every fetch, but never hedged and never cached: memory stays at
+    one chunk and the disk cache keeps its room for models and LoRAs.
+    """
+    if not url or not url.strip().startswith("http"):
+        print(f"[download] Invalid URL: {url}", flush=True)
+        return False
+    if not requests:
+        print("[download] requests module not available", flush=True)
+        return False
+    clean_url = url.strip()
+
+    def _get() -> int:
+        written = 0
+        with requests.get(clean_url, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            with open(dest_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+        return written
+
+    try:
+        print(f"[download] STREAM {clean_url[:120]}", flush=True)
+        t0 = time.time()
+        written = _fetch(clean_url, urlparse(clean_url).netloc, _get, timeout, _large_flag(False, None))
+        print(f"[download] streamed {written} bytes in {time.time()-t0:.1f}s", flush=True)
         return True
     except Exception as e:
         print(f"[download] FAILED {url[:120]}: {e}", flush=True)
@@ -53,13 +430,44 @@ def get_supabase() -> Optional["Client"]:
     return create_client(url, key)
 
 
-def download_from_uploads(object_path: str, dest_path: str) -> bool:
-    """Download one file from uploads bucket to local path."""
+def _download_bucket(bucket: str, object_path: str, timeout: float = 60, hedge: bool = True) -> Optional[bytes]:
+    """Hedged + retried bucket download; None when storage is not configured.
+
+    Uses the storage REST endpoint (through the disk cache) when the service key
+    is available, else the SDK. Latency is tracked per host+bucket so large
+    model_artifacts downloads do not skew the uploads hedge threshold.
+    hedge=False (model_artifacts: LoRA weights) never races a second copy.
+    """
+    supabase_url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL") or os.environ.get("SUPABASE_URL", "")
+    service_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
+    host = f"{urlparse(supabase_url).netloc}/{bucket}"
+    if supabase_url and service_key and requests:
+        return _cached_get(
+            f"{bucket}/{object_path}",
+            host,
+            f"{supabase_url.rstrip('/')}/storage/v1/object/{bucket}/{object_path}",
+            {"Authorization": f"Bearer {service_key}"},
+            timeout,
+            hedge,
+        )
     sb = get_supabase()
     if not sb:
-        return False
+        return None
+    return _fetch(
+        f"{bucket}/{object_path}",
+        host,
+        lambda: sb.storage.from_(bucket).download(object_path),
+        timeout,
+        _large_flag(hedge, None),
+    )
+
+
+def download_from_uploads(object_path: str, dest_path: str) -> bool:
+    """Download one file from uploads bucket to local path."""
     try:
-        data = sb.storage.from_("uploads").download(object_path)
+        data = _download_bucket("uploads", object_path)
+        if data is None:
+            return False
         with open(dest_path, "wb") as f:
             f.write(data)
         return True
@@ -82,11 +490,10 @@ def download_many_from_uploads(object_paths: List[str], dest_dir: str) -> List[s
 
 def download_from_model_artifacts(storage_path: str, dest_path: str) -> bool:
     """Download one file from model_artifacts bucket to local path."""
-    sb = get_supabase()
-    if not sb:
-        return False
     try:
-        data = sb.storage.from_("model_artifacts").download(storage_path)
+        data = _download_bucket("model_artifacts", storage_path, hedge=False)
+        if data is None:
+            return False
         with open(dest_path, "wb") as f:
             f.write(data)
         return True
@@ -120,24 +527,36 @@ def upload_to_uploads(local_path: str, storage_path: str, content_type: str = "i
         instead of a generic "LoRA upload to Supabase failed".
     """
     import sys
-    supabase_url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL") or os.environ.get("SUPABASE_URL", "")
-    service_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
-
     size = os.path.getsize(local_path) if os.path.exists(local_path) else None
     print(f"[storage] upload_to_uploads: path={storage_path} local={local_path} size={size if size is not None else 'MISSING'}", flush=True)
     sys.stdout.flush()
 
     if size is None:
         return None, f"local file missing: {local_path}"
+    try:
+        with open(local_path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return None, f"exception: {type(e).__name__}: {str(e)[:200]}"
+    return upload_bytes_to_uploads(data, storage_path, content_type)
+
+
+def upload_bytes_to_uploads(data: bytes, storage_path: str, content_type: str = "image/jpeg") -> tuple[str | None, str | None]:
+    """Upload in-memory bytes to the uploads bucket (same REST path and return contract as upload_to_uploads).
+
+    Job outputs are encoded straight into memory and posted from there, so the
+    result never goes through a temp file or a base64 copy in the job response.
+    """
+    import sys
+    supabase_url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL") or os.environ.get("SUPABASE_URL", "")
+    service_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
+
     if not supabase_url or not service_key:
         return None, f"supabase env missing: url={'SET' if supabase_url else 'MISSING'} key={'SET' if service_key else 'MISSING'}"
     if not requests:
         return None, "requests module not available"
 
     try:
-        with open(local_path, "rb") as f:
-            data = f.read()
-
         upload_url = f"{supabase_url}/storage/v1/object/uploads/{storage_path}"
         print(f"[storage] upload_to_uploads: POST {upload_url} ({len(data)} bytes)", flush=True)
         sys.stdout.flush()
@@ -0,0 +1,231 @@
+"""
+Tiled Real-ESRGAN (RRDBNet) upscaling with a memory budget.
+
+RealESRGANer(tile=0) pushes the whole image through RRDBNet at once, so peak
+memory grows with the image and large inputs fail. This engine:
+
+  - splits the image into tiles whose size is derived from the memory budget
+    (whole-image pass when it fits)
+  - runs each tile with tile_pad pixels of surrounding context and keeps only
+    the tile's own region of the output, so there are no seams to blend
+  - runs tiles on a thread pool on CPU (torch releases the GIL inside ops;
+    small tiles alone do not saturate the cores), sequentially on GPU. The
+    budget is split between the concurrent tiles, and torch's intra-op threads
+    are split between the tile threads once at load (set_num_threads is
+    process-global) so they do not oversubscribe the cores
+
+Used by face_swap (post-swap x2) and generate_flux (post-generation upscale).
+
+    up = get_upscaler()            # None when weights / basicsr are missing
+    out = up.enhance(img_bgr, outscale=2)
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+UPSCALE_MEMORY_BUDGET_MB = int(os.environ.get("UPSCALE_MEMORY_BUDGET_MB", "0"))  # 0 = auto
+UPSCALE_TILE = int(os.environ.get("UPSCALE_TILE", "0"))  # 0 = from budget
+UPSCALE_TILE_PAD = int(os.environ.get("UPSCALE_TILE_PAD", "16"))
+UPSCALE_CPU_WORKERS = int(os.environ.get("UPSCALE_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+_CPU_DEFAULT_BUDGET_MB = 2048
+_GPU_BUDGET_FRACTION = 0.5  # of free device memory at load time
+
+# Conservative fp32 activation bytes per *input* pixel for RRDBNet(64 feat, 23
+# blocks). x2 weights pixel-unshuffle the input, so the body runs on a quarter
+# of the pixels. fp16 halves it. bench_upscale.py reports the real peaks.
+_BYTES_PER_PIXEL = {2: 6_000, 4: 12_000}
+_MIN_TILE, _MAX_TILE, _TILE_ALIGN = 128, 1024, 32
+
+_WEIGHT_NAMES = {2: "RealESRGAN_x2plus.pth", 4: "RealESRGAN_x4plus.pth"}
+_WEIGHT_DIRS = [
+    "/app/models",
+    "/workspace/ComfyUI/models/upscale_models",
+    os.path.expanduser("~/.cache/realesrgan"),
+    "weights",
+]
+
+
+def _log(msg: str) -> None:
+    print(msg, flush=True)
+
+
+class TiledUpscaler:
+    def __init__(self, model, scale: int, device, half: bool = False,
+                 tile: int = UPSCALE_TILE, tile_pad: int = UPSCALE_TILE_PAD,
+                 memory_budget_mb: int = UPSCALE_MEMORY_BUDGET_MB,
+                 cpu_workers: int = UPSCALE_CPU_WORKERS):
+        self.model = model
+        self.scale = scale
+        self.device = device
+        self.half = half
+        self.tile_pad = tile_pad
+        self.fixed_tile = tile
+        self.cpu_workers = max(1, cpu_workers)
+        self.budget_bytes = (memory_budget_mb or self._auto_budget_mb()) * 1024 * 1024
+        # x2 / x1 RRDBNet pixel-unshuffle the input: sides must be a multiple of 2 / 4
+        self._mod = {2: 2, 1: 4}.get(scale, 1)
+        self._lock = threading.Lock()  # GPU tiles run one at a time
+
+    def _auto_budget_mb(self) -> int:
+        if self.device.type == "cuda":
+            import torch
+            free, _total = torch.cuda.mem_get_info(self.device)
+            return max(256, int(free * _GPU_BUDGET_FRACTION / (1024 * 1024)))
+        return _CPU_DEFAULT_BUDGET_MB
+
+    # ── tiling ──────────────────────────────────────────────────────
+
+    def _concurrency(self) -> int:
+        return self.cpu_workers if self.device.type == "cpu" else 1
+
+    def tile_size(self, h: int, w: int) -> int:
+        """
+        Tile side for an h x w input; 0 means the whole image fits the budget.
+        Tiles run _concurrency() at a time, so each gets that share of it.
+        """
+        if self.fixed_tile:
+            return self.fixed_tile if max(h, w) > self.fixed_tile else 0
+        bpp = _BYTES_PER_PIXEL.get(self.scale, _BYTES_PER_PIXEL[4]) / (2 if self.half else 1)
+        if h * w <= self.budget_bytes / bpp:
+            return 0
+        max_pixels = self.budget_bytes / self._concurrency() / bpp
+        side = int(math.sqrt(max_pixels)) - 2 * self.tile_pad
+        side = side // _TILE_ALIGN * _TILE_ALIGN
+        return max(_MIN_TILE, min(_MAX_TILE, side))
+
+    def _tiles(self, h: int, w: int, tile: int):
+        for y in range(0, h, tile):
+            for x in range(0, w, tile):
+                yield x, y, min(x + tile, w), min(y + tile, h)
+
+    # ── inference ───────────────────────────────────────────────────
+
+    def _run(self, patch: np.ndarray) -> np.ndarray:
+        """RRDBNet on one BGR uint8 patch → BGR uint8 at self.scale."""
+        import torch
+
+        ph, pw = patch.shape[:2]
+        pad_h = (-ph) % self._mod
+        pad_w = (-pw) % self._mod
+        if pad_h or pad_w:
+            patch = cv2.copyMakeBorder(patch, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
+
+        t = torch.from_numpy(np.ascontiguousarray(patch[:, :, ::-1].transpose(2, 0, 1)))
+        t = t.unsqueeze(0).to(self.device)
+        t = (t.half() if self.half else t.float()) / 255.0
+        with torch.no_grad():
+            out = self.model(t)
+        out = out[0].float().clamp_(0, 1).mul_(255.0).round_().byte().cpu().numpy()
+        out = out.transpose(1, 2, 0)[:, :, ::-1]
+        return out[:ph * self.scale, :pw * self.scale]
+
+    def _run_tile(self, img: np.ndarray, out: np.ndarray, box: tuple[int, int, int, int]) -> None:
+        x1, y1, x2, y2 = box
+        h, w = img.shape[:2]
+        p = self.tile_pad
+        px1, py1 = max(0, x1 - p), max(0, y1 - p)
+        px2, py2 = min(w, x2 + p), min(h, y2 + p)
+        if self.device.type == "cuda":
+            with self._lock:
+                sr = self._run(img[py1:py2, px1:px2])
+        else:
+            sr = self._run(img[py1:py2, px1:px2])
+        s = self.scale
+        out[y1 * s:y2 * s, x1 * s:x2 * s] = sr[(y1 - py1) * s:(y2 - py1) * s, (x1 - px1) * s:(x2 - px1) * s]
+
+    def enhance(self, img: np.ndarray, outscale: float | None = None) -> np.ndarray:
+        """Upscale a BGR uint8 image; resized with Lanczos when outscale != model scale."""
+        t0 = time.time()
+        h, w = img.shape[:2]
+        tile = self.tile_size(h, w)
+        if tile == 0:
+            out = self._run(img)
+            tiles = 1
+        else:
+            out = np.empty((h * self.scale, w * self.scale, 3), dtype=np.uint8)
+            boxes = list(self._tiles(h, w, tile))
+            tiles = len(boxes)
+            if self._concurrency() > 1 and tiles > 1:
+                with ThreadPoolExecutor(max_workers=min(self.cpu_workers, tiles),
+                                        thread_name_prefix="esrgan") as pool:
+                    list(pool.map(lambda b: self._run_tile(img, out, b), boxes))
+            else:
+                for box in boxes:
+                    self._run_tile(img, out, box)
+
+        if outscale is not None and outscale != self.scale:
+            out = cv2.resize(out, (int(w * outscale), int(h * outscale)), interpolation=cv2.INTER_LANCZOS4)
+        _log(f"[upscaler] {w}x{h} → {out.shape[1]}x{out.shape[0]} tile={tile or 'full'} "
+             f"tiles={tiles} device={self.device.type} ({time.time()-t0:.2f}s)")
+        return out
+
+
+def find_weights(scale: int = 2) -> str | None:
+    """Real-ESRGAN weights for scale (x2plus preferred for 2, else x4plus)."""
+    names = [_WEIGHT_NAMES[scale]] if scale in _WEIGHT_NAMES else []
+    names += [n for n in _WEIGHT_NAMES.values() if n not in names]
+    try:
+        from model_registry import resolve
+        for name in names:
+            path = resolve(name)
+            if path:
+                return path
+    except ImportError:
+        pass
+    for name in names:
+        for d in _WEIGHT_DIRS:
+            p = os.path.join(d, name)
+            if os.path.isfile(p):
+                return p
+    return None
+
+
+def load_upscaler(model_path: str, **kwargs) -> TiledUpscaler:
+    import torch
+    from basicsr.archs.rrdbnet_arch import RRDBNet
+
+    scale = 2 if "x2" in os.path.basename(model_path).lower() else 4
+    model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=scale)
+    ckpt = torch.load(model_path, map_location="cpu")
+    model.load_state_dict(ckpt.get("params_ema", ckpt.get("params", ckpt)), strict=True)
+    model.eval()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    half = device.type == "cuda"
+    model = model.to(device)
+    if half:
+        model = model.half()
+    up = TiledUpscaler(model, scale, device, half=half, **kwargs)
+    if device.type == "cpu" and up.cpu_workers > 1:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // up.cpu_workers))
+    _log(f"[upscaler] RRDBNet x{scale} loaded from {model_path} on {device.type} "
+         f"(budget={up.budget_bytes // (1024 * 1024)}MB, pad={up.tile_pad}, "
+         f"threads={torch.get_num_threads()})")
+    return up
+
+
+_upscalers: dict[str, TiledUpscaler] = {}
+_upscalers_lock = threading.Lock()
+
+
+def get_upscaler(model_path: str | None = None, scale: int = 2) -> TiledUpscaler | None:
+    """Process-wide engine per weights file; None when weights or basicsr are missing."""
+    model_path = model_path or find_weights(scale)
+    if not model_path:
+        return None
+    with _upscalers_lock:
+        if model_path not in _upscalers:
+            try:
+                _upscalers[model_path] = load_upscaler(model_path)
+            except ImportError as e:
+                _log(f"[upscaler] basicsr/torch not available: {e}")
+                return None
+        return _upscalers[model_path]
@@ -0,0 +1,357 @@
+"""
+Streaming video face swap.
+
+Frames are never all in memory: a reader thread decodes into a bounded queue,
+the main thread detects / tracks / swaps in batches, and a writer thread
+encodes from a second bounded queue, so peak memory is set by VIDEO_QUEUE and
+VIDEO_BATCH rather than by clip length.
+
+Per frame, the target face comes from:
+  - full detection (face_swap._detect_faces) on keyframes — every
+    VIDEO_KEYFRAME_INTERVAL frames — and whenever tracking confidence drops
+    below VIDEO_TRACK_MIN_CONF
+  - otherwise Lucas–Kanade optical flow of the previous frame's kps and
+    106-point landmarks (forward–backward checked), on a downscaled luma copy
+
+Swap inference runs VIDEO_BATCH frames per swap-model call; each frame is then
+pasted and composited (VIDEO_BLEND_MODE, laplacian by default: steadier across
+frames than seamlessClone and cheaper), and restored in shared batches when
+VIDEO_RESTORE=1. No upscale. Audio is muxed back from the input with ffmpeg
+when it is on PATH (which also re-encodes to H.264 for browser playback).
+
+    ok = swap_video(source_paths, "in.mp4", "out.mp4", stats)
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import face_swap
+from face_swap import _log
+from scratch import job_scratch
+from storage import download_stream_to_file, upload_to_uploads
+
+VIDEO_KEYFRAME_INTERVAL = int(os.environ.get("VIDEO_KEYFRAME_INTERVAL", "12"))
+VIDEO_TRACK_MIN_CONF = float(os.environ.get("VIDEO_TRACK_MIN_CONF", "0.7"))
+VIDEO_TRACK_FB_FRAC = float(os.environ.get("VIDEO_TRACK_FB_FRAC", "0.02"))  # of face width
+VIDEO_TRACK_MAX_SIDE = int(os.environ.get("VIDEO_TRACK_MAX_SIDE", "640"))
+VIDEO_BATCH = int(os.environ.get("VIDEO_BATCH", "8"))
+VIDEO_QUEUE = int(os.environ.get("VIDEO_QUEUE", "16"))
+VIDEO_BLEND_MODE = os.environ.get("VIDEO_BLEND_MODE", "laplacian")
+VIDEO_RESTORE = os.environ.get("VIDEO_RESTORE", "1") == "1"
+VIDEO_MAX_FRAMES = int(os.environ.get("VIDEO_MAX_FRAMES", "0"))  # 0 = whole clip
+
+_LK = dict(winSize=(21, 21), maxLevel=3,
+           criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+_END = object()
+
+
+# ── Tracking ────────────────────────────────────────────────────────
+
+class _TrackedFace:
+    """Face geometry carried between keyframes (what compositing and restore read)."""
+
+    def __init__(self, bbox, kps, landmark_2d_106=None, det_score=0.0):
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.kps = np.asarray(kps, dtype=np.float32)
+        self.landmark_2d_106 = None if landmark_2d_106 is None else np.asarray(landmark_2d_106, dtype=np.float32)
+        self.landmark_3d_68 = None
+        self.det_score = det_score
+
+
+def _from_detection(face) -> _TrackedFace:
+    return _TrackedFace(face.bbox, face.kps, getattr(face, "landmark_2d_106", None),
+                        float(getattr(face, "det_score", 1.0)))
+
+
+def _small_gray(frame: np.ndarray) -> tuple[np.ndarray, float]:
+    h, w = frame.shape[:2]
+    s = min(1.0, VIDEO_TRACK_MAX_SIDE / max(h, w))
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if s < 1.0:
+        gray = cv2.resize(gray, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA)
+    return gray, s
+
+
+def _track(prev_gray: np.ndarray, gray: np.ndarray, scale: float, face: _TrackedFace) -> tuple[_TrackedFace | None, float]:
+    """Move face to the next frame with pyramidal LK → (face or None, confidence 0..1)."""
+    n_kps = len(face.kps)
+    pts = face.kps if face.landmark_2d_106 is None else np.concatenate([face.kps, face.landmark_2d_106])
+    p0 = (pts * scale).reshape(-1, 1, 2).astype(np.float32)
+    p1, st1, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, p0, None, **_LK)
+    if p1 is None:
+        return None, 0.0
+    p0r, st2, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, p1, None, **_LK)
+    fb = np.linalg.norm((p0r - p0).reshape(-1, 2), axis=1)
+    fb_max = max(1.0, VIDEO_TRACK_FB_FRAC * (face.bbox[2] - face.bbox[0]) * scale)
+    ok = (st1.ravel() == 1) & (st2.ravel() == 1) & (fb < fb_max)
+    conf = float(ok.mean())
+    if conf < VIDEO_TRACK_MIN_CONF or ok.sum() < 3:
+        return None, conf
+
+    old = p0.reshape(-1, 2)
+    new = p1.reshape(-1, 2).copy()
+    M, _inliers = cv2.estimateAffinePartial2D(old[ok], new[ok])
+    if M is None:
+        return None, 0.0
+    # Points that lost track follow the face's overall motion
+    new[~ok] = old[~ok] @ M[:, :2].T + M[:, 2]
+    new /= scale
+
+    x1, y1, x2, y2 = face.bbox * scale
+    corners = np.array([[x1, y1], [x2, y1], [x1, y2], [x2, y2]], dtype=np.float32) @ M[:, :2].T + M[:, 2]
+    corners /= scale
+    bbox = [corners[:, 0].min(), corners[:, 1].min(), corners[:, 0].max(), corners[:, 1].max()]
+    lmk = None if face.landmark_2d_106 is None else new[n_kps:]
+    return _TrackedFace(bbox, new[:n_kps], lmk, face.det_score), conf
+
+
+# ── Swap ────────────────────────────────────────────────────────────
+
+def _swap_batch(frames: list[np.ndarray], faces: list[_TrackedFace | None], source,
+                swap_kind: str, swap_model, restore: bool, stats: dict) -> list[np.ndarray]:
+    """Swap + composite (+ restore) a run of frames; frames without a face pass through."""
+    out = list(frames)
+    todo = [i for i, f in enumerate(faces) if f is not None]
+    if not todo:
+        return out
+
+    t0 = time.time()
+    swapped: dict[int, np.ndarray] = {}
+    aligned = {i: face_swap._swap_align(swap_kind, frames[i], faces[i]) for i in todo}
+    todo = [i for i in todo if aligned[i] is not None]
+    if todo:
+        preds = face_swap._swap_infer(swap_kind, swap_model, source, np.stack([aligned[i][0] for i in todo]),
+                                      chunk_size=len(todo))
+        for i, pred in zip(todo, preds):
+            swapped[i] = face_swap._swap_paste(frames[i], pred, aligned[i][1])
+    stats["swap_sec"] += time.time() - t0
+
+    t0 = time.time()
+    done = [i for i in todo if i in swapped]
+    for i in done:
+        out[i] = face_swap._composite(frames[i], faces[i], swapped[i], blend_mode=VIDEO_BLEND_MODE)
+    stats["composite_sec"] += time.time() - t0
+
+    if restore and done:
+        t0 = time.time()
+        restored = face_swap._restore_faces([out[i] for i in done], [[faces[i]] for i in done])
+        for i, img in zip(done, restored):
+            out[i] = img
+        stats["restore_sec"] += time.time() - t0
+    stats["swapped"] += len(done)
+    return out
+
+
+# ── Pipeline ────────────────────────────────────────────────────────
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Blocking put that gives up once stop is set (consumer gone)."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _reader(cap, q: queue.Queue, stop: threading.Event, errors: list, max_frames: int) -> None:
+    try:
+        n = 0
+        while not stop.is_set() and (not max_frames or n < max_frames):
+            ok, frame = cap.read()
+            if not ok or not _put(q, frame, stop):
+                break
+            n += 1
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _put(q, _END, stop)
+
+
+def _writer(writer, q: queue.Queue, errors: list) -> None:
+    try:
+        while True:
+            batch = q.get()
+            if batch is _END:
+                return
+            for frame in batch:
+                writer.write(frame)
+    except Exception as e:
+        errors.append(e)
+        while q.get() is not _END:  # drain so the producer never blocks
+            pass
+
+
+def _finalize(raw_path: str, input_path: str, out_path: str) -> None:
+    """H.264 + the input's audio via ffmpeg when available, else the raw mp4v file."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        cmd = [ffmpeg, "-y", "-loglevel", "error", "-i", raw_path, "-i", input_path,
+               "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "libx264", "-pix_fmt", "yuv420p",
+               "-preset", "veryfast", "-crf", "18", "-c:a", "copy", "-shortest", out_path]
+        try:
+            subprocess.run(cmd, check=True, timeout=1800)
+            return
+        except Exception as e:
+            _log(f"[video_swap] ffmpeg mux failed ({e}) — keeping raw mp4v")
+    shutil.move(raw_path, out_path)
+
+
+def swap_video(
+    source_paths: list[str],
+    video_path: str,
+    out_path: str,
+    stats: dict | None = None,
+    restore: bool = VIDEO_RESTORE,
+    max_frames: int = VIDEO_MAX_FRAMES,
+) -> bool:
+    """
+    Swap the identity from source_paths onto the largest face in every frame of
+    video_path. The mp4v intermediate is written next to out_path (out_path +
+    ".raw.mp4"), so out_path should be on disk scratch.
+    """
+    t_start = time.time()
+    stats = stats if stats is not None else {}
+    stats.update({"frames": 0, "keyframes": 0, "redetects": 0, "tracked": 0, "no_face": 0, "swapped": 0,
+                  "detect_sec": 0.0, "track_sec": 0.0, "swap_sec": 0.0, "composite_sec": 0.0,
+                  "restore_sec": 0.0})
+
+    try:
+        source = face_swap._SyntheticFace(face_swap._identity_for_sources(source_paths, stats))
+    except ValueError as e:
+        _log(f"[video_swap] FAIL: {e}")
+        return False
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        _log(f"[video_swap] FAIL: cannot open {video_path}")
+        return False
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    _log(f"[video_swap] ENTER: {w}x{h} @ {fps:.2f}fps, ~{total} frames, batch={VIDEO_BATCH}, "
+         f"keyframe every {VIDEO_KEYFRAME_INTERVAL}")
+
+    swap_kind, swap_model = face_swap._get_swapper()
+    raw_path = out_path + ".raw.mp4"
+    writer = cv2.VideoWriter(raw_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+    q_in: queue.Queue = queue.Queue(maxsize=VIDEO_QUEUE)
+    q_out: queue.Queue = queue.Queue(maxsize=max(1, VIDEO_QUEUE // max(1, VIDEO_BATCH)))
+    stop = threading.Event()
+    errors: list[Exception] = []
+    reader = threading.Thread(target=_reader, args=(cap, q_in, stop, errors, max_frames),
+                              name="video-read", daemon=True)
+    writer_thread = threading.Thread(target=_writer, args=(writer, q_out, errors), name="video-write", daemon=True)
+    reader.start()
+    writer_thread.start()
+
+    face: _TrackedFace | None = None
+    prev_gray = None
+    since_detect = VIDEO_KEYFRAME_INTERVAL  # detect on the first frame
+    frames, faces = [], []
+    try:
+        while True:
+            frame = q_in.get()
+            if frame is _END:
+                break
+            stats["frames"] += 1
+            gray, scale = _small_gray(frame)
+
+            need_detect = since_detect >= VIDEO_KEYFRAME_INTERVAL
+            if face is not None and not need_detect:
+                t0 = time.time()
+                tracked, _conf = _track(prev_gray, gray, scale, face)
+                stats["track_sec"] += time.time() - t0
+                if tracked is None:
+                    stats["redetects"] += 1
+                    need_detect = True
+                else:
+                    face = tracked
+                    stats["tracked"] += 1
+            if need_detect:
+                t0 = time.time()
+                found = face_swap._detect_faces(frame, "landmarks")
+                stats["detect_sec"] += time.time() - t0
+                stats["keyframes"] += 1
+                face = _from_detection(face_swap._largest_face(found)) if found else None
+                since_detect = 0
+            since_detect += 1
+            if face is None:
+                stats["no_face"] += 1
+            prev_gray = gray
+
+            frames.append(frame)
+            faces.append(face)
+            if len(frames) >= VIDEO_BATCH:
+                q_out.put(_swap_batch(frames, faces, source, swap_kind, swap_model, restore, stats))
+                frames, faces = [], []
+        if frames:
+            q_out.put(_swap_batch(frames, faces, source, swap_kind, swap_model, restore, stats))
+    finally:
+        stop.set()
+        q_out.put(_END)
+        writer_thread.join()
+        reader.join(timeout=5)
+        writer.release()
+        cap.release()
+
+    if errors:
+        _log(f"[video_swap] FAIL: {errors[0]}")
+        return False
+    if stats["frames"] == 0:
+        _log("[video_swap] FAIL: no frames decoded")
+        return False
+
+    _finalize(raw_path, video_path, out_path)
+    if os.path.exists(raw_path):
+        os.remove(raw_path)
+    elapsed = time.time() - t_start
+    for k in [k for k in stats if k.endswith("_sec")]:
+        stats[k] = round(stats[k], 3)
+    stats["total_sec"] = round(elapsed, 3)
+    stats["fps"] = round(stats["frames"] / elapsed, 2) if elapsed > 0 else 0.0
+    _log(f"[video_swap] DONE: {stats['frames']} frames ({stats['swapped']} swapped, "
+         f"{stats['keyframes']} detections, {stats['tracked']} tracked) in {elapsed:.1f}s = {stats['fps']} fps")
+    return True
+
+
+def do_video_swap(
+    user_photo_urls: list[str],
+    video_url: str,
+    output_path: str,
+    stats: dict | None = None,
+) -> dict | None:
+    """Download sources + clip, run swap_video, upload the result to uploads/<output_path>."""
+    stats = stats if stats is not None else {}
+    with job_scratch("ot_video_") as scratch:
+        source_paths = face_swap._download_sources(scratch, user_photo_urls, "do_video_swap")
+        if not source_paths:
+            _log("[do_video_swap] FAIL: all source downloads failed")
+            return None
+        ext = os.path.splitext(video_url.split("?")[0])[1] or ".mp4"
+        video_path = scratch.disk_path(f"input{ext}")
+        if not download_stream_to_file(video_url, video_path, timeout=120):
+            _log("[do_video_swap] FAIL: video download failed")
+            return None
+
+        # Clip, mp4v intermediate (output.mp4.raw.mp4) and final encode all
+        # grow with clip length, so they stay off the RAM-backed scratch.
+        out_local = scratch.disk_path("output.mp4")
+        if not swap_video(source_paths, video_path, out_local, stats):
+            return None
+        url, err = upload_to_uploads(out_local, output_path, content_type="video/mp4")
+        if not url:
+            _log(f"[do_video_swap] FAIL: upload failed: {err}")
+            return None
+        return {"output_path": output_path, "output_url": url, "bytes": os.path.getsize(out_local),
+                "content_type": "video/mp4"}